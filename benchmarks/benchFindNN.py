@@ -0,0 +1,61 @@
+"""
+Benchmark the neighbour search backends of findNN() on the bundled atomistic objects and synthetic systems.
+
+Usage: python benchmarks/benchFindNN.py [numCPUs]
+"""
+import sys
+from os.path import basename
+from time import perf_counter
+
+import numpy as np
+
+from sphractal.datasets import getExampleDataPath, getMiscellaneousDataPaths, getStrongScalingDataPath
+from sphractal.utils import findNN, readInp
+
+
+NUM_REPEATS = 5
+
+
+def genRandomSystem(numAtoms, density, aspectRatios, atomRad=1.4, seed=0):
+    """Generate uniformly random atoms with a given number density (atoms per cubic Angstrom) within a cuboid."""
+    sideLens = np.cbrt(numAtoms / density / np.prod(aspectRatios)) * np.array(aspectRatios, dtype=float)
+    atomsXYZ = np.random.default_rng(seed).random((numAtoms, 3)) * sideLens
+    return f"random rho={density} aspect={aspectRatios}", np.full(numAtoms, atomRad), atomsXYZ
+
+
+def timeBackend(atomsRad, atomsXYZ, backend, numCPUs):
+    """Return the shortest wall time of findNN() with a given backend among repeated runs, after a warm-up run."""
+    minXYZ, maxXYZ = atomsXYZ.min(axis=0), atomsXYZ.max(axis=0)
+    findNN(atomsRad, atomsXYZ, minXYZ, maxXYZ, atomsRad.max(), 1.2, True, numCPUs, backend=backend)
+    durations = []
+    for _ in range(NUM_REPEATS):
+        startTime = perf_counter()
+        findNN(atomsRad, atomsXYZ, minXYZ, maxXYZ, atomsRad.max(), 1.2, True, numCPUs, backend=backend)
+        durations.append(perf_counter() - startTime)
+    return min(durations)
+
+
+def main(numCPUs=1):
+    systems = []
+    for xyzFilePath in getMiscellaneousDataPaths() + [getExampleDataPath(), getStrongScalingDataPath()]:
+        _, atomsRad, atomsXYZ, _, _, _ = readInp(xyzFilePath)
+        systems.append((basename(xyzFilePath), atomsRad, atomsXYZ))
+    systems.append(genRandomSystem(40000, 0.08, (1, 1, 1)))  # Dense bulk
+    systems.append(genRandomSystem(40000, 0.08, (100, 1, 1)))  # Dense rod
+    systems.append(genRandomSystem(40000, 0.08, (30, 30, 0.01)))  # Thin sheet
+    systems.append(genRandomSystem(40000, 0.002, (1, 1, 1)))  # Dilute gas
+    systems.append(genRandomSystem(200000, 0.0005, (1, 1, 1)))  # Very dilute gas
+
+    print(f"{'system':42s} {'numAtoms':>9s} {'atoms/cell':>10s} {'cells (ms)':>11s} {'kdTree (ms)':>12s} {'auto':>7s}")
+    for (sysName, atomsRad, atomsXYZ) in systems:
+        stepSize = atomsRad.max() * 2 * 1.2
+        numCells = np.maximum(1, np.ceil((atomsXYZ.max(axis=0) - atomsXYZ.min(axis=0)) / stepSize)).prod()
+        cellsDuration = timeBackend(atomsRad, atomsXYZ, 'cells', numCPUs)
+        kdTreeDuration = timeBackend(atomsRad, atomsXYZ, 'kdTree', numCPUs)
+        autoBackend = 'kdTree' if len(atomsRad) < numCells else 'cells'
+        print(f"{sysName:42s} {len(atomsRad):9d} {len(atomsRad) / numCells:10.3f} {cellsDuration * 1e3:11.2f} "
+              f"{kdTreeDuration * 1e3:12.2f} {autoBackend:>7s}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1)
@@ -40,10 +40,11 @@ from importlib.metadata import version
 __version__ = version('sphractal')
 
 # Populate package namespace
-__all__ = ['constants', 'datasets', 'utils', 'surfVoxel', 'surfExact', 'boxCnt']
-from sphractal.constants import ATOMIC_RAD_DICT, METALLIC_RAD_DICT, PLT_PARAMS
+__all__ = ['constants', 'datasets', 'utils', 'cache', 'structure', 'surfVoxel', 'surfExact', 'boxCnt']
+from sphractal.constants import ATOMIC_RAD_DICT, METALLIC_RAD_DICT, ELE_SYMBOLS, PLT_PARAMS
 from sphractal.datasets import getExampleDataPath, getStrongScalingDataPath, getWeakScalingDataPaths, getValidationDataPath, getCaseStudyDataPaths, getMiscellaneousDataPaths
-from sphractal.utils import readInp, findNN, findSurf
+from sphractal.utils import readInp, readFrames, readLmp, encodeEles, decodeEles, findNN, csrNeighs, findSurf
+from sphractal.structure import AlphaComplex, Structure, VerletList
 from sphractal.surfVoxel import voxelBoxCnts
 from sphractal.surfExact import exactBoxCnts
-from sphractal.boxCnt import findSlope, runBoxCnt
+from sphractal.boxCnt import findSlope, runBoxCnt, runBoxCntTraj
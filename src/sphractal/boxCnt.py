@@ -7,8 +7,10 @@ from matplotlib.ticker import FormatStrFormatter
 import numpy as np
 from statsmodels.api import OLS, add_constant
 
+from sphractal.cache import getCacheKey, loadCache, saveCache
 from sphractal.constants import PLT_PARAMS
-from sphractal.utils import findNN, findSurf, readInp
+from sphractal.utils import getNpName, readFrames, readInp
+from sphractal.structure import Structure, VerletList
 from sphractal.surfVoxel import voxelBoxCnts
 from sphractal.surfExact import exactBoxCnts
 # from sphractal.utils import estDuration, annotate
@@ -166,22 +168,26 @@ def runBoxCnt(inpFilePath,
               radType='atomic', radMult=1.2, calcBL=False, findSurfAlg='alphaShape', alphaMult=2.0, bulkCN=12,
               outDir='outputs', trimLen=True, minSample=6, confLvl=95, 
               rmInSurf=True, vis=True, figType='paper', saveFig=False, showPlot=False, verbose=False,  
-              voxelSurf=True, numPoints=10000, gridNum=1024, fastbcPath='$FASTBC', genPCD=False,
-              exactSurf=True, minLenMult=0.25, maxLenMult=1, numCPUs=8, numBoxLen=10, bufferDist=5.0, writeBox=True): 
+              voxelSurf=True, numPoints=10000, gridNum=1024, fastbcPath=None, genPCD=False,
+              exactSurf=True, minLenMult=0.25, maxLenMult=1, numCPUs=8, numBoxLen=10, bufferDist=5.0, writeBox=True,
+              npName=None, cacheDir=None, cacheSize=2**30, typeEles=None, cellVecs=None, pbc=(True, True, True),
+              verletList=None, dtype=np.float64, probeRad=1.4, prefilterSurf=False, voxelAlg='pointCloud'): 
     """
     Run box-counting algorithm on the surface of a given atomistic object consisting of a set of spheres represented as either a voxelised point cloud or mathematically precise object.
     
     Parameters
     ----------
-    inpFilePath : str
-        Path to xyz file containing Cartesian coordinates of a set of atoms.
+    inpFilePath : Union[str, tuple, Structure]
+        Path to xyz file (optionally gzip, bzip2 or xz compressed) containing Cartesian coordinates of a set of atoms,
+        the outputs of readInp() for a set of atoms that has already been parsed, or a Structure whose memoised
+        neighbour list and surface atoms are reused (in which case the parameters for those stages are ignored).
     radType : {'atomic', 'metallic'}, optional
         Type of radii to use for the atoms.
     radMult : Union[int, float], optional
         Multiplier to the radii of atoms to identify their neighbouring atoms.
     calcBL : bool, optional
         Whether to compute the average distance from its neighbours for each atom.
-    findSurfAlg : {'alphaShape', 'convexHull', 'numNeigh'}, optional
+    findSurfAlg : {'alphaShape', 'convexHull', 'numNeigh', 'probeSphere'}, optional
         Algorithm to identify the surface atoms.
     alphaMult : Union[int, float], optional
         Multiplier to the minimum radius to decide 'alpha' value for the alpha shape algorithm, only used if
@@ -214,9 +220,10 @@ def runBoxCnt(inpFilePath,
     numPoints : int, optional
         Number of surface points to generate around each atom.
     gridNum : int, optional
-        Resolution of the 3D binary image.
+        Resolution of the 3D binary image, as a power of 2 up to 2^21.
     fastbcPath : str, optional
-        Path to the compiled C++ file for box-counting on 3D binary image written by Ruiz de Miras et al.
+        Path to the compiled C++ file for box-counting on 3D binary image written by Ruiz de Miras et al., the built-in
+        box-counting is used if None.
     genPCD : bool, optional
         Whether to generate point cloud data (pcd) file.
     exactSurf : bool, optional
@@ -233,6 +240,34 @@ def runBoxCnt(inpFilePath,
         Buffer distance from the borders of the largest box (Angstrom).
     writeBox : bool, optional
         Whether to generate output file containing coordinates of examined boxes.
+    npName : str, optional
+        Identifier of the measured object, which forms part of the output file names, defaults to the input file name.
+    cacheDir : str, optional
+        Path to the directory caching the parsed atoms, their neighbours and the surface atoms, keyed by the content of
+        the input file and the parameters they depend on. Caching is disabled if None or if 'inpFilePath' is not a path.
+    cacheSize : int, optional
+        Maximum total size of the cache directory in bytes, least recently used entries are evicted beyond it.
+    typeEles : Union[dict, list], optional
+        Element symbol of each LAMMPS atom type, only used for lmp files without an 'element' column.
+    cellVecs : 2D ndarray of floats, optional
+        Vectors spanning the periodic simulation cell as rows, e.g. for slab models, the surface being measured within
+        the cell. The object is treated as non-periodic if None.
+    pbc : tuple of bools, optional
+        Whether the object is periodic along each cell vector, only used if 'cellVecs' is given.
+    verletList : VerletList, optional
+        Neighbour list shared across the frames of a trajectory, whose 'radMult' and 'calcBL' are used for the
+        neighbour search in place of the parameters above.
+    dtype : {np.float64, np.float32}, optional
+        Floating point type of the coordinates, surface points and distances within both surface representations,
+        np.float32 halves their memory footprint.
+    probeRad : Union[int, float], optional
+        Radius of the probe sphere to identify the surface atoms (Angstrom), only used if 'findSurfAlg' is 'probeSphere'.
+    prefilterSurf : bool, optional
+        Whether to skip the buried atoms when triangulating for the alpha shape, by growing a shell from the atoms with
+        less than 'bulkCN' neighbours, only used if 'findSurfAlg' is 'alphaShape'.
+    voxelAlg : {'pointCloud', 'sphereShell'}, optional
+        Algorithm to voxelise the surface, either from 'numPoints' points around each atom or by rasterising the
+        exposed spherical shell of each atom directly, only used if 'voxelSurf' is True.
     
     Returns
     -------
@@ -257,28 +292,102 @@ def runBoxCnt(inpFilePath,
     --------
     >>> r2VX, bcDimVX, confIntVX, minMaxLensVX, r2EX, bcDimEX, confIntEX, minMaxLensEX = runBoxCnt('example.xyz')
     """
-    atomsEle, atomsRad, atomsXYZ, maxRange, minXYZ, maxXYZ = readInp(inpFilePath, radType)
-    atomsNeighIdxs, atomsAvgBondLen = findNN(atomsRad, atomsXYZ, minXYZ, maxXYZ, atomsRad.max(), radMult, calcBL)
-    atomsSurfIdxs = findSurf(atomsXYZ, atomsNeighIdxs, findSurfAlg, alphaMult * atomsRad.min(), bulkCN)
-    testCase = inpFilePath.split('/')[-1][:-4]
+    if isinstance(inpFilePath, Structure):
+        struct = inpFilePath
+    else:
+        structKwargs = dict(radMult=radMult, calcBL=calcBL, findSurfAlg=findSurfAlg, alphaMult=alphaMult, bulkCN=bulkCN,
+                            cellVecs=cellVecs, pbc=pbc, probeRad=probeRad, prefilterSurf=prefilterSurf)
+        cacheKey = cachedArrs = None
+        if cacheDir is not None and isinstance(inpFilePath, str):
+            cellKey = None if cellVecs is None else (np.asarray(cellVecs, dtype=float).tolist(), tuple(map(bool, pbc)))
+            cacheKey = getCacheKey(inpFilePath, radType=radType, typeEles=typeEles,
+                                   **dict(structKwargs, cellVecs=cellKey, pbc=None))
+            cachedArrs = loadCache(cacheDir, cacheKey)
+        if cachedArrs is not None:
+            inp = (cachedArrs['atomsEle'], cachedArrs['atomsRad'], cachedArrs['atomsXYZ'],
+                   float(cachedArrs['maxRange']), cachedArrs['minXYZ'], cachedArrs['maxXYZ'])
+            struct = Structure.fromInp(inp, atomsNeighIdxs=(cachedArrs['atomsNeighPtrs'], cachedArrs['atomsNeighIdxs']),
+                                       atomsAvgBondLen=cachedArrs['atomsAvgBondLen'],
+                                       atomsSurfIdxs=cachedArrs['atomsSurfIdxs'], numCPUs=numCPUs, **structKwargs)
+        else:
+            if isinstance(inpFilePath, str):
+                inp = readInp(inpFilePath, radType, numCPUs, typeEles=typeEles)
+            else:
+                inp = inpFilePath
+            struct = Structure.fromInp(inp, numCPUs=numCPUs, verletList=verletList, **structKwargs)
+            if cacheKey is not None:
+                saveCache(cacheDir, cacheKey, cacheSize, atomsEle=struct.atomsEle, atomsRad=struct.atomsRad,
+                          atomsXYZ=struct.atomsXYZ, maxRange=struct.maxRange, minXYZ=struct.minXYZ,
+                          maxXYZ=struct.maxXYZ, atomsNeighPtrs=struct.atomsNeighIdxs[0],
+                          atomsNeighIdxs=struct.atomsNeighIdxs[1],
+                          atomsAvgBondLen=struct.atomsAvgBondLen, atomsSurfIdxs=struct.atomsSurfIdxs)
+    if npName is not None:
+        testCase = npName
+    else:
+        testCase = getNpName(inpFilePath) if isinstance(inpFilePath, str) else 'structure'
     if verbose:
         print(f"\n{testCase}")
 
     r2VX, bcDimVX, confIntVX, minMaxLensVX = np.nan, np.nan, (np.nan, np.nan), (np.nan, np.nan)
     r2EX, bcDimEX, confIntEX, minMaxLensEX = np.nan, np.nan, (np.nan, np.nan), (np.nan, np.nan)
     if voxelSurf:
-        scalesVX, countsVX = voxelBoxCnts(atomsEle, atomsRad, atomsSurfIdxs, atomsXYZ, atomsNeighIdxs,
-                                          testCase, outDir, numCPUs, fastbcPath,
-                                          radType, numPoints, gridNum,
-                                          rmInSurf, vis, verbose, genPCD)
+        scalesVX, countsVX = voxelBoxCnts(struct, npName=testCase, outDir=outDir, numCPUs=numCPUs,
+                                          fastbcPath=fastbcPath, radType=radType, numPoints=numPoints,
+                                          gridNum=gridNum, rmInSurf=rmInSurf, vis=vis, verbose=verbose, genPCD=genPCD,
+                                          dtype=dtype, voxelAlg=voxelAlg)
         r2VX, bcDimVX, confIntVX, minMaxLensVX = findSlope(scalesVX, countsVX, f"{testCase}_VX", outDir, trimLen,
                                                            minSample, confLvl, vis, figType, saveFig, showPlot, verbose)
     if exactSurf:
-        minAtomRad = atomsRad.min()
-        scalesEX, countsEX = exactBoxCnts(atomsEle, atomsRad, atomsSurfIdxs, atomsXYZ, atomsNeighIdxs,
-                                          maxRange, (minAtomRad * minLenMult, minAtomRad * maxLenMult),
-                                          minXYZ, testCase, outDir, numCPUs, numBoxLen, bufferDist,
-                                          rmInSurf, writeBox, verbose)
+        minAtomRad = struct.atomsRad.min()
+        scalesEX, countsEX = exactBoxCnts(struct, minMaxBoxLens=(minAtomRad * minLenMult, minAtomRad * maxLenMult),
+                                          npName=testCase, outDir=outDir, numCPUs=numCPUs, numBoxLen=numBoxLen,
+                                          bufferDist=bufferDist, rmInSurf=rmInSurf, writeBox=writeBox, verbose=verbose,
+                                          dtype=dtype)
         r2EX, bcDimEX, confIntEX, minMaxLensEX = findSlope(scalesEX, countsEX, f"{testCase}_EX", outDir, trimLen,
                                                            minSample, confLvl, vis, figType, saveFig, showPlot, verbose)
     return r2VX, bcDimVX, confIntVX, minMaxLensVX, r2EX, bcDimEX, confIntEX, minMaxLensEX
+
+
+def runBoxCntTraj(inpFilePath, radType='atomic', skin=0.5, **kwargs):
+    """
+    Run box-counting algorithm on the surface of every frame of a multi-frame trajectory, one frame at a time.
+
+    Frames are parsed lazily, hence only a single frame is held in memory at any moment. The neighbour list is shared
+    across the frames as a VerletList, hence searched again only once the atoms have moved far enough.
+
+    Parameters
+    ----------
+    inpFilePath : str
+        Path to multi-frame xyz or lmp (LAMMPS dump) file, optionally gzip, bzip2 or xz compressed, containing
+        Cartesian coordinates of a set of atoms.
+    radType : {'atomic', 'metallic'}, optional
+        Type of radii to use for the atoms.
+    skin : Union[int, float], optional
+        Skin distance of the neighbour list shared across the frames (Angstrom), the neighbours of each frame are
+        searched from scratch if None.
+    **kwargs
+        Other keyword arguments of runBoxCnt(), applied to every frame. 'npName' is used as the prefix of the
+        identifier of each frame, which defaults to the input file name.
+
+    Yields
+    ------
+    frameIdx : int
+        Index of the frame in the trajectory.
+    boxCntDims : tuple
+        Outputs of runBoxCnt() for the frame.
+
+    Examples
+    --------
+    >>> for (frameIdx, (r2VX, bcDimVX, _, _, r2EX, bcDimEX, _, _)) in runBoxCntTraj('traj.xyz', voxelSurf=False):
+    ...     print(frameIdx, bcDimEX)
+    """
+    npName = kwargs.pop('npName', None)
+    if npName is not None:
+        testCase = npName
+    else:
+        testCase = getNpName(inpFilePath) if isinstance(inpFilePath, str) else 'structure'
+    if skin is not None and 'verletList' not in kwargs:
+        kwargs['verletList'] = VerletList(kwargs.get('radMult', 1.2), skin, kwargs.get('calcBL', False),
+                                          kwargs.get('numCPUs', 8))
+    for (frameIdx, frameInp) in enumerate(readFrames(inpFilePath, radType, kwargs.get('typeEles'))):
+        yield frameIdx, runBoxCnt(frameInp, radType, npName=f"{testCase}_{frameIdx}", **kwargs)
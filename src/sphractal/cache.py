@@ -0,0 +1,98 @@
+from hashlib import sha256
+from os import listdir, mkdir, rename, utime
+from os.path import getmtime, getsize, isdir, join
+from shutil import rmtree
+from time import time
+
+import numpy as np
+
+
+CACHE_VERSION = 3  # Bump whenever the layout or meaning of the cached arrays changes
+
+
+def hashFile(filePath, blockSize=2**20):
+    """Return the SHA-256 digest of the content of a file."""
+    fileHash = sha256()
+    with open(filePath, 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''):
+            fileHash.update(block)
+    return fileHash.hexdigest()
+
+
+def getCacheKey(filePath, **params):
+    """Return a key identifying the content of a file together with the parameters used to process it."""
+    paramsStr = ','.join(f"{name}={params[name]!r}" for name in sorted(params))
+    return sha256(f"{CACHE_VERSION}:{hashFile(filePath)}:{paramsStr}".encode()).hexdigest()
+
+
+def getDirSize(dirPath):
+    """Return the total size of the files in a directory in bytes."""
+    return sum(getsize(join(dirPath, fileName)) for fileName in listdir(dirPath))
+
+
+def loadCache(cacheDir, key):
+    """
+    Load the arrays stored under a key as read-only memory-mapped arrays.
+
+    Parameters
+    ----------
+    cacheDir : str
+        Path to the cache directory.
+    key : str
+        Key of the entry, as returned by getCacheKey().
+
+    Returns
+    -------
+    arrs : dict or None
+        Arrays stored under the key, None if the entry is not cached.
+    """
+    entryDir = join(cacheDir, key)
+    if not isdir(entryDir):
+        return None
+    now = time()
+    utime(entryDir, (now, now))  # Mark as recently used
+    return {fileName[:-4]: np.asarray(np.load(join(entryDir, fileName), mmap_mode='r'))
+            for fileName in listdir(entryDir) if fileName.endswith('.npy')}
+
+
+def saveCache(cacheDir, key, cacheSize=2**30, **arrs):
+    """
+    Store arrays under a key as npy files, then evict the least recently used entries beyond the size limit.
+
+    Parameters
+    ----------
+    cacheDir : str
+        Path to the cache directory.
+    key : str
+        Key of the entry, as returned by getCacheKey().
+    cacheSize : int, optional
+        Maximum total size of the cache in bytes, the entry just stored is always retained.
+    **arrs
+        Arrays to be stored, retrievable by their keyword names.
+    """
+    if not isdir(cacheDir):
+        mkdir(cacheDir)
+    entryDir, tmpDir = join(cacheDir, key), join(cacheDir, f".{key}.tmp")
+    if isdir(tmpDir):
+        rmtree(tmpDir)
+    mkdir(tmpDir)
+    for (name, arr) in arrs.items():
+        np.save(join(tmpDir, f"{name}.npy"), np.asarray(arr))
+    if isdir(entryDir):
+        rmtree(entryDir)
+    rename(tmpDir, entryDir)  # Entries appear atomically to concurrent readers
+    evictCache(cacheDir, cacheSize, keep=key)
+
+
+def evictCache(cacheDir, cacheSize, keep=None):
+    """Remove the least recently used entries of a cache directory until its total size is within 'cacheSize' bytes."""
+    entries = [(getmtime(join(cacheDir, key)), getDirSize(join(cacheDir, key)), key)
+               for key in listdir(cacheDir) if not key.startswith('.') and isdir(join(cacheDir, key))]
+    totSize = sum(entrySize for (_, entrySize, _) in entries)
+    for (_, entrySize, key) in sorted(entries):
+        if totSize <= cacheSize:
+            break
+        if key == keep:
+            continue
+        rmtree(join(cacheDir, key))
+        totSize -= entrySize
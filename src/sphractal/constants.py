@@ -1,3 +1,6 @@
+import numpy as np
+
+
 defRad = 1.0  # Default radius value for missing data
 # Atomic radii (computed from theoretical models) from E. Clementi; D.L. Raimondi; W.P. Reinhardt (1967) "Atomic
 # Screening Constants from SCF Functions. II. Atoms with 37 to 86 Electrons." The Journal of Chemical Physics. 47 (4):
@@ -38,6 +41,12 @@ METALLIC_RAD_DICT = {
     'Sg': defRad, 'Bh': defRad, 'Hs': defRad, 'Mt': defRad, 'Ds': defRad, 'Rg': defRad, 'Cn': defRad, 'Nh': defRad,
     'Fl': defRad, 'Mc': defRad, 'Lv': defRad, 'Ts': defRad, 'Og': defRad
 }
+# Element symbols indexed by atomic number, elements are encoded as these compact integer codes (0 for dummy atoms)
+ELE_SYMBOLS = ('X',) + tuple(ATOMIC_RAD_DICT)
+ELE_CODES = {ele: eleCode for (eleCode, ele) in enumerate(ELE_SYMBOLS)}
+# Radii lookup tables indexed by element code
+ATOMIC_RAD_ARR = np.array([defRad] + list(ATOMIC_RAD_DICT.values()))
+METALLIC_RAD_ARR = np.array([defRad] + [METALLIC_RAD_DICT[ele] for ele in ATOMIC_RAD_DICT])
 PLT_PARAMS = {'paper': {'figSize': (3.5, 2.5), 'dpi': 300, 'fontSize': 'medium', 'labelSize': 'small',
                         'legendSize': 'x-small', 'lineWidth': 0.5, 'markerSize': 24},
               'notebook': {'figSize': (3.5, 2.5), 'dpi': 120, 'fontSize': 'medium', 'labelSize': 'small',
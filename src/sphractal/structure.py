@@ -0,0 +1,343 @@
+import numpy as np
+from scipy.spatial import Delaunay
+
+from sphractal.constants import ATOMIC_RAD_ARR, METALLIC_RAD_ARR
+from sphractal.utils import calcCircumRads, csrNeighs, encodeEles, filterNeighs, findNN, findPeriodicImages, findSurf, \
+    getMinMaxXYZ, readInp, wrapXYZ
+
+
+class Structure:
+    """
+    In-memory set of atoms, whose bounding box, neighbour list and surface atoms are computed lazily and memoised.
+
+    Parameters
+    ----------
+    atomsEle : 1D ndarray of uint8
+        Element type of each atom, either encoded as atomic number or as element symbol.
+    atomsXYZ : 2D ndarray of floats
+        Cartesian coordinates of each atom.
+    atomsRad : 1D ndarray of floats, optional
+        Radius of each atom, looked up from the element types according to 'radType' if None.
+    radType : {'atomic', 'metallic'}, optional
+        Type of radii to use for the atoms, only used if 'atomsRad' is None.
+    radMult : Union[int, float], optional
+        Multiplier to the radii of atoms to identify their neighbouring atoms.
+    calcBL : bool, optional
+        Whether to compute the average distance from its neighbours for each atom.
+    findSurfAlg : {'alphaShape', 'convexHull', 'numNeigh', 'probeSphere'}, optional
+        Algorithm to identify the surface atoms.
+    alphaMult : Union[int, float], optional
+        Multiplier to the minimum radius to decide 'alpha' value for the alpha shape algorithm.
+    bulkCN : int, optional
+        Minimum number of neighbouring atoms for non-surface atoms.
+    numCPUs : int, optional
+        Number of CPUs to be used for the neighbour search, defaults to the number of CPUs available.
+    cellVecs : 2D ndarray of floats, optional
+        Vectors spanning the periodic simulation cell as rows, the atoms are wrapped into the cell along its periodic
+        axes. The structure is treated as non-periodic if None.
+    pbc : tuple of bools, optional
+        Whether the structure is periodic along each cell vector, only used if 'cellVecs' is given.
+    atomsNeighIdxs : tuple of 1D ndarrays of ints, optional
+        Precomputed neighbour atoms indices of each atom in compressed sparse row form, e.g. from a cache.
+    atomsAvgBondLen : 1D ndarray of floats, optional
+        Precomputed average bond lengths for each atom.
+    atomsSurfIdxs : 1D ndarray of ints, optional
+        Precomputed indices of surface atoms.
+    verletList : VerletList, optional
+        Neighbour list shared across the frames of a trajectory, used in place of findNN() with its own 'radMult' and
+        'calcBL' if given.
+    probeRad : Union[int, float], optional
+        Radius of the probe sphere to identify the surface atoms, only used if 'findSurfAlg' is 'probeSphere'.
+    prefilterSurf : bool, optional
+        Whether to triangulate only a shell of atoms near the under-coordinated atoms, only used if 'findSurfAlg' is
+        'alphaShape'.
+
+    Examples
+    --------
+    >>> struct = Structure(['Pd', 'Pd'], np.array([[0.0, 0.0, 0.0], [2.7, 0.0, 0.0]]))
+    >>> struct.atomsSurfIdxs
+    array([0, 1])
+    """
+    __slots__ = ('atomsEle', 'atomsRad', 'atomsXYZ', 'radMult', 'calcBL', 'findSurfAlg', 'alphaMult', 'bulkCN', 'numCPUs',
+                 'cellVecs', 'pbc', 'verletList', 'probeRad', 'prefilterSurf',
+                 '_bbox', '_neighs', '_atomsSurfIdxs', '_engineInps')
+
+    def __init__(self, atomsEle, atomsXYZ, atomsRad=None, radType='atomic',
+                 radMult=1.2, calcBL=False, findSurfAlg='alphaShape', alphaMult=2.0, bulkCN=12, numCPUs=None,
+                 cellVecs=None, pbc=(True, True, True), atomsNeighIdxs=None, atomsAvgBondLen=None, atomsSurfIdxs=None,
+                 verletList=None, probeRad=1.4, prefilterSurf=False):
+        self.atomsEle = encodeEles(atomsEle)
+        self.atomsXYZ = np.asarray(atomsXYZ, dtype=np.float64)
+        self.cellVecs, self.pbc = None, None
+        if cellVecs is not None:
+            self.cellVecs, self.pbc = np.asarray(cellVecs, dtype=np.float64), np.asarray(pbc, dtype=np.bool_)
+            self.atomsXYZ = wrapXYZ(self.atomsXYZ, self.cellVecs, self.pbc)
+        if atomsRad is None:
+            atomsRad = (ATOMIC_RAD_ARR if radType == 'atomic' else METALLIC_RAD_ARR)[self.atomsEle]
+        self.atomsRad = np.asarray(atomsRad, dtype=np.float64)
+        self.radMult, self.calcBL = radMult, calcBL
+        self.findSurfAlg, self.alphaMult, self.bulkCN, self.numCPUs = findSurfAlg, alphaMult, bulkCN, numCPUs
+        self.verletList, self.probeRad, self.prefilterSurf = verletList, probeRad, prefilterSurf
+        self._bbox = None
+        self._neighs = None if atomsNeighIdxs is None else (csrNeighs(atomsNeighIdxs), atomsAvgBondLen)
+        self._atomsSurfIdxs = atomsSurfIdxs
+        self._engineInps = None
+
+    @classmethod
+    def fromInp(cls, inp, **kwargs):
+        """Build a Structure from the outputs of readInp() or readFrames(), keyword arguments are passed to __init__."""
+        atomsEle, atomsRad, atomsXYZ, maxRange, minXYZ, maxXYZ = inp
+        struct = cls(atomsEle, atomsXYZ, atomsRad, **kwargs)
+        if struct.cellVecs is None:  # Wrapped periodic atoms have their bounding box recomputed
+            struct._bbox = (maxRange, minXYZ, maxXYZ)
+        return struct
+
+    @classmethod
+    def fromFile(cls, filePath, radType='atomic', numCPUs=1, typeEles=None, **kwargs):
+        """Build a Structure from an xyz or lmp file, keyword arguments are passed to __init__."""
+        return cls.fromInp(readInp(filePath, radType, numCPUs, typeEles=typeEles), **kwargs)
+
+    def __len__(self):
+        return len(self.atomsEle)
+
+    def __repr__(self):
+        return f"Structure({len(self)} atoms, radMult={self.radMult}, findSurfAlg={self.findSurfAlg!r})"
+
+    @property
+    def bbox(self):
+        """Maximum range among all dimensions, minimum and maximum values of each dimension of the Cartesian space."""
+        if self._bbox is None:
+            self._bbox = getMinMaxXYZ(self.atomsXYZ)
+        return self._bbox
+
+    @property
+    def maxRange(self):
+        """Maximum range among all dimensions of the Cartesian space."""
+        return self.bbox[0]
+
+    @property
+    def minXYZ(self):
+        """Minimum values of each dimension in the Cartesian space."""
+        return self.bbox[1]
+
+    @property
+    def maxXYZ(self):
+        """Maximum values of each dimension in the Cartesian space."""
+        return self.bbox[2]
+
+    @property
+    def neighs(self):
+        """Neighbour atoms indices and average bond lengths of each atom, computed by findNN() on first access."""
+        if self._neighs is None and self.verletList is not None:
+            self._neighs = self.verletList.update(self.atomsRad, self.atomsXYZ, self.cellVecs, self.pbc)
+        elif self._neighs is None:
+            self._neighs = findNN(self.atomsRad, self.atomsXYZ, self.minXYZ, self.maxXYZ, self.atomsRad.max(),
+                                  self.radMult, self.calcBL, self.numCPUs, self.cellVecs, self.pbc)
+        return self._neighs
+
+    @property
+    def atomsNeighIdxs(self):
+        """Neighbour atoms indices of each atom in compressed sparse row form (neighPtrs, neighIdxs)."""
+        return self.neighs[0]
+
+    @property
+    def atomsAvgBondLen(self):
+        """Average bond lengths for each atom, only meaningful if 'calcBL' is True."""
+        return self.neighs[1]
+
+    @property
+    def atomsSurfIdxs(self):
+        """Indices of surface atoms, computed by findSurf() on first access."""
+        if self._atomsSurfIdxs is None:
+            self._atomsSurfIdxs = findSurf(self.atomsXYZ, self.atomsNeighIdxs, self.findSurfAlg,
+                                           self.alphaMult * self.atomsRad.min(), self.bulkCN, self.cellVecs, self.pbc,
+                                           self.atomsRad, self.probeRad, self.prefilterSurf)
+        return self._atomsSurfIdxs
+
+    def engineInps(self):
+        """
+        Return the per-atom arrays expected by voxelBoxCnts() and exactBoxCnts(), in their order.
+
+        For periodic structures, the atoms are followed by their periodic images within a bond length outside the cell,
+        so that the engines see the neighbours across the cell faces at their actual positions. The images of surface
+        atoms are included in the surface atoms indices, but only the atoms preceding them (len(self)) are measured.
+        """
+        if self.cellVecs is None:
+            return self.atomsEle, self.atomsRad, self.atomsSurfIdxs, self.atomsXYZ, self.atomsNeighIdxs
+        if self._engineInps is None:
+            imgsIdxs, imgsXYZ = findPeriodicImages(self.atomsXYZ, self.cellVecs, self.pbc,
+                                                   margin=2 * self.atomsRad.max() * self.radMult)
+            atomsEle = np.concatenate((self.atomsEle, self.atomsEle[imgsIdxs]))
+            atomsRad = np.concatenate((self.atomsRad, self.atomsRad[imgsIdxs]))
+            atomsXYZ = np.concatenate((self.atomsXYZ, imgsXYZ))
+            atomsNeighIdxs, _ = findNN(atomsRad, atomsXYZ, atomsXYZ.min(axis=0), atomsXYZ.max(axis=0), atomsRad.max(),
+                                       self.radMult, False, self.numCPUs)
+            isSurf = np.zeros(len(self), dtype=np.bool_)
+            isSurf[self.atomsSurfIdxs] = True
+            atomsSurfIdxs = np.concatenate((self.atomsSurfIdxs, len(self) + np.nonzero(isSurf[imgsIdxs])[0]))
+            self._engineInps = (atomsEle, atomsRad, atomsSurfIdxs, atomsXYZ, atomsNeighIdxs)
+        return self._engineInps
+
+
+class VerletList:
+    """
+    Neighbour list reused across the frames of a trajectory, in which the atoms move little between frames.
+
+    The pairs of atoms within the neighbour cutoff plus a skin distance are searched by findNN() and stored, then the
+    neighbours of subsequent frames are filtered from the stored pairs, until any atom has moved by more than half of
+    the skin distance since the last search (or the atoms or cell have changed) and the pairs are searched again.
+
+    Parameters
+    ----------
+    radMult : Union[int, float], optional
+        Multiplier to the radii of atoms to identify their neighbouring atoms.
+    skin : Union[int, float], optional
+        Distance added to the neighbour cutoff when searching for the stored pairs (Angstrom). Larger values allow
+        more frames between searches at the cost of more pairs to filter.
+    calcBL : bool, optional
+        Whether to compute the average distance from its neighbours for each atom.
+    numCPUs : int, optional
+        Number of CPUs to be used for the neighbour search, defaults to the number of CPUs available.
+
+    Examples
+    --------
+    >>> verletList = VerletList(radMult=1.2, skin=0.5)
+    >>> for frameInp in readFrames('traj.xyz'):
+    ...     struct = Structure.fromInp(frameInp, verletList=verletList)
+    """
+    __slots__ = ('radMult', 'skin', 'calcBL', 'numCPUs', 'numBuilds', '_refXYZ', '_refRad', '_refCell', '_candNeighIdxs')
+
+    def __init__(self, radMult=1.2, skin=0.5, calcBL=False, numCPUs=None):
+        self.radMult, self.skin, self.calcBL, self.numCPUs = radMult, skin, calcBL, numCPUs
+        self.numBuilds = 0
+        self._refXYZ = self._refRad = self._refCell = self._candNeighIdxs = None
+
+    def __repr__(self):
+        return f"VerletList(radMult={self.radMult}, skin={self.skin}, numBuilds={self.numBuilds})"
+
+    def needsRebuild(self, atomsRad, atomsXYZ, cellVecs=None, pbc=(True, True, True)):
+        """Whether the stored pairs may miss any neighbours of the given atoms."""
+        if self._candNeighIdxs is None or len(atomsXYZ) != len(self._refXYZ) or \
+                not np.array_equal(atomsRad, self._refRad):
+            return True
+        if cellVecs is None or self._refCell is None:
+            if (cellVecs is None) != (self._refCell is None):
+                return True
+            disps = atomsXYZ - self._refXYZ
+        else:
+            if not (np.array_equal(cellVecs, self._refCell[0]) and np.array_equal(pbc, self._refCell[1])):
+                return True
+            pbc = np.asarray(pbc, dtype=np.bool_)
+            dispsFrac = (atomsXYZ - self._refXYZ) @ np.linalg.inv(cellVecs)
+            dispsFrac[:, pbc] -= np.round(dispsFrac[:, pbc])  # Atoms wrapped across the cell faces
+            disps = dispsFrac @ cellVecs
+        return np.einsum('ij,ij->i', disps, disps).max() > (self.skin / 2) ** 2
+
+    def update(self, atomsRad, atomsXYZ, cellVecs=None, pbc=(True, True, True)):
+        """
+        Return the neighbour list of a frame, searching for the pairs within the enlarged cutoff again if necessary.
+
+        Parameters
+        ----------
+        atomsRad : 1D ndarray of floats
+            Radius of each atom.
+        atomsXYZ : 2D ndarray of floats
+            Cartesian coordinates of each atom.
+        cellVecs : 2D ndarray of floats, optional
+            Vectors spanning the periodic simulation cell as rows, the frame is treated as non-periodic if None.
+        pbc : tuple of bools, optional
+            Whether the frame is periodic along each cell vector, only used if 'cellVecs' is given.
+
+        Returns
+        -------
+        atomsNeighIdxs : tuple of 1D ndarrays of int32
+            Neighbour atoms indices of each atom in compressed sparse row form (neighPtrs, neighIdxs).
+        atomsAvgBondLen : 1D ndarray of floats
+            Average bond lengths for each atom.
+        """
+        atomsRad, atomsXYZ = np.asarray(atomsRad, dtype=np.float64), np.asarray(atomsXYZ, dtype=np.float64)
+        if cellVecs is None:
+            periodicity = (np.eye(3), np.eye(3), np.zeros(3, dtype=np.bool_))
+        else:
+            cellVecs, pbc = np.asarray(cellVecs, dtype=np.float64), np.asarray(pbc, dtype=np.bool_)
+            periodicity = (cellVecs, np.linalg.inv(cellVecs), pbc)
+        if self.needsRebuild(atomsRad, atomsXYZ, cellVecs, pbc):
+            # Every pair within (rad1+rad2)*radMult + skin is stored, as the radii sum to at least twice the minimum
+            skinRadMult = self.radMult + self.skin / (2 * atomsRad.min())
+            self._candNeighIdxs, _ = findNN(atomsRad, atomsXYZ, atomsXYZ.min(axis=0), atomsXYZ.max(axis=0),
+                                            atomsRad.max(), skinRadMult, False, self.numCPUs, cellVecs, pbc)
+            self._refXYZ, self._refRad = atomsXYZ.copy(), atomsRad.copy()
+            self._refCell = None if cellVecs is None else (cellVecs.copy(), pbc.copy())
+            self.numBuilds += 1
+        return filterNeighs(*self._candNeighIdxs, atomsRad, atomsXYZ, self.radMult, *periodicity, self.calcBL)
+
+
+class AlphaComplex:
+    """
+    Delaunay triangulation of a set of atoms, from which the alpha shape surface atoms are read off for any alpha value.
+
+    The atoms are triangulated only once, e.g. to sweep 'alphaMult' for a new material. Each triangle is stored with the
+    circumsphere radii of its two adjacent tetrahedrons (the second being infinite on the convex hull), sorted by the
+    smaller one. A triangle bounds the alpha shape if exactly one of the tetrahedrons has a circumsphere radius smaller
+    than alpha, as in alphaShape().
+
+    Parameters
+    ----------
+    atomsXYZ : 2D ndarray of floats
+        Cartesian coordinates of each atom.
+    cellVecs : 2D ndarray of floats, optional
+        Vectors spanning the periodic simulation cell as rows, the atoms are wrapped into the cell and padded with their
+        periodic images. The atoms are treated as non-periodic if None.
+    pbc : tuple of bools, optional
+        Whether the atoms are periodic along each cell vector, only used if 'cellVecs' is given.
+    maxAlpha : Union[int, float], optional
+        Largest alpha value to be queried, required if 'cellVecs' is given to decide the padding by periodic images.
+
+    Examples
+    --------
+    >>> alphaComplex = AlphaComplex(atomsXYZ)
+    >>> for alphaMult in (1.5, 2.0, 2.5):
+    ...     print(alphaMult, len(alphaComplex.surfAtoms(alphaMult * atomsRad.min())))
+    """
+    __slots__ = ('numAtoms', 'maxAlpha', 'triVtxsIdxs', 'triLowRads', 'triHighRads')
+
+    def __init__(self, atomsXYZ, cellVecs=None, pbc=(True, True, True), maxAlpha=None):
+        atomsXYZ = np.asarray(atomsXYZ, dtype=np.float64)
+        self.numAtoms, self.maxAlpha = len(atomsXYZ), maxAlpha
+        if cellVecs is not None:
+            if maxAlpha is None:
+                raise ValueError("'maxAlpha' is required to pad periodic atoms with their images!")
+            atomsXYZ = wrapXYZ(atomsXYZ, cellVecs, pbc)
+            _, imgsXYZ = findPeriodicImages(atomsXYZ, cellVecs, pbc, margin=2.0 * maxAlpha)
+            atomsXYZ = np.concatenate((atomsXYZ, imgsXYZ))
+        delaunay = Delaunay(atomsXYZ)
+        tetraVtxsIdxs, tetrasNeighIdxs = delaunay.simplices, delaunay.neighbors
+        tetrasCircumRad = calcCircumRads(tetraVtxsIdxs, atomsXYZ)
+
+        # Triangle opposite to vertex j of tetrahedron i, stored once from the tetrahedron with the larger index
+        tetraIdxs, vtxIdxs = np.nonzero(tetrasNeighIdxs < np.arange(len(tetraVtxsIdxs))[:, np.newaxis])
+        triVtxsIdxs = np.array([tetraVtxsIdxs[tetraIdxs, (vtxIdxs + k) % 4] for k in range(1, 4)]).T
+        neighIdxs = tetrasNeighIdxs[tetraIdxs, vtxIdxs]
+        triRads = np.stack((tetrasCircumRad[tetraIdxs],
+                            np.where(neighIdxs > -1, tetrasCircumRad[neighIdxs], np.inf)), axis=1)
+        triLowRads, triHighRads = triRads.min(axis=1), triRads.max(axis=1)
+        trisOrder = np.argsort(triLowRads, kind='stable')
+        self.triVtxsIdxs = triVtxsIdxs[trisOrder].astype(np.int32)
+        self.triLowRads, self.triHighRads = triLowRads[trisOrder], triHighRads[trisOrder]
+
+    def __repr__(self):
+        return f"AlphaComplex({self.numAtoms} atoms, {len(self.triVtxsIdxs)} triangles)"
+
+    def surfAtoms(self, alpha):
+        """Return the indices of surface atoms identified by the alpha shape with a given alpha value."""
+        if self.maxAlpha is not None and alpha > self.maxAlpha:
+            raise ValueError(f"alpha {alpha} exceeds 'maxAlpha' {self.maxAlpha} of the periodic images padding!")
+        # Only the triangles with a smaller circumsphere radius than alpha could bound the alpha shape
+        numCandTris = np.searchsorted(self.triLowRads, alpha, side='left')
+        isBoundTri = self.triHighRads[:numCandTris] >= alpha
+        surfAtomsIdxs = np.unique(self.triVtxsIdxs[:numCandTris][isBoundTri])
+        return surfAtomsIdxs[surfAtomsIdxs < self.numAtoms]  # Periodic images are only padding
+
+    def surfAtomsSpectrum(self, alphas):
+        """Return the indices of surface atoms for each of the given alpha values."""
+        return [self.surfAtoms(alpha) for alpha in alphas]
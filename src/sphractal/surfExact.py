@@ -7,7 +7,10 @@ from time import time
 from numba import njit
 import numpy as np
 
-from sphractal.utils import calcDist, oppositeInnerAtoms
+from sphractal.constants import ELE_SYMBOLS
+from sphractal.structure import Structure
+from sphractal.utils import attachArrays, calcDist, calcSurfFrames, csrNeighs, encodeEles, findAtomNeighs, \
+    getMinMaxXYZ, getSurfFrame, oppositeInnerAtoms, shareArrays, splitSurfNeighs
 # from sphractal.utils import annotate
 
 
@@ -29,8 +32,8 @@ def getNearFarCoord(scanBoxIdx, boxLen, lowBound, atomCoord, bufferDist=5.0):
 
 @njit(fastmath=True, cache=True)
 def scanBox(minXYZ, scanBoxIdxs, scanBoxNearFarXYZs, boxLen,
-            atomIdx, atomRad, atomXYZ, atomNeighIdxs,
-            atomsSurfIdxs, atomsXYZ, atomsNeighIdxs,
+            atomIdx, atomRad, atomXYZ, atomSurfNeighIdxs, atomSurfFrame,
+            atomsXYZ,
             bufferDist=5.0, rmInSurf=True):
     """Find the nearest and furthest point of a given box from a given atom."""
     # Remove the box if it covers the inner surface
@@ -38,8 +41,8 @@ def scanBox(minXYZ, scanBoxIdxs, scanBoxNearFarXYZs, boxLen,
         scanBoxX = minXYZ[0] - bufferDist + (scanBoxIdxs[0]+1)*boxLen - boxLen*0.5
         scanBoxY = minXYZ[1] - bufferDist + (scanBoxIdxs[1]+1)*boxLen - boxLen*0.5
         scanBoxZ = minXYZ[2] - bufferDist + (scanBoxIdxs[2]+1)*boxLen - boxLen*0.5
-        if not oppositeInnerAtoms(np.array((scanBoxX, scanBoxY, scanBoxZ)), atomXYZ, atomNeighIdxs,
-                                  atomsSurfIdxs, atomsXYZ, atomsNeighIdxs):
+        scanBoxXYZ = np.array((scanBoxX, scanBoxY, scanBoxZ)).astype(atomXYZ.dtype)
+        if not oppositeInnerAtoms(scanBoxXYZ, atomXYZ, atomSurfNeighIdxs, atomSurfFrame, atomsXYZ):
             return 'none'
 
     # Check what does the box cover
@@ -57,9 +60,11 @@ def scanBox(minXYZ, scanBoxIdxs, scanBoxNearFarXYZs, boxLen,
 @njit(fastmath=True, cache=True)
 def scanAtom(args):
     """Count the number of boxes that cover the outer spherical surface of a given atom."""
-    magn, boxLen, minXYZ, atomIdx, atomRad, atomsSurfIdxs, atomsXYZ, atomsNeighIdxs, bufferDist, rmInSurf = args
-    atomXYZ, atomNeighIdxsPadded = atomsXYZ[atomIdx], atomsNeighIdxs[atomIdx]
-    atomNeighIdxs = atomNeighIdxsPadded[atomNeighIdxsPadded > -1]
+    magn, boxLen, minXYZ, atomIdx, atomRad, surfNeighEnds, atomsSurfFrames, atomsXYZ, atomsNeighIdxs, bufferDist, \
+        rmInSurf = args
+    atomXYZ = atomsXYZ[atomIdx]
+    atomSurfNeighIdxs, _ = findAtomNeighs(atomIdx, atomsNeighIdxs, surfNeighEnds)
+    atomSurfFrame = getSurfFrame(atomIdx, atomsSurfFrames)
 
     atomX, atomY, atomZ = atomXYZ
     minX, minY, minZ = minXYZ
@@ -87,8 +92,8 @@ def scanAtom(args):
                 belong = scanBox(minXYZ, (scanBoxIdxX, scanBoxIdxY, scanBoxIdxZ),
                                  (scanBoxNearX, scanBoxNearY, scanBoxNearZ, scanBoxFarX, scanBoxFarY, scanBoxFarZ),
                                  boxLen,
-                                 atomIdx, atomRad, atomXYZ, atomNeighIdxs,
-                                 atomsSurfIdxs, atomsXYZ, atomsNeighIdxs,
+                                 atomIdx, atomRad, atomXYZ, atomSurfNeighIdxs, atomSurfFrame,
+                                 atomsXYZ,
                                  bufferDist, rmInSurf)
                 if belong == 'surf':
                     atomSurfBoxs.append((scanBoxIdxX, scanBoxIdxY, scanBoxIdxZ))
@@ -100,13 +105,13 @@ def scanAtom(args):
 # @annotate('scanAtomsForLoop', color='cyan')
 @njit(fastmath=True, cache=True)
 def scanAtomsForLoop(atomsIdxs, magn, boxLen, minXYZ,
-                     atomsRad, atomsSurfIdxs, atomsXYZ, atomsNeighIdxs,
+                     atomsRad, surfNeighEnds, atomsSurfFrames, atomsXYZ, atomsNeighIdxs,
                      bufferDist=5.0, rmInSurf=True):
     """Serialised loop to scan the atoms for timing comparison with the parallelised version."""
     allAtomsSurfBoxs, allAtomsBulkBoxs = [], []
     for atomIdx in atomsIdxs:
         scanAtomInp = (magn, boxLen, minXYZ, atomIdx,
-                       atomsRad[atomIdx], atomsSurfIdxs, atomsXYZ, atomsNeighIdxs, 
+                       atomsRad[atomIdx], surfNeighEnds, atomsSurfFrames, atomsXYZ, atomsNeighIdxs, 
                        bufferDist, rmInSurf)
         atomSurfBoxs, atomBulkBoxs = scanAtom(scanAtomInp)
         allAtomsSurfBoxs.extend(atomSurfBoxs)
@@ -114,20 +119,40 @@ def scanAtomsForLoop(atomsIdxs, magn, boxLen, minXYZ,
     return allAtomsSurfBoxs, allAtomsBulkBoxs
 
 
+# @annotate('scanSharedAtoms', color='cyan')
+def scanSharedAtoms(args):
+    """Count the number of boxes that cover the outer spherical surface of a chunk of atoms, from shared arrays."""
+    arrsSpecs, atomsIdxs, magn, boxLen, minXYZ, bufferDist, rmInSurf = args
+    with attachArrays(arrsSpecs) as sharedArrs:
+        atomsRad, surfNeighEnds, pairPtrs, pairLocIdxs, pairNormals, pairInnerDots, avgInnerXYZs, atomsXYZ, neighPtrs, \
+            neighIdxs = sharedArrs
+        return scanAtomsForLoop(atomsIdxs, magn, boxLen, minXYZ,
+                                atomsRad, surfNeighEnds, (pairPtrs, pairLocIdxs, pairNormals, pairInnerDots, avgInnerXYZs),
+                                atomsXYZ, (neighPtrs, neighIdxs), bufferDist, rmInSurf)
+
+
 # @annotate('scanAllAtoms', color='magenta')
 def scanAllAtoms(args):
-    """Count the number of boxes that cover the outer spherical surface of a set of atoms for a given box size."""
-    magn, boxLen, atomsIdxs, minXYZ, atomsRad, atomsSurfIdxs, atomsXYZ, atomsNeighIdxs, bufferDist, rmInSurf, verbose, maxCPU = args
-    scanAtomInps = [(magn, boxLen, minXYZ, atomIdx, atomsRad[atomIdx],
-                     atomsSurfIdxs, atomsXYZ, atomsNeighIdxs, bufferDist, rmInSurf) for atomIdx in atomsIdxs]
-    allAtomsSurfBoxs, allAtomsBulkBoxs = [], []
-    with Pool(max_workers=maxCPU) as pool:
-        for scanAtomResult in pool.map(scanAtom, scanAtomInps, chunksize=ceil(len(atomsIdxs) / maxCPU)):
-            allAtomsSurfBoxs.extend(scanAtomResult[0])
-            allAtomsBulkBoxs.extend(scanAtomResult[1])
-    # allAtomsSurfBoxs, allAtomsBulkBoxs = scanAtomsForLoop(atomsIdxs, magn, boxLen, minXYZ,
-    #                                                       atomsRad, atomsSurfIdxs, atomsXYZ, atomsNeighIdxs,
-    #                                                       bufferDist, rmInSurf)
+    """
+    Count the number of boxes that cover the outer spherical surface of a set of atoms for a given box size.
+
+    The workers attach the per-atom arrays from shared memory and are only sent a chunk of atom indices each.
+    """
+    magn, boxLen, atomsIdxs, minXYZ, atomsRad, surfNeighEnds, atomsSurfFrames, atomsXYZ, atomsNeighIdxs, bufferDist, \
+        rmInSurf, verbose, maxCPU = args
+    if maxCPU > 1:
+        allAtomsSurfBoxs, allAtomsBulkBoxs = [], []
+        with shareArrays((atomsRad, surfNeighEnds, *atomsSurfFrames, atomsXYZ, *atomsNeighIdxs)) as arrsSpecs, \
+                Pool(max_workers=maxCPU) as pool:
+            scanSharedAtomsInps = [(arrsSpecs, atomsIdxsChunk, magn, boxLen, minXYZ, bufferDist, rmInSurf)
+                                   for atomsIdxsChunk in np.array_split(atomsIdxs, maxCPU)]
+            for scanAtomsResult in pool.map(scanSharedAtoms, scanSharedAtomsInps):
+                allAtomsSurfBoxs.extend(scanAtomsResult[0])
+                allAtomsBulkBoxs.extend(scanAtomsResult[1])
+    else:
+        allAtomsSurfBoxs, allAtomsBulkBoxs = scanAtomsForLoop(atomsIdxs, magn, boxLen, minXYZ,
+                                                              atomsRad, surfNeighEnds, atomsSurfFrames, atomsXYZ,
+                                                              atomsNeighIdxs, bufferDist, rmInSurf)
     allAtomsSurfBoxs, allAtomsBulkBoxs = set(allAtomsSurfBoxs), set(allAtomsBulkBoxs)
     allAtomsSurfBoxs.difference_update(allAtomsBulkBoxs)
 
@@ -153,7 +178,7 @@ def writeBoxCoords(atomsEle, atomsXYZ, allSurfBoxs, allBulkBoxs, minXYZ, boxLens
                 f.write('\n')
             f.write(f"{len(atomsEle) + len(allSurfBoxs[i]) + len(allBulkBoxs[i])}\n")
             for (j, atomXYZ) in enumerate(atomsXYZ):
-                f.write(f"\n{atomsEle[j]}\t{atomXYZ[0]} {atomXYZ[1]} {atomXYZ[2]}")
+                f.write(f"\n{ELE_SYMBOLS[atomsEle[j]]}\t{atomXYZ[0]} {atomXYZ[1]} {atomXYZ[2]}")
             for (boxIDX, boxIDY, boxIDZ) in allSurfBoxs[i]:
                 boxX = minX - bufferDist + boxIDX*boxLen + boxLen/2
                 boxY = minY - bufferDist + boxIDY*boxLen + boxLen/2
@@ -170,44 +195,49 @@ def writeBoxCoords(atomsEle, atomsXYZ, allSurfBoxs, allBulkBoxs, minXYZ, boxLens
 @njit(fastmath=True, cache=True)
 def findAtomsWithSurfNeighs(atomsNeighIdxs, atomsSurfIdxs):
     """Find atoms with neighbours that are on the surface."""
+    neighPtrs, neighIdxs = atomsNeighIdxs
+    isSurf = np.zeros(len(neighPtrs) - 1, dtype=np.bool_)
+    isSurf[atomsSurfIdxs] = True
     atomsIdxs = []
-    for (atomIdx, atomNeighIdxs) in enumerate(atomsNeighIdxs):
-        for neighIdx in atomNeighIdxs:
-            if neighIdx < 0:
-                break
-            if neighIdx in atomsSurfIdxs:
+    for atomIdx in range(len(neighPtrs) - 1):
+        for neighIdx in neighIdxs[neighPtrs[atomIdx]:neighPtrs[atomIdx + 1]]:
+            if isSurf[neighIdx]:
                 atomsIdxs.append(atomIdx)
                 break
     return np.array(atomsIdxs) if len(atomsIdxs) > 0 else atomsSurfIdxs
 
 
 # @annotate('exactBoxCnts', color='blue')
-def exactBoxCnts(atomsEle, atomsRad, atomsSurfIdxs, atomsXYZ, atomsNeighIdxs,
-                 maxRange, minMaxBoxLens, minXYZ, npName, 
+def exactBoxCnts(atomsEle, atomsRad=None, atomsSurfIdxs=None, atomsXYZ=None, atomsNeighIdxs=None,
+                 maxRange=None, minMaxBoxLens=None, minXYZ=None, npName='structure',
                  outDir='outputs', numCPUs=None, numBoxLen=10, bufferDist=5.0,
-                 rmInSurf=True, writeBox=True, verbose=False):
+                 rmInSurf=True, writeBox=True, verbose=False, dtype=np.float64):
     """
     Count the boxes that cover the outer surface of a set of overlapping spheres represented as exact spheres for different box sizes.
     
     Parameters
     ----------
-    atomsEle : 1D ndarray of strs
-        Element type of each atom.
-    atomsRad : 1D ndarray of floats
+    atomsEle : Union[1D ndarray of uint8, Structure]
+        Element type of each atom, either encoded as atomic number or as element symbol, or a Structure providing the
+        per-atom arrays below (which are then ignored) and defaults for 'maxRange' and 'minXYZ'. The surface of a
+        periodic Structure is measured within its cell, using the periodic images of the atoms as their neighbours.
+    atomsRad : 1D ndarray of floats, optional
         Radius of each atom.
-    atomsSurfIdxs : 1D ndarray of ints
+    atomsSurfIdxs : 1D ndarray of ints, optional
         Indices of surface atoms.
-    atomsXYZ : 2D ndarray of floats
+    atomsXYZ : 2D ndarray of floats, optional
         Cartesian coordinates of each atom.
-    atomsNeighIdxs : 2D ndarray of ints
-        Neighbour atoms indices of each atom.
-    maxRange : float
-        Maximum range among all dimensions of the Cartesian space, defines the borders of the largest box.
-    minMaxBoxLens : tuple of floats
-        Minimum and maximum box lengths.
-    minXYZ : 1D ndarray of floats
-        Minimum values of each dimension in the Cartesian space.
-    npName : str
+    atomsNeighIdxs : tuple of 1D ndarrays of ints, optional
+        Neighbour atoms indices of each atom in compressed sparse row form, as returned by findNN().
+        A 2D array padded with -1 is converted.
+    maxRange : float, optional
+        Maximum range among all dimensions of the Cartesian space, defines the borders of the largest box, defaults to
+        that of 'atomsXYZ'.
+    minMaxBoxLens : tuple of floats, optional
+        Minimum and maximum box lengths, defaults to 0.25 and 1 times the minimum atomic radius.
+    minXYZ : 1D ndarray of floats, optional
+        Minimum values of each dimension in the Cartesian space, defaults to those of 'atomsXYZ'.
+    npName : str, optional
         Identifier of the measured object, which forms part of the output file name, ideally unique.
     outDir : str, optional
         Path to the directory to store the output files.
@@ -223,6 +253,8 @@ def exactBoxCnts(atomsEle, atomsRad, atomsSurfIdxs, atomsXYZ, atomsNeighIdxs,
         Whether to generate output files for visualisation.
     verbose : bool, optional
         Whether to display the details.
+    dtype : {np.float64, np.float32}, optional
+        Floating point type of the coordinates and radii used to classify the boxes.
     
     Returns
     -------
@@ -237,8 +269,24 @@ def exactBoxCnts(atomsEle, atomsRad, atomsSurfIdxs, atomsXYZ, atomsNeighIdxs,
     >>> neighs, _ = findNN(rads, xyzs, minxyz, maxxyz, 1.2)
     >>> surfs = findSurf(xyzs, neighs, 'alphaShape', 5.0)
     >>> scalesES, countsES = exactBoxCnts(eles, rads, surfs, xyzs, neighs, 100, (0.2, 1), minxyz, 'example')
+    >>> scalesES, countsES = exactBoxCnts(Structure.fromFile('example.xyz'), npName='example')
     """
-    atomsIdxs = atomsSurfIdxs if rmInSurf else np.array(range(len(atomsEle)))
+    numAtoms = len(atomsEle)
+    if isinstance(atomsEle, Structure):
+        struct = atomsEle
+        atomsEle, atomsRad, atomsSurfIdxs, atomsXYZ, atomsNeighIdxs = struct.engineInps()
+        maxRange = struct.maxRange if maxRange is None else maxRange
+        minXYZ = struct.minXYZ if minXYZ is None else minXYZ
+    elif maxRange is None or minXYZ is None:
+        atomsMaxRange, atomsMinXYZ, _ = getMinMaxXYZ(np.asarray(atomsXYZ))
+        maxRange = atomsMaxRange if maxRange is None else maxRange
+        minXYZ = atomsMinXYZ if minXYZ is None else minXYZ
+    atomsNeighIdxs, surfNeighEnds = splitSurfNeighs(csrNeighs(atomsNeighIdxs), atomsSurfIdxs)
+    atomsRad, atomsXYZ, minXYZ = (np.asarray(arr, dtype=dtype) for arr in (atomsRad, atomsXYZ, minXYZ))
+    atomsSurfFrames = calcSurfFrames(atomsXYZ, atomsNeighIdxs, surfNeighEnds)
+    if minMaxBoxLens is None:
+        minMaxBoxLens = (0.25 * atomsRad.min(), atomsRad.min())
+    atomsIdxs = atomsSurfIdxs[atomsSurfIdxs < numAtoms] if rmInSurf else np.array(range(numAtoms))  # Skip periodic images
     if numCPUs is None: 
         numCPUs = len(sched_getaffinity(0))
     # Resource allocations for parallelisation, rooms are available for further optimisation
@@ -266,7 +314,7 @@ def exactBoxCnts(atomsEle, atomsRad, atomsSurfIdxs, atomsXYZ, atomsNeighIdxs,
         magnFac = int(overallBoxLen / approxScanBoxLen)
         scanBoxLen = overallBoxLen / magnFac
         scanAllAtomsInp = (magnFac, scanBoxLen, atomsIdxs, minXYZ,
-                           atomsRad, atomsSurfIdxs, atomsXYZ, atomsNeighIdxs, bufferDist,
+                           atomsRad, surfNeighEnds, atomsSurfFrames, atomsXYZ, atomsNeighIdxs, bufferDist,
                            rmInSurf, verbose, atomConcMaxCPU)
         if boxLenConcMaxCPU > 1:
             scanAllAtomsInps.append(scanAllAtomsInp) 
@@ -293,7 +341,7 @@ def exactBoxCnts(atomsEle, atomsRad, atomsSurfIdxs, atomsXYZ, atomsNeighIdxs,
     if writeBox:
         if not isdir(outDir):
             mkdir(outDir)
-        writeBoxCoords(atomsEle, atomsXYZ, allLensSurfBoxs, allLensBulkBoxs, minXYZ, scanBoxLens, bufferDist, 
+        writeBoxCoords(encodeEles(atomsEle), atomsXYZ, allLensSurfBoxs, allLensBulkBoxs, minXYZ, scanBoxLens, bufferDist, 
                        outDir, npName)
     return scales, counts
 
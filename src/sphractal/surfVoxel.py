@@ -1,20 +1,22 @@
 from concurrent.futures import ProcessPoolExecutor as Pool
-from math import ceil, cos, log10, pi, sin, sqrt
+from math import cos, floor, log10, pi, sin, sqrt
 from os import mkdir, sched_getaffinity, system
 from os.path import isdir
 
 from numba import njit
 import numpy as np
 
-from sphractal.constants import ATOMIC_RAD_DICT, METALLIC_RAD_DICT
-from sphractal.utils import calcDist, oppositeInnerAtoms
+from sphractal.constants import ATOMIC_RAD_ARR, METALLIC_RAD_ARR
+from sphractal.structure import Structure
+from sphractal.utils import attachArrays, calcDist, calcSurfFrames, csrNeighs, encodeEles, findAtomNeighs, \
+    getSurfFrame, oppositeInnerAtoms, shareArrays, splitSurfNeighs
 # from sphractal.utils import annotate
 
 
 @njit(fastmath=True, cache=True)
-def fibonacciSphere(numPoints, sphereRad):
-    """Generate evenly spread points on the surface of a sphere with a specified radius."""
-    xyzs = np.empty((numPoints, 3), dtype=np.float64)
+def fibonacciSphere(numPoints, sphereRad, dtype=np.float64):
+    """Generate evenly spread points on the surface of a sphere with a specified radius, in a given floating point type."""
+    xyzs = np.empty((numPoints, 3), dtype=dtype)
     phi = pi * (sqrt(5)-1)  # Golden angle (radians)
     for i in range(numPoints):
         y = 1 - (i / float(numPoints-1))*2  # y \in [1, -1]
@@ -35,82 +37,331 @@ def withinNeighRad(surfPointXYZ, atomNeighIdxs, atomsRad, atomsXYZ):
     return False
 
 
+# @annotate('pointsOnAtoms', color='cyan')
 @njit(fastmath=True, cache=True)
-def rmPoint(args):
-    """Check whether a point falls on the outer surface."""
-    surfPoint, atomXYZ, atomNeighIdxs, atomsRad, atomsXYZ, rmInSurf, atomsSurfIdxs, atomsNeighIdxs = args
-    surfPointXYZ = surfPoint + atomXYZ
-    if withinNeighRad(surfPointXYZ, atomNeighIdxs, atomsRad, atomsXYZ):
-        return 'isWithinRad', surfPointXYZ
-    if (not rmInSurf) or (rmInSurf and oppositeInnerAtoms(surfPointXYZ, atomXYZ,
-                                                          atomNeighIdxs, atomsSurfIdxs, atomsXYZ, atomsNeighIdxs)):
-        return 'toExclude', surfPointXYZ
-    return 'toInclude', surfPointXYZ
-
-
-# @annotate('pointsOnAtom', color='cyan')
-def pointsOnAtom(args):
-    """Generate surface points around an atom and classify them as either inner or outer surface."""
-    atomIdx, numPoints, atomsSurfIdxs, atomsRad, atomsXYZ, atomsNeighIdxs, maxCPU, surfPoints, rmInSurf = args
-    if surfPoints is None:
-        surfPoints = fibonacciSphere(numPoints, atomsRad[atomIdx])
-    atomXYZ, atomNeighIdxsPadded = atomsXYZ[atomIdx], atomsNeighIdxs[atomIdx]
-    atomNeighIdxs = atomNeighIdxsPadded[atomNeighIdxsPadded > -1]
-    rmPointInp, outerSurfs, innerSurfs = [], [], []
-
-    # Include points that fall on surface of interest
-    for surfPoint in surfPoints:
-        if maxCPU > 1:
-            rmPointInp.append((surfPoint, atomXYZ, atomNeighIdxs, atomsRad, atomsXYZ, rmInSurf, atomsSurfIdxs, atomsNeighIdxs))
-            continue
-        pointPosition, surfPointXYZ = rmPoint((surfPoint, atomXYZ, atomNeighIdxs, atomsRad, atomsXYZ, rmInSurf, atomsSurfIdxs, atomsNeighIdxs))
-        if pointPosition == 'toExclude':
-            outerSurfs.append(surfPointXYZ)
-        elif pointPosition == 'toInclude':
-            innerSurfs.append(surfPointXYZ)
+def pointsOnAtoms(args):
+    """
+    Generate surface points around a set of atoms and classify them as either outer or inner surface.
+
+    The points around each atom are copied from the template sphere of its element, and those falling within the
+    radius of a neighbouring atom are dropped. The kept points are written into buffers that grow with them, so the
+    memory scales with the number of exposed points rather than with the number of points generated. The neighbour
+    atoms indices and 'surfNeighEnds' are the outputs of splitSurfNeighs(), 'atomsSurfFrames' is the output of
+    calcSurfFrames().
+    """
+    atomsIdxs, atomsSphereIdxs, spheresPoints, atomsRad, atomsXYZ, atomsNeighIdxs, surfNeighEnds, atomsSurfFrames, \
+        rmInSurf = args
+    neighPtrs, neighIdxs = atomsNeighIdxs
+    numPoints = spheresPoints.shape[1]
+    outerPointXYZs, numOuterPoints = np.empty((numPoints, 3), dtype=atomsXYZ.dtype), 0
+    innerPointXYZs, numInnerPoints = np.empty((numPoints, 3), dtype=atomsXYZ.dtype), 0
+    for (i, atomIdx) in enumerate(atomsIdxs):
+        atomXYZ, atomNeighIdxs = atomsXYZ[atomIdx], neighIdxs[neighPtrs[atomIdx]:neighPtrs[atomIdx + 1]]
+        atomSurfNeighIdxs, _ = findAtomNeighs(atomIdx, atomsNeighIdxs, surfNeighEnds)
+        atomSurfFrame = getSurfFrame(atomIdx, atomsSurfFrames)
+        # Make room for all points of the atom on either surface, doubling the buffers to amortise the copies
+        outerPointXYZs = growRows(outerPointXYZs, numOuterPoints + numPoints)
+        innerPointXYZs = growRows(innerPointXYZs, numInnerPoints + numPoints)
+        for surfPoint in spheresPoints[atomsSphereIdxs[i]]:
+            surfPointXYZ = surfPoint + atomXYZ
+            if withinNeighRad(surfPointXYZ, atomNeighIdxs, atomsRad, atomsXYZ):
+                continue
+            if (not rmInSurf) or oppositeInnerAtoms(surfPointXYZ, atomXYZ, atomSurfNeighIdxs, atomSurfFrame, atomsXYZ):
+                outerPointXYZs[numOuterPoints] = surfPointXYZ
+                numOuterPoints += 1
+            else:
+                innerPointXYZs[numInnerPoints] = surfPointXYZ
+                numInnerPoints += 1
+    return outerPointXYZs[:numOuterPoints], innerPointXYZs[:numInnerPoints]
+
+
+@njit(fastmath=True, cache=True)
+def growRows(arr, minNumRows):
+    """Return an array of at least 'minNumRows' rows, either 'arr' itself or a copy of it with its rows doubled."""
+    if len(arr) >= minNumRows:
+        return arr
+    newArr = np.empty((max(2 * len(arr), minNumRows), arr.shape[1]), dtype=arr.dtype)
+    newArr[:len(arr)] = arr
+    return newArr
+
+
+# @annotate('pointsOnSharedAtoms', color='cyan')
+def pointsOnSharedAtoms(args):
+    """Generate and classify surface points around a range of the atoms to scan, from shared arrays."""
+    arrsSpecs, scanStart, scanEnd, rmInSurf = args
+    with attachArrays(arrsSpecs) as sharedArrs:
+        scanIdxs, atomsSphereIdxs, spheresPoints, atomsRad, atomsXYZ, neighPtrs, neighIdxs, surfNeighEnds, pairPtrs, \
+            pairLocIdxs, pairNormals, pairInnerDots, avgInnerXYZs = sharedArrs
+        return pointsOnAtoms((scanIdxs[scanStart:scanEnd], atomsSphereIdxs[scanStart:scanEnd], spheresPoints, atomsRad,
+                              atomsXYZ, (neighPtrs, neighIdxs), surfNeighEnds,
+                              (pairPtrs, pairLocIdxs, pairNormals, pairInnerDots, avgInnerXYZs), rmInSurf))
+
+
+@njit(fastmath=True, cache=True)
+def spreadBits(voxelIdx):
+    """Insert two zero bits between each of the lower 21 bits of a voxel index."""
+    voxelIdx &= 0x1fffff
+    voxelIdx = (voxelIdx | voxelIdx << 32) & 0x1f00000000ffff
+    voxelIdx = (voxelIdx | voxelIdx << 16) & 0x1f0000ff0000ff
+    voxelIdx = (voxelIdx | voxelIdx << 8) & 0x100f00f00f00f00f
+    voxelIdx = (voxelIdx | voxelIdx << 4) & 0x10c30c30c30c30c3
+    return (voxelIdx | voxelIdx << 2) & 0x1249249249249249
 
-    # Parallel implementation of the point position assessment algorithm
-    if maxCPU > 1:
-        with Pool(max_workers=maxCPU) as pool:
-            for rmPointResult in pool.map(rmPoint, rmPointInp, 
-                                          chunksize=ceil(numPoints / maxCPU)):
-                if rmPointResult[0] == 'toExclude':
-                    outerSurfs.append(rmPointResult[1])
-                elif rmPointResult[0] == 'toInclude':
-                    innerSurfs.append(rmPointResult[1])
 
-    return outerSurfs, innerSurfs
+@njit(fastmath=True, cache=True)
+def compactBits(voxelCode):
+    """Gather every third bit of a Morton code into a voxel index, inverse of spreadBits()."""
+    voxelCode &= 0x1249249249249249
+    voxelCode = (voxelCode ^ (voxelCode >> 2)) & 0x10c30c30c30c30c3
+    voxelCode = (voxelCode ^ (voxelCode >> 4)) & 0x100f00f00f00f00f
+    voxelCode = (voxelCode ^ (voxelCode >> 8)) & 0x1f0000ff0000ff
+    voxelCode = (voxelCode ^ (voxelCode >> 16)) & 0x1f00000000ffff
+    return (voxelCode ^ (voxelCode >> 32)) & 0x1fffff
+
+
+@njit(fastmath=True, cache=True)
+def encodeMorton(voxelXYZs):
+    """Interleave the bits of the indices of voxels along each axis (up to 2^21) into Morton codes."""
+    voxelCodes = np.empty(len(voxelXYZs), dtype=np.int64)
+    for (i, voxelXYZ) in enumerate(voxelXYZs):
+        voxelCodes[i] = spreadBits(np.int64(voxelXYZ[0])) << 2 | spreadBits(np.int64(voxelXYZ[1])) << 1 | \
+            spreadBits(np.int64(voxelXYZ[2]))
+    return voxelCodes
+
+
+@njit(fastmath=True, cache=True)
+def decodeMorton(voxelCodes):
+    """Recover the indices of voxels along each axis from their Morton codes."""
+    voxelXYZs = np.empty((len(voxelCodes), 3), dtype=np.int64)
+    for (i, voxelCode) in enumerate(voxelCodes):
+        voxelXYZs[i, 0], voxelXYZs[i, 1], voxelXYZs[i, 2] = compactBits(voxelCode >> 2), compactBits(voxelCode >> 1), \
+            compactBits(voxelCode)
+    return voxelXYZs
+
+
+@njit(fastmath=True, cache=True)
+def voxelFrame(minXYZs, maxXYZs, gridSize):
+    """
+    Return the minimum corner of a grid of 'gridSize' cubic voxels per axis spanning the largest range of a bounding
+    box and centred on it, along with the number of voxels per unit length.
+    """
+    rangeXYZs = maxXYZs - minXYZs
+    maxRange = rangeXYZs.max()
+    return minXYZs - (maxRange-rangeXYZs) * 0.5, gridSize / maxRange if maxRange > 0 else 0.0
+
+
+@njit(fastmath=True, cache=True)
+def voxelIdx(coord, cornerCoord, voxelsPerLen, gridSize):
+    """Return the index of the voxel along an axis that a coordinate lies within, clipped to the grid."""
+    return min(max(int(floor((coord-cornerCoord) * voxelsPerLen)), 0), gridSize - 1)
 
 
 # @annotate('pointsToVoxels', color='magenta')
 @njit(fastmath=True, cache=True)
 def pointsToVoxels(pointXYZs, gridSize):
-    """Turn coordinates of point clouds into coordinates of occupied voxels."""
-    # Get segmenting points in 3D space
-    rangeXYZ = np.array([pointXYZs[:, i].max() - pointXYZs[:, i].min() for i in range(3)])
-    maxRange = max(rangeXYZ)
-    minXYZs, maxXYZs, segmentXYZs = np.empty(3), np.empty(3), np.empty((3, gridSize + 1))
+    """
+    Turn coordinates of point clouds into the sorted unique Morton codes of the voxels they occupy.
+
+    The voxels are cubes spanning the largest range of the points over 'gridSize' voxels, centred on the points.
+    """
+    minXYZs, maxXYZs = np.empty(3), np.empty(3)
     for i in range(3):
-        minXYZs[i] = pointXYZs[:, i].min() - (maxRange-rangeXYZ[i]) * 0.5
-        maxXYZs[i] = pointXYZs[:, i].max() + (maxRange-rangeXYZ[i]) * 0.5
-        segmentXYZs[i] = np.linspace(minXYZs[i], maxXYZs[i], num=gridSize+1)
+        minXYZs[i], maxXYZs[i] = pointXYZs[:, i].min(), pointXYZs[:, i].max()
+    cornerXYZ, voxelsPerLen = voxelFrame(minXYZs, maxXYZs, gridSize)
 
-    # Get the index of the segment that each point lies within
-    voxelXs = np.clip(np.searchsorted(segmentXYZs[0], pointXYZs[:, 0]) - 1, 0, gridSize)
-    voxelYs = np.clip(np.searchsorted(segmentXYZs[1], pointXYZs[:, 1]) - 1, 0, gridSize)
-    voxelZs = np.clip(np.searchsorted(segmentXYZs[2], pointXYZs[:, 2]) - 1, 0, gridSize)
+    # Get the index of the voxel that each point lies within along each axis
+    voxelCodes = np.empty(len(pointXYZs), dtype=np.int64)
+    for (i, pointXYZ) in enumerate(pointXYZs):
+        voxelCode = 0
+        for j in range(3):
+            voxelCode |= spreadBits(voxelIdx(pointXYZ[j], cornerXYZ[j], voxelsPerLen, gridSize)) << (2-j)
+        voxelCodes[i] = voxelCode
+    return np.unique(voxelCodes)
 
-    # Get indices of occupied voxels after flattened
-    voxelIdxs = set(voxelXs*gridSize*gridSize + voxelYs*gridSize + voxelZs)
-    return np.column_stack((voxelXs, voxelYs, voxelZs)), voxelIdxs
+
+@njit(fastmath=True, cache=True)
+def cubeDistsSq(cubeXYZ, cubeLen, pointXYZ):
+    """Return the squared minimum and maximum distances from a point to an axis-aligned cube."""
+    minDistSq, maxDistSq = 0.0, 0.0
+    for i in range(3):
+        lowDist, highDist = cubeXYZ[i] - pointXYZ[i], pointXYZ[i] - cubeXYZ[i] - cubeLen
+        minDistSq += max(lowDist, highDist, 0.0) ** 2
+        maxDistSq += max(abs(lowDist), abs(highDist)) ** 2
+    return minDistSq, maxDistSq
+
+
+@njit(fastmath=True, cache=True)
+def closestSpherePoint(cubeXYZ, cubeLen, atomXYZ, sphereRad, pointXYZ):
+    """Fill 'pointXYZ' with the point on the sphere of an atom closest to the centre of a cube."""
+    centreDistSq = 0.0
+    for i in range(3):
+        pointXYZ[i] = cubeXYZ[i] + cubeLen*0.5 - atomXYZ[i]
+        centreDistSq += pointXYZ[i] ** 2
+    if centreDistSq == 0:
+        pointXYZ[0] = 1.0
+        centreDistSq = 1.0
+    for i in range(3):
+        pointXYZ[i] = atomXYZ[i] + pointXYZ[i] * sphereRad / sqrt(centreDistSq)
+
+
+@njit(fastmath=True, cache=True)
+def shellVoxelExposed(voxelXYZ, voxelLen, atomXYZ, sphereRad, atomNeighIdxs, atomsRad, atomsXYZ, atomSurfNeighIdxs,
+                      atomSurfFrame, rmInSurf, numSubdivs, pointXYZ, cubes):
+    """
+    Return whether a voxel contains a point on the sphere of an atom that is outside the radius of all of its
+    neighbouring atoms (and on the outer surface if 'rmInSurf').
+
+    The inner surface is told apart by the point on the sphere closest to the centre of the voxel, as in
+    pointsOnAtoms(). Parts of the voxel are then discarded if they miss the sphere or lie entirely within a
+    neighbouring atom, and accepted if they lie entirely outside the neighbouring atoms. The undecided parts are split
+    into octants up to 'numSubdivs' times, after which their point on the sphere closest to their centre decides if it
+    lies within them.
+    'pointXYZ' and 'cubes' (of 7*numSubdivs + 1 rows and 4 columns) are work arrays reused across voxels.
+    """
+    if rmInSurf:
+        closestSpherePoint(voxelXYZ, voxelLen, atomXYZ, sphereRad, pointXYZ)
+        if not oppositeInnerAtoms(pointXYZ, atomXYZ, atomSurfNeighIdxs, atomSurfFrame, atomsXYZ):
+            return False
+    cubes[0, :3], cubes[0, 3], numCubes = voxelXYZ, 0, 1
+    while numCubes > 0:
+        numCubes -= 1
+        cubeXYZ, depth = cubes[numCubes, :3], int(cubes[numCubes, 3])
+        cubeLen = voxelLen / 2**depth
+        minDistSq, maxDistSq = cubeDistsSq(cubeXYZ, cubeLen, atomXYZ)
+        if minDistSq > sphereRad*sphereRad or maxDistSq < sphereRad*sphereRad:
+            continue
+        isBuried, isExposed = False, True
+        for neighIdx in atomNeighIdxs:
+            minDistSq, maxDistSq = cubeDistsSq(cubeXYZ, cubeLen, atomsXYZ[neighIdx])
+            if maxDistSq <= atomsRad[neighIdx]*atomsRad[neighIdx]:
+                isBuried = True
+                break
+            if minDistSq <= atomsRad[neighIdx]*atomsRad[neighIdx]:
+                isExposed = False
+        if isBuried:
+            continue
+        if isExposed:
+            return True
+        if depth == numSubdivs:
+            closestSpherePoint(cubeXYZ, cubeLen, atomXYZ, sphereRad, pointXYZ)
+            isInCube = True
+            for i in range(3):
+                isInCube = isInCube and cubeXYZ[i] <= pointXYZ[i] <= cubeXYZ[i] + cubeLen
+            if isInCube and not withinNeighRad(pointXYZ, atomNeighIdxs, atomsRad, atomsXYZ):
+                return True
+            continue
+        # The popped cube is overwritten by its first octant
+        cubeX, cubeY, cubeZ, halfLen = cubeXYZ[0], cubeXYZ[1], cubeXYZ[2], cubeLen * 0.5
+        for octant in range(8):
+            cubes[numCubes, 0] = cubeX + halfLen*(octant >> 2)
+            cubes[numCubes, 1] = cubeY + halfLen*(octant >> 1 & 1)
+            cubes[numCubes, 2] = cubeZ + halfLen*(octant & 1)
+            cubes[numCubes, 3] = depth + 1
+            numCubes += 1
+    return False
+
+
+# @annotate('shellsOnAtoms', color='cyan')
+@njit(fastmath=True, cache=True)
+def shellsOnAtoms(args):
+    """
+    Rasterise the exposed spherical shell of a set of atoms into the sorted unique Morton codes of the voxels it
+    crosses, without generating surface points.
+
+    The voxels crossed by each sphere are enumerated column by column along the z axis, in which the sphere spans at
+    most two intervals, so the cost scales with the number of surface voxels. Each of them is then checked against the
+    neighbouring atoms by shellVoxelExposed(). The neighbour atoms indices and 'surfNeighEnds' are the outputs of
+    splitSurfNeighs(), 'atomsSurfFrames' is the output of calcSurfFrames(), the grid is given by voxelFrame().
+    """
+    atomsIdxs, spheresRad, atomsRad, atomsXYZ, atomsNeighIdxs, surfNeighEnds, atomsSurfFrames, cornerXYZ, voxelsPerLen, \
+        gridSize, rmInSurf, numSubdivs = args
+    neighPtrs, neighIdxs = atomsNeighIdxs
+    voxelLen = 1.0 / voxelsPerLen
+    voxelCodes, numVoxels = np.empty(1024, dtype=np.int64), 0
+    voxelXYZ, pointXYZ = np.empty(3, dtype=atomsXYZ.dtype), np.empty(3, dtype=atomsXYZ.dtype)
+    cubes = np.empty((7*numSubdivs + 1, 4), dtype=atomsXYZ.dtype)
+    for (i, atomIdx) in enumerate(atomsIdxs):
+        atomXYZ, sphereRad = atomsXYZ[atomIdx], spheresRad[i]
+        atomNeighIdxs = neighIdxs[neighPtrs[atomIdx]:neighPtrs[atomIdx + 1]]
+        atomSurfNeighIdxs, _ = findAtomNeighs(atomIdx, atomsNeighIdxs, surfNeighEnds)
+        atomSurfFrame = getSurfFrame(atomIdx, atomsSurfFrames)
+        minX, maxX = voxelIdx(atomXYZ[0] - sphereRad, cornerXYZ[0], voxelsPerLen, gridSize), \
+            voxelIdx(atomXYZ[0] + sphereRad, cornerXYZ[0], voxelsPerLen, gridSize)
+        minY, maxY = voxelIdx(atomXYZ[1] - sphereRad, cornerXYZ[1], voxelsPerLen, gridSize), \
+            voxelIdx(atomXYZ[1] + sphereRad, cornerXYZ[1], voxelsPerLen, gridSize)
+        for voxelX in range(minX, maxX + 1):
+            voxelXYZ[0] = cornerXYZ[0] + voxelX*voxelLen
+            lowDistX, highDistX = voxelXYZ[0] - atomXYZ[0], atomXYZ[0] - voxelXYZ[0] - voxelLen
+            for voxelY in range(minY, maxY + 1):
+                voxelXYZ[1] = cornerXYZ[1] + voxelY*voxelLen
+                lowDistY, highDistY = voxelXYZ[1] - atomXYZ[1], atomXYZ[1] - voxelXYZ[1] - voxelLen
+                minDistSq = max(lowDistX, highDistX, 0.0)**2 + max(lowDistY, highDistY, 0.0)**2
+                maxDistSq = max(abs(lowDistX), abs(highDistX))**2 + max(abs(lowDistY), abs(highDistY))**2
+                if minDistSq > sphereRad*sphereRad:
+                    continue
+                # The sphere crosses the column within the upper and lower caps between these heights from its centre
+                maxHeight = sqrt(sphereRad*sphereRad - minDistSq)
+                minHeight = sqrt(max(sphereRad*sphereRad - maxDistSq, 0.0))
+                for (lowZ, highZ) in ((atomXYZ[2] + minHeight, atomXYZ[2] + maxHeight),
+                                      (atomXYZ[2] - maxHeight, atomXYZ[2] - minHeight)):
+                    for voxelZ in range(voxelIdx(lowZ, cornerXYZ[2], voxelsPerLen, gridSize),
+                                        voxelIdx(highZ, cornerXYZ[2], voxelsPerLen, gridSize) + 1):
+                        voxelXYZ[2] = cornerXYZ[2] + voxelZ*voxelLen
+                        if not shellVoxelExposed(voxelXYZ, voxelLen, atomXYZ, sphereRad, atomNeighIdxs, atomsRad,
+                                                 atomsXYZ, atomSurfNeighIdxs, atomSurfFrame, rmInSurf, numSubdivs,
+                                                 pointXYZ, cubes):
+                            continue
+                        if numVoxels == len(voxelCodes):
+                            voxelCodes = np.concatenate((voxelCodes, np.empty(numVoxels, dtype=np.int64)))
+                        voxelCodes[numVoxels] = spreadBits(voxelX) << 2 | spreadBits(voxelY) << 1 | spreadBits(voxelZ)
+                        numVoxels += 1
+    return np.unique(voxelCodes[:numVoxels])
+
+
+# @annotate('shellsOnSharedAtoms', color='cyan')
+def shellsOnSharedAtoms(args):
+    """Rasterise the exposed spherical shell of a range of the atoms to scan into voxels, from shared arrays."""
+    arrsSpecs, scanStart, scanEnd, cornerXYZ, voxelsPerLen, gridSize, rmInSurf, numSubdivs = args
+    with attachArrays(arrsSpecs) as sharedArrs:
+        scanIdxs, spheresRad, atomsRad, atomsXYZ, neighPtrs, neighIdxs, surfNeighEnds, pairPtrs, pairLocIdxs, \
+            pairNormals, pairInnerDots, avgInnerXYZs = sharedArrs
+        return shellsOnAtoms((scanIdxs[scanStart:scanEnd], spheresRad[scanStart:scanEnd], atomsRad, atomsXYZ,
+                              (neighPtrs, neighIdxs), surfNeighEnds,
+                              (pairPtrs, pairLocIdxs, pairNormals, pairInnerDots, avgInnerXYZs), cornerXYZ,
+                              voxelsPerLen, gridSize, rmInSurf, numSubdivs))
+
+
+@njit(fastmath=True, cache=True)
+def voxelsBoxCnts(voxelCodes, gridSize):
+    """
+    Count the boxes that cover a set of occupied voxels for dyadic box sizes, by successively coarsening the voxels.
+
+    'voxelCodes' are the sorted unique Morton codes of the voxels, so the boxes of length 2^k are the distinct values
+    among the codes shifted right by 3k bits, which stay sorted. Box lengths (in voxels) range from 2 up to half of the
+    grid size, as counted by the C++ code written by Ruiz de Miras and Posadas. Returns the box lengths in ascending
+    order and the corresponding box counts.
+    """
+    numLevels = 0
+    while 2 ** (numLevels + 2) <= gridSize:
+        numLevels += 1
+    boxLens, counts = np.empty(numLevels, dtype=np.int64), np.empty(numLevels, dtype=np.int64)
+    for level in range(numLevels):
+        shift, count, prevBoxCode = 3 * (level+1), 0, -1
+        for voxelCode in voxelCodes:
+            boxCode = voxelCode >> shift
+            if boxCode != prevBoxCode:
+                count += 1
+                prevBoxCode = boxCode
+        boxLens[level], counts[level] = 2 ** (level + 1), count
+    return boxLens, counts
 
 
 # @annotate('writeSurfVoxelIdxs', color='yellow')
-def writeSurfVoxelIdxs(outDir, voxelIdxs):
+def writeSurfVoxelIdxs(outDir, voxelXYZs, gridSize):
     """Generate a txt file required for 3D box-counting using C++ code written by Ruiz de Miras and Posadas."""
     with open(f"{outDir}/surfVoxelIdxs.txt", 'w') as f:
-        for idx in voxelIdxs:
-            f.write(f"{idx}\n")
+        for (voxelX, voxelY, voxelZ) in voxelXYZs:
+            f.write(f"{voxelX*gridSize*gridSize + voxelY*gridSize + voxelZ}\n")
 
 
 # @annotate('writePCD', color='yellow')
@@ -166,98 +417,141 @@ def writeSurfVoxels(outDir, npName, surfVoxelXYZs):
 def genSurfPoints(atomsEle, atomsRad, atomsSurfIdxs, atomsXYZ, atomsNeighIdxs,
                   npName, outDir='outputs', numCPUs=None, 
                   radType='atomic', numPoints=10000, gridNum=1024,
-                  rmInSurf=True, vis=False, verbose=False, genPCD=False):
-    """Generate point clouds approximating the outer spherical surface formed by a set of atoms."""
+                  rmInSurf=True, vis=False, verbose=False, genPCD=False, numAtoms=None):
+    """
+    Generate point clouds approximating the outer spherical surface formed by a set of atoms, returning the Morton codes of the voxels they occupy.
+
+    Only the surface atoms among the first 'numAtoms' atoms are covered with points, the rest being periodic images.
+    The points are generated in the floating point type of 'atomsXYZ'.
+    """
+    scanIdxs = atomsSurfIdxs if numAtoms is None else atomsSurfIdxs[atomsSurfIdxs < numAtoms]
     # Avoid repeating generation of surface points around atoms with the same radii
-    radDict = ATOMIC_RAD_DICT if radType == 'atomic' else METALLIC_RAD_DICT
-    surfPointsEles = {atomEle: fibonacciSphere(numPoints, radDict[atomEle]) for atomEle in set(atomsEle)}
+    radArr = ATOMIC_RAD_ARR if radType == 'atomic' else METALLIC_RAD_ARR
+    atomsEle = encodeEles(atomsEle)
+    sphereEles, atomsSphereIdxs = np.unique(atomsEle[scanIdxs], return_inverse=True)
+    spheresPoints = np.array([fibonacciSphere(numPoints, radArr[atomEle], atomsXYZ.dtype.type) for atomEle in sphereEles])
+    spheresPoints = spheresPoints.reshape(len(sphereEles), numPoints, 3)
+    # Surface membership and local surface geometry of the atoms are computed once here rather than for every point
+    atomsNeighIdxs, surfNeighEnds = splitSurfNeighs(atomsNeighIdxs, atomsSurfIdxs)
+    atomsSurfFrames = calcSurfFrames(atomsXYZ, atomsNeighIdxs, surfNeighEnds)
 
-    # Resource allocations for parallelisation, rooms are available for further optimisation
     if numCPUs is None: 
         numCPUs = len(sched_getaffinity(0))
-    minAtomCPU = max(1, len(atomsSurfIdxs) // 25)
-    maxPointCPUperAtom = ceil(numPoints / numPoints)  # ceil(numPoints / 25)
-    if numCPUs > maxPointCPUperAtom * minAtomCPU:
-        atomConcMaxCPU = numCPUs // maxPointCPUperAtom
-        pointConcMaxCPU = maxPointCPUperAtom
-    # elif numCPUs > minAtomCPU:
-    #     atomConcMaxCPU = minAtomCPU
-    #     pointConcMaxCPU = numCPUs // minAtomCPU
-    else:
-        atomConcMaxCPU, pointConcMaxCPU = numCPUs, 1
+    numCPUs = max(1, min(numCPUs, len(scanIdxs) // 25))
     if verbose:
-        print(f"    Assessing points over:\n      {len(atomsSurfIdxs)} atoms using {atomConcMaxCPU} cpu(s)...\n"
-              f"      {numPoints} points using {pointConcMaxCPU} cpu(s)...")
-
-    # Generate point clouds and convert to voxels
-    surfPointXYZs, nonSurfPointXYZs = [], []
-    pointsOnAtomInp = []
-    for atomIdx in atomsSurfIdxs:
-        if atomConcMaxCPU > 1:  # Adjust back
-            pointsOnAtomInp.append((atomIdx, numPoints, atomsSurfIdxs, atomsRad, atomsXYZ, atomsNeighIdxs, pointConcMaxCPU,
-                                    surfPointsEles[atomsEle[atomIdx]], rmInSurf))
-        else:
-            outerSurfs, innerSurfs = pointsOnAtom((atomIdx, numPoints, atomsSurfIdxs, atomsRad, atomsXYZ, atomsNeighIdxs, pointConcMaxCPU, surfPointsEles[atomsEle[atomIdx]], rmInSurf))
-            surfPointXYZs.extend(outerSurfs)
-            nonSurfPointXYZs.extend(innerSurfs)
-
-    # Parallel implementation of the points generation around atoms
-    if atomConcMaxCPU > 1:
-        with Pool(max_workers=atomConcMaxCPU) as pool:
-            for pointsOnAtomResult in pool.map(pointsOnAtom, pointsOnAtomInp, 
-                                               chunksize=ceil(len(atomsSurfIdxs) / atomConcMaxCPU)):
-                surfPointXYZs.extend(pointsOnAtomResult[0])
-                nonSurfPointXYZs.extend(pointsOnAtomResult[1])
-
-    surfVoxelXYZs, surfVoxelIdxs = pointsToVoxels(np.array(surfPointXYZs), gridNum)
+        print(f"    Assessing {numPoints} points over {len(scanIdxs)} atoms using {numCPUs} cpu(s)...")
+
+    # Generate point clouds in batches of atoms, one per worker attaching the arrays from shared memory, and convert to voxels
+    if numCPUs > 1:
+        chunkBounds = np.linspace(0, len(scanIdxs), numCPUs + 1).astype(np.int64)
+        with shareArrays((scanIdxs, atomsSphereIdxs, spheresPoints, atomsRad, atomsXYZ, *atomsNeighIdxs, surfNeighEnds,
+                          *atomsSurfFrames)) as arrsSpecs, Pool(max_workers=numCPUs) as pool:
+            pointsOnSharedAtomsInps = [(arrsSpecs, scanStart, scanEnd, rmInSurf)
+                                       for (scanStart, scanEnd) in zip(chunkBounds[:-1], chunkBounds[1:])]
+            pointsOnAtomsResults = list(pool.map(pointsOnSharedAtoms, pointsOnSharedAtomsInps))
+    else:
+        pointsOnAtomsResults = [pointsOnAtoms((scanIdxs, atomsSphereIdxs, spheresPoints, atomsRad, atomsXYZ,
+                                               atomsNeighIdxs, surfNeighEnds, atomsSurfFrames, rmInSurf))]
+    surfPointXYZs = np.concatenate([outerPointXYZs for (outerPointXYZs, _) in pointsOnAtomsResults])
+    nonSurfPointXYZs = np.concatenate([innerPointXYZs for (_, innerPointXYZs) in pointsOnAtomsResults])
+
+    surfVoxelCodes = pointsToVoxels(surfPointXYZs, gridNum)
 
     # Generate output files
-    writeSurfVoxelIdxs(outDir, surfVoxelIdxs)
     if verbose:
-        print(f"    {len(surfPointXYZs)} surface points -> {len(surfVoxelIdxs)} voxels, # grids: {gridNum}")
+        print(f"    {len(surfPointXYZs)} surface points -> {len(surfVoxelCodes)} voxels, # grids: {gridNum}")
     if genPCD:
         writePCD(outDir, npName, surfPointXYZs)
     if vis:
         writeSurfPoints(outDir, npName, atomsSurfIdxs, atomsXYZ, surfPointXYZs, nonSurfPointXYZs)
-        writeSurfVoxels(outDir, npName, surfVoxelXYZs)
+        writeSurfVoxels(outDir, npName, decodeMorton(surfVoxelCodes))
+    return surfVoxelCodes
+
+
+# @annotate('genSurfShells', color='cyan')
+def genSurfShells(atomsEle, atomsRad, atomsSurfIdxs, atomsXYZ, atomsNeighIdxs,
+                  npName, outDir='outputs', numCPUs=None,
+                  radType='atomic', gridNum=1024, numSubdivs=8,
+                  rmInSurf=True, vis=False, verbose=False, numAtoms=None):
+    """
+    Rasterise the outer spherical surface formed by a set of atoms directly into voxels, returning their Morton codes.
+
+    Only the surface atoms among the first 'numAtoms' atoms are rasterised, the rest being periodic images. The grid
+    spans the spheres of the rasterised atoms. The voxels are located in the floating point type of 'atomsXYZ'.
+    """
+    scanIdxs = atomsSurfIdxs if numAtoms is None else atomsSurfIdxs[atomsSurfIdxs < numAtoms]
+    radArr = ATOMIC_RAD_ARR if radType == 'atomic' else METALLIC_RAD_ARR
+    spheresRad = radArr[encodeEles(atomsEle)[scanIdxs]].astype(atomsXYZ.dtype)
+    scanXYZs = atomsXYZ[scanIdxs]
+    cornerXYZ, voxelsPerLen = voxelFrame((scanXYZs - spheresRad[:, None]).min(axis=0),
+                                         (scanXYZs + spheresRad[:, None]).max(axis=0), gridNum)
+    cornerXYZ, voxelsPerLen = cornerXYZ.astype(atomsXYZ.dtype), atomsXYZ.dtype.type(voxelsPerLen)
+    atomsNeighIdxs, surfNeighEnds = splitSurfNeighs(atomsNeighIdxs, atomsSurfIdxs)
+    atomsSurfFrames = calcSurfFrames(atomsXYZ, atomsNeighIdxs, surfNeighEnds)
+
+    if numCPUs is None:
+        numCPUs = len(sched_getaffinity(0))
+    numCPUs = max(1, min(numCPUs, len(scanIdxs) // 25))
+    if verbose:
+        print(f"    Rasterising the spheres of {len(scanIdxs)} atoms using {numCPUs} cpu(s)...")
+
+    # Rasterise in batches of atoms, one per worker attaching the arrays from shared memory
+    if numCPUs > 1:
+        chunkBounds = np.linspace(0, len(scanIdxs), numCPUs + 1).astype(np.int64)
+        with shareArrays((scanIdxs, spheresRad, atomsRad, atomsXYZ, *atomsNeighIdxs, surfNeighEnds,
+                          *atomsSurfFrames)) as arrsSpecs, Pool(max_workers=numCPUs) as pool:
+            shellsOnSharedAtomsInps = [(arrsSpecs, scanStart, scanEnd, cornerXYZ, voxelsPerLen, gridNum, rmInSurf,
+                                        numSubdivs) for (scanStart, scanEnd) in zip(chunkBounds[:-1], chunkBounds[1:])]
+            surfVoxelCodes = np.unique(np.concatenate(list(pool.map(shellsOnSharedAtoms, shellsOnSharedAtomsInps))))
+    else:
+        surfVoxelCodes = shellsOnAtoms((scanIdxs, spheresRad, atomsRad, atomsXYZ, atomsNeighIdxs, surfNeighEnds,
+                                        atomsSurfFrames, cornerXYZ, voxelsPerLen, gridNum, rmInSurf, numSubdivs))
+    if verbose:
+        print(f"    {len(surfVoxelCodes)} voxels, # grids: {gridNum}")
+    if vis:
+        writeSurfVoxels(outDir, npName, decodeMorton(surfVoxelCodes))
+    return surfVoxelCodes
 
 
 # @annotate('voxelBoxCnts', color='blue')
-def voxelBoxCnts(atomsEle, atomsRad, atomsSurfIdxs, atomsXYZ, atomsNeighIdxs,
-                 npName, outDir='outputs', numCPUs=None, fastbcPath='$FASTBC',
+def voxelBoxCnts(atomsEle, atomsRad=None, atomsSurfIdxs=None, atomsXYZ=None, atomsNeighIdxs=None,
+                 npName='structure', outDir='outputs', numCPUs=None, fastbcPath=None,
                  radType='atomic', numPoints=300, gridNum=1024,
-                 rmInSurf=True, vis=True, verbose=False, genPCD=False):
+                 rmInSurf=True, vis=True, verbose=False, genPCD=False, dtype=np.float64, voxelAlg='pointCloud'):
     """
-    Count the boxes that cover the outer surface of a set of overlapping spheres represented as point clouds for different box sizes, using 3D box-counting algorithm written by Ruiz de Miras et al. in C++. 
+    Count the boxes that cover the outer surface of a set of overlapping spheres represented as point clouds for different box sizes, using a 3D box-counting algorithm on the occupied voxels.
 
-    IMPORTANT: Make sure the source code has been downloaded from https://github.com/Jon-Ting/fastBC and compiled on your machine. 'fastbcPath' should point to the right file if FASTBC is not set as an environment variable.
+    The boxes are counted in memory by voxelsBoxCnts(). Alternatively, the C++ code written by Ruiz de Miras et al. could be used by downloading the source code from https://github.com/Jon-Ting/fastBC, compiling it on your machine and pointing 'fastbcPath' to the compiled file.
     
     Parameters
     ----------
-    atomsEle : 1D ndarray of strs
-        Element type of each atom.
-    atomsRad : 1D ndarray of floats
+    atomsEle : Union[1D ndarray of uint8, Structure]
+        Element type of each atom, either encoded as atomic number or as element symbol, or a Structure providing all
+        of the per-atom arrays below (which are then ignored). The surface of a periodic Structure is measured within
+        its cell, using the periodic images of the atoms as their neighbours.
+    atomsRad : 1D ndarray of floats, optional
         Radius of each atom.
-    atomsSurfIdxs : 1D ndarray of ints
+    atomsSurfIdxs : 1D ndarray of ints, optional
         Indices of surface atoms.
-    atomsXYZ : 2D ndarray of floats
+    atomsXYZ : 2D ndarray of floats, optional
         Cartesian coordinates of each atom.
-    atomsNeighIdxs : 2D ndarray of ints
-        Neighbour atoms indices of each atom.
-    npName : str
+    atomsNeighIdxs : tuple of 1D ndarrays of ints, optional
+        Neighbour atoms indices of each atom in compressed sparse row form, as returned by findNN().
+        A 2D array padded with -1 is converted.
+    npName : str, optional
         Identifier of the measured object, which forms part of the output file name, ideally unique.
     outDir : str, optional
         Path to the directory to store the output files.
     numCPUs : int, optional
         Number of CPUs to be used for parallelisation of tasks.
     fastbcPath : str, optional
-        Path to the compiled C++ file for box-counting.
+        Path to the compiled C++ file for box-counting, the built-in box-counting is used if None.
     radType : {'atomic', 'metallic'}, optional
         Type of radii to use for the spheres.
     numPoints : int, optional
         Number of surface points to be generated around each atom.
     gridNum : int, optional
-        Resolution of the 3D binary image.
+        Resolution of the 3D binary image, as a power of 2 up to 2^21.
     rmInSurf : bool, optional
         Whether to remove the surface points on the inner surface.
     vis : bool, optional
@@ -266,6 +560,12 @@ def voxelBoxCnts(atomsEle, atomsRad, atomsSurfIdxs, atomsXYZ, atomsNeighIdxs,
         Whether to display the details.
     genPCD : bool, optional
         Whether to generate pcd file for box-counting using MATLAB code written by Kazuaki Iida.
+    dtype : {np.float64, np.float32}, optional
+        Floating point type of the coordinates and surface points, np.float32 halves the memory of the point clouds.
+    voxelAlg : {'pointCloud', 'sphereShell'}, optional
+        Algorithm to voxelise the surface, either by dropping 'numPoints' points generated around each atom into the
+        voxels, or by rasterising the exposed spherical shell of each atom directly into the voxels it crosses (as an
+        infinitely dense point cloud would, 'numPoints' and 'genPCD' are then ignored).
     
     Returns
     -------
@@ -280,24 +580,41 @@ def voxelBoxCnts(atomsEle, atomsRad, atomsSurfIdxs, atomsXYZ, atomsNeighIdxs,
     >>> neighs, _ = findNN(rads, xyzs, minxyz, maxxyz, 1.2)
     >>> surfs = findSurf(xyzs, neighs, 'alphaShape', 5.0)
     >>> scalesPC, countsPC = voxelBoxCnts(eles, rads, surfs, xyzs, neighs, 'example')
+    >>> scalesPC, countsPC = voxelBoxCnts(Structure.fromFile('example.xyz'), npName='example')
+    >>> scalesVX, countsVX = voxelBoxCnts(eles, rads, surfs, xyzs, neighs, 'example', voxelAlg='sphereShell')
 
     Notes
     -----
-    The 3D binary image resolution (gridNum) is restricted to 1024 or lower. Details about maximum grid size and memory estimation could be found in 'test.cpp' documented by the authors (https://www.ugr.es/~demiras/fbc/).
+    The 3D binary image resolution (gridNum) should be a power of 2, up to 2^21 as only the occupied voxels are stored, as Morton codes. It is restricted to 1024 or lower when 'fastbcPath' is given, details about maximum grid size and memory estimation could be found in 'test.cpp' documented by the authors (https://www.ugr.es/~demiras/fbc/).
     """
-    if verbose:
-        print(f"  Approximating the surface with {numPoints} points for each atom...")
+    numAtoms = len(atomsEle)
+    if isinstance(atomsEle, Structure):
+        atomsEle, atomsRad, atomsSurfIdxs, atomsXYZ, atomsNeighIdxs = atomsEle.engineInps()
+    atomsNeighIdxs = csrNeighs(atomsNeighIdxs)
+    atomsRad, atomsXYZ = np.asarray(atomsRad, dtype=dtype), np.asarray(atomsXYZ, dtype=dtype)
     if not isdir(outDir):
         mkdir(outDir)
 
-    genSurfPoints(atomsEle, atomsRad, atomsSurfIdxs, atomsXYZ, atomsNeighIdxs,
-                  npName, outDir, numCPUs,
-                  radType, numPoints, gridNum,
-                  rmInSurf, vis, verbose, genPCD)
-    system(f"{fastbcPath} {gridNum} {outDir}/surfVoxelIdxs.txt {outDir}/surfVoxelBoxCnts.txt")
-    scales, counts = [], []
-    with open(f"{outDir}/surfVoxelBoxCnts.txt", 'r') as f:
-        for line in f:
-            scales.append(log10(1 / int(line.split()[0])))
-            counts.append(log10(int(line.split()[1])))
+    if voxelAlg == 'sphereShell':
+        if verbose:
+            print('  Rasterising the surface spheres into voxels...')
+        surfVoxelCodes = genSurfShells(atomsEle, atomsRad, atomsSurfIdxs, atomsXYZ, atomsNeighIdxs,
+                                       npName, outDir, numCPUs,
+                                       radType, gridNum, rmInSurf=rmInSurf, vis=vis, verbose=verbose, numAtoms=numAtoms)
+    else:
+        if verbose:
+            print(f"  Approximating the surface with {numPoints} points for each atom...")
+        surfVoxelCodes = genSurfPoints(atomsEle, atomsRad, atomsSurfIdxs, atomsXYZ, atomsNeighIdxs,
+                                       npName, outDir, numCPUs,
+                                       radType, numPoints, gridNum,
+                                       rmInSurf, vis, verbose, genPCD, numAtoms)
+    if fastbcPath is None:
+        boxLens, boxCnts = voxelsBoxCnts(surfVoxelCodes, gridNum)
+    else:
+        writeSurfVoxelIdxs(outDir, decodeMorton(surfVoxelCodes), gridNum)
+        if system(f"{fastbcPath} {gridNum} {outDir}/surfVoxelIdxs.txt {outDir}/surfVoxelBoxCnts.txt") != 0:
+            raise RuntimeError(f"Box-counting with {fastbcPath} failed, check that it points to the compiled fastBC")
+        boxLens, boxCnts = np.loadtxt(f"{outDir}/surfVoxelBoxCnts.txt", dtype=np.int64, ndmin=2).T
+    scales = [log10(1 / boxLen) for boxLen in boxLens]
+    counts = [log10(boxCnt) for boxCnt in boxCnts]
     return scales[::-1], counts[::-1]
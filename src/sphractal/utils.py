@@ -1,14 +1,30 @@
+import bz2
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor as Pool
+from contextlib import contextmanager
+import gzip
+from itertools import islice, product
+import lzma
 from math import ceil, floor, sqrt
+from multiprocessing.shared_memory import SharedMemory
+from os import sched_getaffinity
+from os.path import basename, getsize, splitext
 from time import time
 
 from numba import njit, prange
-from numba.typed import List
 import numpy as np
 # from nvtx import annotate
-from scipy.spatial import ConvexHull, Delaunay
+from scipy.spatial import ConvexHull, Delaunay, cKDTree
 from scipy.spatial._qhull import QhullError
 
-from sphractal.constants import ATOMIC_RAD_DICT, METALLIC_RAD_DICT
+from sphractal.constants import ATOMIC_RAD_ARR, METALLIC_RAD_ARR, ELE_CODES, ELE_SYMBOLS
+
+
+COMPRESSED_OPENERS = {b'\x1f\x8b': gzip.open, b'BZh': bz2.open, b'\xfd7zXZ\x00': lzma.open}  # Magic bytes -> opener
+COMPRESSED_EXTS = ('.gz', '.bz2', '.xz')
+# LAMMPS atom style -> Indices of the 'type' and 'x' columns in the Atoms section of data files
+LMP_ATOM_STYLE_COLS = {'atomic': (1, 2), 'charge': (1, 3), 'bond': (2, 3), 'angle': (2, 3), 'molecular': (2, 3),
+                       'full': (2, 4), 'sphere': (1, 4)}
 
 
 def estDuration(func):
@@ -36,27 +52,482 @@ def getMinMaxXYZ(atomsXYZ):
     return max(maxXYZ - minXYZ), minXYZ, maxXYZ
 
 
+def tokeniseCols(buf, keepCols=slice(-4, None)):
+    """
+    Split a block of lines into a flat list of tokens with a constant number of columns per line.
+
+    Lines with differing numbers of columns (or blank lines) are split one by one, only keeping the columns selected by
+    'keepCols' from each of them.
+    """
+    buf = buf.strip()
+    firstLineEnd = buf.find(b'\n')
+    numCols = len(buf[:firstLineEnd if firstLineEnd > -1 else len(buf)].split())
+    numLines = buf.count(b'\n') + 1 if buf else 0
+    tokens = buf.split()
+    # Ragged or blank lines (even if the total number of tokens matches), fall back to splitting line by line
+    if len(tokens) != numCols * numLines or (countLineTokens(np.frombuffer(buf, dtype=np.uint8)) != numCols).any():
+        lineTokens = [line.split()[keepCols] for line in buf.split(b'\n') if line.strip()]
+        numCols, numLines = len(lineTokens[0]), len(lineTokens)
+        tokens = [token for lineToken in lineTokens for token in lineToken]
+        if any(len(lineToken) != numCols for lineToken in lineTokens):
+            raise ValueError('Lines with too few columns found!')
+    return tokens, numCols, numLines
+
+
+@njit(cache=True)
+def countLineTokens(chars):
+    """Return the number of whitespace-separated tokens on each line of a block of lines, given as an array of bytes."""
+    lineTokens, numLines, inToken = np.zeros(np.sum(chars == 10) + 1, dtype=np.int64), 0, False
+    for char in chars:
+        if char == 10:
+            numLines += 1
+            inToken = False
+        elif char == 32 or 9 <= char <= 13:  # As bytes.split() without arguments
+            inToken = False
+        elif not inToken:
+            lineTokens[numLines] += 1
+            inToken = True
+    return lineTokens
+
+
+def tokensToFloats(tokens, firstCol, numCols, numLines):
+    """Convert three consecutive columns of a flat list of tokens into a 2D ndarray of floats."""
+    vals = np.empty((numLines, 3), dtype=np.float64)
+    for col in range(3):
+        vals[:, col] = np.fromiter(map(float, tokens[firstCol+col::numCols]), dtype=np.float64, count=numLines)
+    return vals
+
+
+def parseEleXYZ(buf):
+    """Tokenise a block of lines ending with 'element x y z' columns into arrays of element symbols and coordinates."""
+    tokens, numCols, numLines = tokeniseCols(buf)
+    if numLines == 0:
+        return np.empty(0, dtype='S2'), np.empty((0, 3), dtype=np.float64)
+    atomsEleBytes = np.array(tokens[numCols-4::numCols], dtype='S')
+    return atomsEleBytes, tokensToFloats(tokens, numCols - 3, numCols, numLines)
+
+
+def getOpener(filePath):
+    """Return the function to open a file with, decompressing on the fly if it is gzip, bzip2 or xz compressed."""
+    with open(filePath, 'rb') as f:
+        magic = f.read(6)
+    for (magicBytes, opener) in COMPRESSED_OPENERS.items():
+        if magic.startswith(magicBytes):
+            return opener
+    return open
+
+
+def openInp(filePath):
+    """Open a plain or compressed (gzip, bzip2 or xz) file for reading in binary mode."""
+    return getOpener(filePath)(filePath, 'rb')
+
+
+def getNpName(filePath):
+    """Return the name of an input file without its directory, compression and format extensions."""
+    fileName = basename(filePath)
+    if fileName.endswith(COMPRESSED_EXTS):
+        fileName = splitext(fileName)[0]
+    return splitext(fileName)[0]
+
+
+def readChunk(args):
+    """Parse the lines lying within a byte range of a file."""
+    filePath, start, end = args
+    with open(filePath, 'rb') as f:
+        f.seek(start)
+        return parseEleXYZ(f.read(end - start))
+
+
+def getChunkBounds(filePath, numLinesSkip, chunkSize):
+    """Split the data section of a file into byte ranges of roughly 'chunkSize' bytes aligned to line boundaries."""
+    fileSize = getsize(filePath)
+    with open(filePath, 'rb') as f:
+        for _ in range(numLinesSkip):
+            f.readline()
+        start, bounds = f.tell(), []
+        while start < fileSize:
+            f.seek(min(start + chunkSize, fileSize) - 1)
+            f.readline()  # Move to the end of the line being cut through
+            end = f.tell()
+            bounds.append((start, end))
+            start = end
+    return bounds
+
+
+def iterChunks(f, chunkSize):
+    """Yield blocks of roughly 'chunkSize' bytes read from a (possibly decompressing) file object, cut at line ends."""
+    tail = b''
+    while True:
+        block = f.read(chunkSize)
+        if not block:
+            if tail:
+                yield tail
+            return
+        block = tail + block
+        cutIdx = block.rfind(b'\n') + 1
+        tail = block[cutIdx:]
+        if cutIdx > 0:
+            yield block[:cutIdx]
+
+
+def mapBounded(pool, func, iterable, maxPending):
+    """Ordered equivalent of pool.map() that only reads ahead 'maxPending' items of 'iterable'."""
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.submit(func, item))
+        if len(pending) >= maxPending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+@contextmanager
+def shareArrays(arrs):
+    """
+    Copy read-only arrays into shared memory once, yielding their specifications for attachArrays() in worker processes.
+
+    Only the specifications, made of the name, shape and data type of each array, need to be sent to the workers,
+    instead of pickling the arrays for every task. The shared memory is released on exit.
+    """
+    blocks, arrsSpecs = [], []
+    try:
+        for arr in arrs:
+            arr = np.ascontiguousarray(arr)
+            block = SharedMemory(create=True, size=max(1, arr.nbytes))
+            blocks.append(block)
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[...] = arr
+            arrsSpecs.append((block.name, arr.shape, arr.dtype.str))
+        yield arrsSpecs
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+@contextmanager
+def attachArrays(arrsSpecs):
+    """
+    Attach the arrays shared by shareArrays() without copying them, given their specifications.
+
+    The shared memory is closed on exit, so neither the arrays nor views of them should be used beyond it.
+    """
+    blocks, arrs = [], []
+    try:
+        for (blockName, shape, dtype) in arrsSpecs:
+            blocks.append(SharedMemory(name=blockName))
+            arrs.append(np.ndarray(shape, dtype=dtype, buffer=blocks[-1].buf))
+        yield arrs
+    finally:
+        for block in blocks:
+            block.close()
+
+
 # @annotate('readInp', color='cyan')
-def readInp(filePath, radType='atomic'):
-    """Parse an xyz or a lmp file."""
-    radDict = ATOMIC_RAD_DICT if radType == 'atomic' else METALLIC_RAD_DICT
-    atomsEle, atomsRad, atomsXYZ = [], [], []
-    numLinesSkip = 9 if '.lmp' in filePath else 2
-    with open(filePath, 'r') as f:
-        for (i, line) in enumerate(f):
-            if i < numLinesSkip:
+def readInp(filePath, radType='atomic', numCPUs=1, chunkSize=2**26, typeEles=None):
+    """
+    Parse an xyz or a lmp (LAMMPS data or dump) file, which could be gzip, bzip2 or xz compressed.
+
+    The data section of xyz files is read in line-aligned chunks that are tokenised in bulk, which could be spread over
+    multiple processes for large files. Compressed files are decompressed while streaming the chunks through the parser.
+    lmp files are parsed according to their headers by readLmp().
+
+    Parameters
+    ----------
+    filePath : str
+        Path to the xyz or lmp file.
+    radType : {'atomic', 'metallic'}, optional
+        Type of radii to use for the atoms.
+    numCPUs : int, optional
+        Number of processes to parse the chunks with, all available cores are used if None.
+    chunkSize : int, optional
+        Approximate number of (decompressed) bytes to parse at once.
+    typeEles : Union[dict, list], optional
+        Element symbol of each LAMMPS atom type, either as a mapping from type to symbol or as a sequence of symbols
+        for types 1, 2, ..., only used for lmp files without an 'element' column.
+
+    Returns
+    -------
+    atomsEle : 1D ndarray of uint8
+        Element type of each atom, encoded as atomic number (see constants.ELE_SYMBOLS).
+    atomsRad : 1D ndarray of floats
+        Radius of each atom.
+    atomsXYZ : 2D ndarray of floats
+        Cartesian coordinates of each atom.
+    maxRange : float
+        Maximum range among all dimensions of the Cartesian space.
+    minXYZ : 1D ndarray of floats
+        Minimum values of each dimension in the Cartesian space.
+    maxXYZ : 1D ndarray of floats
+        Maximum values of each dimension in the Cartesian space.
+    """
+    radArr = ATOMIC_RAD_ARR if radType == 'atomic' else METALLIC_RAD_ARR
+    if '.lmp' in filePath:
+        return readLmp(filePath, radType, typeEles)
+    numLinesSkip = 2
+    if numCPUs is None:
+        numCPUs = len(sched_getaffinity(0))
+    opener = getOpener(filePath)
+    if numCPUs > 1:  # Make sure every process gets a share of the file
+        estFileSize = getsize(filePath) * (1 if opener is open else 4)  # Rough estimate of the decompressed size
+        chunkSize = max(1, min(chunkSize, ceil(estFileSize / numCPUs)))
+
+    if opener is open:  # Workers read their own byte ranges of plain files
+        readChunkInps = [(filePath, start, end) for (start, end) in getChunkBounds(filePath, numLinesSkip, chunkSize)]
+        if numCPUs > 1 and len(readChunkInps) > 1:
+            with Pool(max_workers=min(numCPUs, len(readChunkInps))) as pool:
+                chunks = list(pool.map(readChunk, readChunkInps))
+        else:
+            chunks = [readChunk(readChunkInp) for readChunkInp in readChunkInps]
+    else:  # Decompressed blocks are parsed while the following ones are being decompressed
+        with opener(filePath, 'rb') as f:
+            for _ in range(numLinesSkip):
+                f.readline()
+            if numCPUs > 1:
+                with Pool(max_workers=numCPUs) as pool:
+                    chunks = list(mapBounded(pool, parseEleXYZ, iterChunks(f, chunkSize), numCPUs * 2))
+            else:
+                chunks = [parseEleXYZ(block) for block in iterChunks(f, chunkSize)]
+    atomsEleBytes = np.concatenate([chunk[0] for chunk in chunks])
+    atomsXYZ = np.concatenate([chunk[1] for chunk in chunks])
+    return assembleInp(encodeEles(atomsEleBytes), atomsXYZ, radArr)
+
+
+def readFrames(filePath, radType='atomic', typeEles=None):
+    """
+    Lazily parse the frames of a multi-frame xyz or lmp (LAMMPS dump) trajectory file one at a time.
+
+    Compressed (gzip, bzip2 or xz) trajectories are decompressed while streaming through the frames.
+
+    Parameters
+    ----------
+    filePath : str
+        Path to the xyz or lmp trajectory file.
+    radType : {'atomic', 'metallic'}, optional
+        Type of radii to use for the atoms.
+    typeEles : Union[dict, list], optional
+        Element symbol of each LAMMPS atom type, only used for lmp files without an 'element' column.
+
+    Yields
+    ------
+    frameInp : tuple
+        Outputs of readInp() for each frame, i.e. (atomsEle, atomsRad, atomsXYZ, maxRange, minXYZ, maxXYZ).
+
+    Examples
+    --------
+    >>> for (atomsEle, atomsRad, atomsXYZ, maxRange, minXYZ, maxXYZ) in readFrames('traj.xyz'):
+    ...     print(len(atomsEle))
+    """
+    radArr = ATOMIC_RAD_ARR if radType == 'atomic' else METALLIC_RAD_ARR
+    isLmp = '.lmp' in filePath
+    with openInp(filePath) as f:
+        while True:
+            if isLmp:
+                frame = readLmpDumpFrame(f, typeEles)
+                if frame is None:
+                    return
+                yield assembleInp(frame[0], frame[1], radArr)
                 continue
-            eleXYZ = line.split()
-            ele = eleXYZ[-4]
-            atomsEle.append(ele)
-            atomsRad.append(radDict[ele])
-            atomX, atomY, atomZ = float(eleXYZ[-3]), float(eleXYZ[-2]), float(eleXYZ[-1])
-            atomsXYZ.append((atomX, atomY, atomZ))
-    atomsEle, atomsRad, atomsXYZ = np.array(atomsEle, dtype='U2'), np.array(atomsRad), np.array(atomsXYZ)
+            line = f.readline()
+            while line and not line.strip():  # Skip blank lines between frames
+                line = f.readline()
+            if not line:
+                return
+            f.readline()  # Comment line
+            numAtoms = int(line)
+            atomsEleBytes, atomsXYZ = parseEleXYZ(b''.join(islice(f, numAtoms)))
+            if len(atomsEleBytes) != numAtoms:
+                raise ValueError(f"Frame in {filePath} is truncated, expected {numAtoms} atoms but found "
+                                 f"{len(atomsEleBytes)}!")
+            yield assembleInp(encodeEles(atomsEleBytes), atomsXYZ, radArr)
+
+
+def getTypeEleCodes(typeEles):
+    """Return a lookup table from LAMMPS atom types to element codes, given as a mapping or a sequence of symbols."""
+    if isinstance(typeEles, dict):
+        typeEleCodes = np.zeros(max(typeEles) + 1, dtype=np.uint8)
+        for (atomType, ele) in typeEles.items():
+            typeEleCodes[atomType] = encodeEles([ele])[0]
+    else:  # Sequence of element symbols for types 1, 2, ...
+        typeEleCodes = np.concatenate((np.zeros(1, dtype=np.uint8), encodeEles(list(typeEles))))
+    return typeEleCodes
+
+
+def mapTypes(atomsTypeTokens, typeEles, filePath=''):
+    """Map the LAMMPS atom type tokens of the atoms to element codes."""
+    if typeEles is None:
+        raise ValueError(f"Element of each atom type is unknown in {filePath}, please provide 'typeEles'!")
+    atomsType = np.fromiter(map(int, atomsTypeTokens), dtype=np.int64, count=len(atomsTypeTokens))
+    typeEleCodes = getTypeEleCodes(typeEles)
+    if atomsType.min() < 1 or atomsType.max() >= len(typeEleCodes) or not typeEleCodes[atomsType].all():
+        raise ValueError(f"Atom types in {filePath} are missing from 'typeEles'!")
+    return typeEleCodes[atomsType]
+
+
+def getLmpCell(boundLines):
+    """Return the origin and the cell vectors (as rows) from the bounds of a LAMMPS simulation box."""
+    (xlo, xhi), (ylo, yhi), (zlo, zhi) = [bounds[:2] for bounds in boundLines]
+    xy, xz, yz = [bounds[2] if len(bounds) > 2 else 0.0 for bounds in boundLines]
+    if any(len(bounds) > 2 for bounds in boundLines):  # Dump files list the bounding box of triclinic cells
+        xlo, xhi = xlo - min(0.0, xy, xz, xy + xz), xhi - max(0.0, xy, xz, xy + xz)
+        ylo, yhi = ylo - min(0.0, yz), yhi - max(0.0, yz)
+    cellVecs = np.array(((xhi - xlo, 0.0, 0.0), (xy, yhi - ylo, 0.0), (xz, yz, zhi - zlo)))
+    return np.array((xlo, ylo, zlo)), cellVecs
+
+
+def readLmpDumpFrame(f, typeEles=None):
+    """
+    Read the next frame of a LAMMPS dump file from a file object, returning None at the end of the file.
+
+    The columns are identified from the 'ITEM: ATOMS' header. Elements are read from the 'element' column, or mapped
+    from the 'type' column through 'typeEles'. Coordinates are read from the first available set of the unscaled
+    (x y z), unwrapped (xu yu zu), scaled (xs ys zs), or scaled unwrapped (xsu ysu zsu) columns.
+    """
+    line = f.readline()
+    while line and not line.strip():  # Skip blank lines between frames
+        line = f.readline()
+    if not line:
+        return None
+    numAtoms = boundLines = None
+    while not line.startswith(b'ITEM: ATOMS'):
+        if not line:
+            raise ValueError('LAMMPS dump frame ended before the ITEM: ATOMS section!')
+        if line.startswith(b'ITEM: NUMBER OF ATOMS'):
+            numAtoms = int(f.readline())
+        elif line.startswith(b'ITEM: BOX BOUNDS'):
+            boundLines = [[float(bound) for bound in f.readline().split()] for _ in range(3)]
+        line = f.readline()
+    if numAtoms is None:
+        raise ValueError('LAMMPS dump frame without ITEM: NUMBER OF ATOMS section!')
+    colNames = [colName.decode() for colName in line.split()[2:]]
+
+    tokens, numCols, numLines = tokeniseCols(b''.join(islice(f, numAtoms)), slice(None))
+    if numLines != numAtoms or numCols != len(colNames):
+        raise ValueError(f"LAMMPS dump frame is truncated or malformed, expected {numAtoms} atoms with columns "
+                         f"{colNames}!")
+    if 'element' in colNames:
+        atomsEle = encodeEles(np.array(tokens[colNames.index('element')::numCols], dtype='S'))
+    elif 'type' in colNames:
+        atomsEle = mapTypes(tokens[colNames.index('type')::numCols], typeEles, 'LAMMPS dump frame')
+    else:
+        raise ValueError("LAMMPS dump frame without 'element' or 'type' column!")
+    for xyzCols in (('x', 'y', 'z'), ('xu', 'yu', 'zu'), ('xs', 'ys', 'zs'), ('xsu', 'ysu', 'zsu')):
+        if all(xyzCol in colNames for xyzCol in xyzCols):
+            break
+    else:
+        raise ValueError('LAMMPS dump frame without coordinate columns!')
+    atomsXYZ = np.empty((numAtoms, 3), dtype=np.float64)
+    for (i, xyzCol) in enumerate(xyzCols):
+        atomsXYZ[:, i] = np.fromiter(map(float, tokens[colNames.index(xyzCol)::numCols]), dtype=np.float64,
+                                     count=numAtoms)
+    if xyzCols[0].startswith('xs'):  # Scaled (fractional) coordinates
+        if boundLines is None:
+            raise ValueError('LAMMPS dump frame with scaled coordinates but without ITEM: BOX BOUNDS section!')
+        origin, cellVecs = getLmpCell(boundLines)
+        atomsXYZ = origin + atomsXYZ @ cellVecs
+    return atomsEle, atomsXYZ
+
+
+def readLmpData(f, typeEles=None):
+    """
+    Read the atoms from a LAMMPS data file object.
+
+    The layout of the Atoms section is decided by its atom style comment (e.g. 'Atoms # full'), assumed to be 'atomic'
+    if absent. Elements are mapped from the atom types through 'typeEles', or through the comments in the Masses
+    section (e.g. '1 106.42  # Pd') if 'typeEles' is not given.
+    """
+    f.readline()  # Title line
+    numAtoms, massEles = None, {}
+    line = f.readline()
+    while line:
+        words = line.split(b'#')[0].split()
+        if len(words) == 2 and words[1] == b'atoms':
+            numAtoms = int(words[0])
+        elif words and words[0] == b'Masses':
+            line = f.readline()
+            while not line.strip():
+                line = f.readline()
+            while line.strip():  # Masses entries end at the next blank line
+                if b'#' in line:
+                    massEles[int(line.split()[0])] = line.split(b'#')[1].split()[0].decode()
+                line = f.readline()
+        elif words and words[0] == b'Atoms':
+            atomStyle = line.split(b'#')[1].split()[0].decode() if b'#' in line else 'atomic'
+            break
+        line = f.readline()
+    else:
+        raise ValueError('LAMMPS data file without Atoms section!')
+    if numAtoms is None:
+        raise ValueError('LAMMPS data file without the number of atoms in its header!')
+    if atomStyle not in LMP_ATOM_STYLE_COLS:
+        raise ValueError(f"LAMMPS atom style '{atomStyle}' is not supported, choose from {list(LMP_ATOM_STYLE_COLS)}!")
+    typeCol, xCol = LMP_ATOM_STYLE_COLS[atomStyle]
+
+    line = f.readline()
+    while line and not line.strip():
+        line = f.readline()
+    tokens, numCols, numLines = tokeniseCols(line + b''.join(islice(f, numAtoms - 1)), slice(None, xCol + 3))
+    if numLines != numAtoms or numCols < xCol + 3:
+        raise ValueError(f"LAMMPS data file Atoms section is truncated or malformed, expected {numAtoms} atoms!")
+    atomsEle = mapTypes(tokens[typeCol::numCols], typeEles if typeEles is not None else (massEles or None),
+                        'LAMMPS data file')
+    return atomsEle, tokensToFloats(tokens, xCol, numCols, numLines)
+
+
+def readLmp(filePath, radType='atomic', typeEles=None):
+    """
+    Parse a LAMMPS data file or the first frame of a LAMMPS dump file according to its headers.
+
+    Parameters
+    ----------
+    filePath : str
+        Path to the lmp file, which could be gzip, bzip2 or xz compressed.
+    radType : {'atomic', 'metallic'}, optional
+        Type of radii to use for the atoms.
+    typeEles : Union[dict, list], optional
+        Element symbol of each atom type, either as a mapping from type to symbol or as a sequence of symbols for types
+        1, 2, ..., only needed if the elements could not be found from the file itself.
+
+    Returns
+    -------
+    inp : tuple
+        Same as the outputs of readInp(), i.e. (atomsEle, atomsRad, atomsXYZ, maxRange, minXYZ, maxXYZ).
+
+    Examples
+    --------
+    >>> atomsEle, atomsRad, atomsXYZ, maxRange, minXYZ, maxXYZ = readLmp('slab.lmp', typeEles={1: 'Pt', 2: 'O'})
+    """
+    radArr = ATOMIC_RAD_ARR if radType == 'atomic' else METALLIC_RAD_ARR
+    with openInp(filePath) as f:
+        isDump = f.readline().startswith(b'ITEM:')
+        f.seek(0)
+        atomsEle, atomsXYZ = readLmpDumpFrame(f, typeEles) if isDump else readLmpData(f, typeEles)
+    return assembleInp(atomsEle, atomsXYZ, radArr)
+
+
+def assembleInp(atomsEle, atomsXYZ, radArr):
+    """Look up the radius of each atom from its element code and collect the arrays as returned by readInp()."""
+    atomsRad = radArr[atomsEle]
     maxRange, minXYZ, maxXYZ = getMinMaxXYZ(atomsXYZ)
     return atomsEle, atomsRad, atomsXYZ, maxRange, minXYZ, maxXYZ
 
 
+def encodeEles(atomsEle):
+    """Encode element symbols as uint8 atomic numbers, element codes are returned unchanged."""
+    atomsEle = np.asarray(atomsEle)
+    if atomsEle.dtype.kind not in 'US':
+        return atomsEle.astype(np.uint8, copy=False)
+    uniqEles, eleIdxs = np.unique(atomsEle.astype('U'), return_inverse=True)
+    unknownEles = [ele for ele in uniqEles if ele not in ELE_CODES]
+    if unknownEles:
+        raise ValueError(f"Unknown element symbol(s): {', '.join(map(str, unknownEles))}!")
+    return np.array([ELE_CODES[ele] for ele in uniqEles], dtype=np.uint8)[eleIdxs.ravel()]
+
+
+def decodeEles(atomsEle):
+    """Decode uint8 element codes into element symbols."""
+    return np.array(ELE_SYMBOLS, dtype='U2')[atomsEle]
+
+
 @njit(fastmath=True, cache=True)
 def allDirVecs():
     """Return a list of vectors corresponding to the standard 26 directions from a point."""
@@ -68,12 +539,159 @@ def allDirVecs():
     return dirVecs
 
 
-# @annotate('findNN', color='magenta')
 @njit(fastmath=True, cache=True)
-def findNN(atomsRad, atomsXYZ, minXYZ, maxXYZ, maxAtomRad, radMult=1.2, calcBL=False):
+def sortAtomsToCells(atomsCellCoords, numCellsXYZ):
+    """Counting sort of atoms into cells given their coordinates in units of cells, the atoms in cell c being cellAtoms[cellPtrs[c]:cellPtrs[c+1]]."""
+    numX, numY, numZ = numCellsXYZ
+    atomsCellXYZ = np.empty((len(atomsCellCoords), 3), dtype=np.int64)
+    cellPtrs = np.zeros(numX*numY*numZ + 1, dtype=np.int64)
+    for i in range(len(atomsCellCoords)):
+        cellCoordX, cellCoordY, cellCoordZ = atomsCellCoords[i]
+        x = max(0, min(numX - 1, floor(cellCoordX)))
+        y = max(0, min(numY - 1, floor(cellCoordY)))
+        z = max(0, min(numZ - 1, floor(cellCoordZ)))
+        atomsCellXYZ[i, 0], atomsCellXYZ[i, 1], atomsCellXYZ[i, 2] = x, y, z
+        cellPtrs[(x*numY + y)*numZ + z + 1] += 1
+    cellPtrs = np.cumsum(cellPtrs)
+    cellFill = cellPtrs[:-1].copy()
+    cellAtoms = np.empty(len(atomsCellCoords), dtype=np.int64)
+    for i in range(len(atomsCellCoords)):
+        cellIdx = (atomsCellXYZ[i, 0]*numY + atomsCellXYZ[i, 1])*numZ + atomsCellXYZ[i, 2]
+        cellAtoms[cellFill[cellIdx]] = i
+        cellFill[cellIdx] += 1
+    return atomsCellXYZ, numCellsXYZ, cellPtrs, cellAtoms
+
+
+@njit(fastmath=True, cache=True)
+def neighCellRange(cellIdx, numCells, periodic):
+    """Return the range of cells adjacent to a cell along an axis, to be wrapped modulo 'numCells' if periodic."""
+    if not periodic:
+        return max(0, cellIdx - 1), min(numCells, cellIdx + 2)
+    if numCells < 3:  # Visit each cell once
+        return 0, numCells
+    return cellIdx - 1, cellIdx + 2
+
+
+@njit(fastmath=True, cache=True)
+def minImage(diffX, diffY, diffZ, cellVecs, invCellVecs, pbc):
+    """Return the minimum image of a displacement vector along the periodic axes of a cell (with vectors as rows)."""
+    fracA = diffX*invCellVecs[0, 0] + diffY*invCellVecs[1, 0] + diffZ*invCellVecs[2, 0]
+    fracB = diffX*invCellVecs[0, 1] + diffY*invCellVecs[1, 1] + diffZ*invCellVecs[2, 1]
+    fracC = diffX*invCellVecs[0, 2] + diffY*invCellVecs[1, 2] + diffZ*invCellVecs[2, 2]
+    if pbc[0]:
+        fracA -= floor(fracA + 0.5)
+    if pbc[1]:
+        fracB -= floor(fracB + 0.5)
+    if pbc[2]:
+        fracC -= floor(fracC + 0.5)
+    return (fracA*cellVecs[0, 0] + fracB*cellVecs[1, 0] + fracC*cellVecs[2, 0],
+            fracA*cellVecs[0, 1] + fracB*cellVecs[1, 1] + fracC*cellVecs[2, 1],
+            fracA*cellVecs[0, 2] + fracB*cellVecs[1, 2] + fracC*cellVecs[2, 2])
+
+
+@njit(fastmath=True, cache=True)
+def scanHalfNeighs(i, atomsRad, atomsXYZ, radMult, cellVecs, invCellVecs, pbc,
+                   atomsCellXYZ, numCellsXYZ, cellPtrs, cellAtoms, halfIdxs, halfDists):
+    """Return the number of neighbours of an atom with smaller indices, written to 'halfIdxs' and 'halfDists' if given."""
+    numX, numY, numZ = numCellsXYZ
+    x, y, z = atomsCellXYZ[i]
+    atom1X, atom1Y, atom1Z = atomsXYZ[i]
+    atom1rad = atomsRad[i]
+    isPeriodic = pbc[0] or pbc[1] or pbc[2]
+    loX, hiX = neighCellRange(x, numX, pbc[0])
+    loY, hiY = neighCellRange(y, numY, pbc[1])
+    loZ, hiZ = neighCellRange(z, numZ, pbc[2])
+    numNeighs = 0
+    for cellX in range(loX, hiX):
+        for cellY in range(loY, hiY):
+            for cellZ in range(loZ, hiZ):
+                cellIdx = ((cellX % numX)*numY + cellY % numY)*numZ + cellZ % numZ
+                for j in cellAtoms[cellPtrs[cellIdx]:cellPtrs[cellIdx + 1]]:
+                    if j >= i:
+                        break
+                    atom2X, atom2Y, atom2Z = atomsXYZ[j]
+                    atom2rad = atomsRad[j]
+
+                    diffX, diffY, diffZ = atom1X - atom2X, atom1Y - atom2Y, atom1Z - atom2Z
+                    if isPeriodic:
+                        diffX, diffY, diffZ = minImage(diffX, diffY, diffZ, cellVecs, invCellVecs, pbc)
+                    sumOfSquares = diffX*diffX + diffY*diffY + diffZ*diffZ
+                    if sumOfSquares < ((atom1rad+atom2rad)*radMult) ** 2:
+                        if len(halfIdxs) > 0:  # Insertion sort, as the rows are short
+                            k = numNeighs
+                            while k > 0 and halfIdxs[k - 1] > j:
+                                halfIdxs[k], halfDists[k] = halfIdxs[k - 1], halfDists[k - 1]
+                                k -= 1
+                            halfIdxs[k], halfDists[k] = j, sqrt(sumOfSquares)
+                        numNeighs += 1
+    return numNeighs
+
+
+@njit(fastmath=True, cache=True)
+def findHalfNeighs(args):
+    """Collect the neighbours with smaller indices of a range of atoms in ascending order, together with their distances."""
+    start, end, atomsRad, atomsXYZ, radMult, cellVecs, invCellVecs, pbc, atomsCellXYZ, numCellsXYZ, cellPtrs, cellAtoms = args
+    # Count the neighbours first to collect them into preallocated rows
+    halfPtrs = np.zeros(end - start + 1, dtype=np.int64)
+    noIdxs, noDists = np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64)
+    for i in range(start, end):
+        halfPtrs[i - start + 1] = scanHalfNeighs(i, atomsRad, atomsXYZ, radMult, cellVecs, invCellVecs, pbc,
+                                                 atomsCellXYZ, numCellsXYZ, cellPtrs, cellAtoms, noIdxs, noDists)
+    halfPtrs = np.cumsum(halfPtrs)
+    halfIdxs, halfDists = np.empty(halfPtrs[-1], dtype=np.int32), np.empty(halfPtrs[-1], dtype=np.float64)
+    for i in range(start, end):
+        rowStart, rowEnd = halfPtrs[i - start], halfPtrs[i - start + 1]
+        scanHalfNeighs(i, atomsRad, atomsXYZ, radMult, cellVecs, invCellVecs, pbc,
+                       atomsCellXYZ, numCellsXYZ, cellPtrs, cellAtoms, halfIdxs[rowStart:rowEnd], halfDists[rowStart:rowEnd])
+    return halfPtrs, halfIdxs, halfDists
+
+
+@njit(fastmath=True, cache=True)
+def mergeHalfNeighs(halfPtrs, halfIdxs, halfDists, calcBL):
+    """Combine the neighbours with smaller and larger indices of each atom into compressed sparse rows."""
+    numAtoms = len(halfPtrs) - 1
+    neighPtrs = np.zeros(numAtoms + 1, dtype=np.int64)
+    for i in range(numAtoms):
+        neighPtrs[i + 1] += halfPtrs[i + 1] - halfPtrs[i]
+    for j in halfIdxs:
+        neighPtrs[j + 1] += 1
+    neighPtrs = np.cumsum(neighPtrs)
+    neighIdxs = np.empty(neighPtrs[-1], dtype=np.int32)
+    atomsAvgBondLen = np.zeros(numAtoms, dtype=np.float64)
+    for i in range(numAtoms):
+        numHalf = halfPtrs[i + 1] - halfPtrs[i]
+        neighIdxs[neighPtrs[i]:neighPtrs[i] + numHalf] = halfIdxs[halfPtrs[i]:halfPtrs[i + 1]]
+        if calcBL:
+            atomsAvgBondLen[i] = halfDists[halfPtrs[i]:halfPtrs[i + 1]].sum()
+
+    # Neighbours with larger indices follow, in ascending order as the atoms are visited in order
+    neighFill = neighPtrs[:-1] + (halfPtrs[1:] - halfPtrs[:-1])
+    for i in range(numAtoms):
+        for k in range(halfPtrs[i], halfPtrs[i + 1]):
+            j = halfIdxs[k]
+            neighIdxs[neighFill[j]] = i
+            neighFill[j] += 1
+            if calcBL:
+                atomsAvgBondLen[j] += halfDists[k]
+    if calcBL:
+        for i in range(numAtoms):
+            if neighPtrs[i + 1] > neighPtrs[i]:
+                atomsAvgBondLen[i] /= neighPtrs[i + 1] - neighPtrs[i]
+    return (neighPtrs.astype(np.int32), neighIdxs), atomsAvgBondLen
+
+
+# @annotate('findNN', color='magenta')
+def findNN(atomsRad, atomsXYZ, minXYZ, maxXYZ, maxAtomRad, radMult=1.2, calcBL=False, numCPUs=None,
+           cellVecs=None, pbc=(True, True, True), backend='auto'):
     """
     Compute the nearest neighbour list and average bond length for each atom.
 
+    With the 'cells' backend, the atoms are sorted into cells no smaller than the largest bond length, the neighbours
+    of chunks of atoms are then collected in parallel processes, before being merged into compressed sparse rows. For
+    periodic systems the cells tile the simulation cell and the minimum image convention is applied, hence no replicas
+    are needed. The 'kdTree' backend collects the pairs of atoms from a KD-tree instead, which is faster for sparse or
+    elongated systems whose uniform grid of cells would be mostly empty.
+
     Parameters
     ----------
     atomsRad : 1D ndarray of floats
@@ -90,69 +708,262 @@ def findNN(atomsRad, atomsXYZ, minXYZ, maxXYZ, maxAtomRad, radMult=1.2, calcBL=F
         Multiplier to the atomic radii.
     calcBL : bool, optional
         Whether to compute the average bond length for each atom.
+    numCPUs : int, optional
+        Number of CPUs to be used for the neighbour search, defaults to the number of CPUs available.
+    cellVecs : 2D ndarray of floats, optional
+        Vectors spanning the periodic simulation cell as rows, the system is treated as non-periodic if None.
+    pbc : tuple of bools, optional
+        Whether the system is periodic along each cell vector, only used if 'cellVecs' is given.
+    backend : {'auto', 'cells', 'kdTree'}, optional
+        Neighbour search algorithm, 'auto' chooses 'kdTree' for non-periodic systems with less than one atom per cell
+        on average and 'cells' otherwise. 'kdTree' is single-threaded and does not support periodic systems.
 
     Returns
     -------
-    atomsNeighIdxsPadded : 2D ndarray of ints
-        Neighbour atoms indices of each atom, padded with -1 for fixed number of columns.
+    atomsNeighIdxs : tuple of 1D ndarrays of int32
+        Neighbour atoms indices of each atom in compressed sparse row form (neighPtrs, neighIdxs), the neighbours of
+        atom i being neighIdxs[neighPtrs[i]:neighPtrs[i+1]] in ascending order.
     atomsAvgBondLen : 1D ndarray of floats
         Average bond lengths for each each.
     """
-    (minX, minY, minZ), (maxX, maxY, maxZ) = minXYZ, maxXYZ
-    atomsNeighIdxs = [[int(i) for i in range(0)] for _ in range(len(atomsRad))]
-    atomsAvgBondLen = np.zeros_like(atomsRad)
     stepSize = maxAtomRad * 2 * radMult
-    numX, numY, numZ = max(1, ceil((maxX-minX) / stepSize)), max(1, ceil((maxY-minY) / stepSize)), max(1, ceil((maxZ-minZ) / stepSize))
-    boxes = [[[[int(i) for i in range(0)] for _ in range(numZ)] for _ in range(numY)] for _ in range(numX)]
-    allDirections = allDirVecs()
-    for (i, atom1rad) in enumerate(atomsRad):
+    if cellVecs is None:
+        cellVecs, pbc = np.eye(3), np.zeros(3, dtype=np.bool_)
+        minXYZ, maxXYZ = np.asarray(minXYZ, dtype=np.float64), np.asarray(maxXYZ, dtype=np.float64)
+        numCellsXYZ = np.maximum(1, np.ceil((maxXYZ - minXYZ) / stepSize)).astype(np.int64)
+        if backend == 'auto':
+            backend = 'kdTree' if len(atomsRad) < numCellsXYZ.prod() else 'cells'
+        if backend == 'kdTree':
+            return findNNKDTree(atomsRad, atomsXYZ, maxAtomRad, radMult, calcBL)
+        atomsCellCoords = (atomsXYZ - minXYZ) / stepSize
+    elif backend == 'kdTree':
+        raise ValueError("The 'kdTree' backend does not support periodic systems, use the 'cells' backend!")
+    else:
+        cellVecs, pbc = np.asarray(cellVecs, dtype=np.float64), np.asarray(pbc, dtype=np.bool_)
+        cellWidths = getCellWidths(cellVecs)
+        if np.any(cellWidths[pbc] < 2 * stepSize):
+            raise ValueError(f"Periodic cell widths {cellWidths} are smaller than twice the cutoff {stepSize:.3f}, "
+                             'replicate the cell before searching for neighbours!')
+        atomsFrac = atomsXYZ @ np.linalg.inv(cellVecs)
+        atomsFrac[:, pbc] %= 1.0
+        minFrac = np.where(pbc, 0.0, atomsFrac.min(axis=0))
+        fracRange = np.maximum(np.where(pbc, 1.0, atomsFrac.max(axis=0) - minFrac), 1e-12)
+        numCellsXYZ = np.maximum(1, np.floor(fracRange * cellWidths / stepSize)).astype(np.int64)
+        atomsCellCoords = (atomsFrac - minFrac) / fracRange * numCellsXYZ
+    if numCPUs is None:
+        numCPUs = len(sched_getaffinity(0))
+    numAtoms = len(atomsRad)
+    cells = sortAtomsToCells(atomsCellCoords, numCellsXYZ)
+    periodicity = (cellVecs, np.linalg.inv(cellVecs), pbc)
+
+    # Split the atoms into contiguous chunks, small systems are processed serially
+    numChunks = max(1, min(numCPUs, ceil(numAtoms / 2**14)))
+    chunkBounds = np.linspace(0, numAtoms, numChunks + 1).astype(np.int64)
+    findHalfNeighsInps = [(chunkBounds[c], chunkBounds[c + 1], atomsRad, atomsXYZ, radMult, *periodicity, *cells)
+                          for c in range(numChunks)]
+    if numChunks > 1:
+        with Pool(max_workers=numChunks) as pool:
+            chunksHalfNeighs = list(pool.map(findHalfNeighs, findHalfNeighsInps))
+    else:
+        chunksHalfNeighs = [findHalfNeighs(findHalfNeighsInps[0])]
+    chunksPtrs, chunksIdxs, chunksDists = zip(*chunksHalfNeighs)
+    chunksOffsets = np.cumsum([0] + [chunkPtrs[-1] for chunkPtrs in chunksPtrs])
+    halfPtrs = np.concatenate([[0]] + [chunkPtrs[1:] + chunksOffsets[c] for (c, chunkPtrs) in enumerate(chunksPtrs)])
+    return mergeHalfNeighs(halfPtrs, np.concatenate(chunksIdxs), np.concatenate(chunksDists), calcBL)
+
+
+@njit(fastmath=True, cache=True)
+def filterNeighs(candPtrs, candIdxs, atomsRad, atomsXYZ, radMult, cellVecs, invCellVecs, pbc, calcBL):
+    """
+    Select the actual neighbours of each atom among candidate neighbours given in compressed sparse row form.
+
+    Parameters
+    ----------
+    candPtrs : 1D ndarray of ints
+        Row pointers of the candidate neighbours, e.g. found by findNN() with an enlarged 'radMult'.
+    candIdxs : 1D ndarray of ints
+        Candidate neighbour atoms indices of each atom, in ascending order within each row.
+    atomsRad : 1D ndarray of floats
+        Radius of each atom.
+    atomsXYZ : 2D ndarray of floats
+        Cartesian coordinates of each atom.
+    radMult : Union[int,float]
+        Multiplier to the atomic radii.
+    cellVecs : 2D ndarray of floats
+        Vectors spanning the periodic simulation cell as rows, ignored along the non-periodic axes.
+    invCellVecs : 2D ndarray of floats
+        Inverse of 'cellVecs'.
+    pbc : 1D ndarray of bools
+        Whether the system is periodic along each cell vector.
+    calcBL : bool
+        Whether to compute the average bond length for each atom.
+
+    Returns
+    -------
+    atomsNeighIdxs : tuple of 1D ndarrays of int32
+        Neighbour atoms indices of each atom in compressed sparse row form (neighPtrs, neighIdxs).
+    atomsAvgBondLen : 1D ndarray of floats
+        Average bond lengths for each atom.
+    """
+    numAtoms = len(candPtrs) - 1
+    isPeriodic = pbc[0] or pbc[1] or pbc[2]
+    neighPtrs = np.zeros(numAtoms + 1, dtype=np.int32)
+    neighIdxs = np.empty(len(candIdxs), dtype=np.int32)
+    atomsAvgBondLen = np.zeros(numAtoms, dtype=np.float64)
+    numNeighs = 0
+    for i in range(numAtoms):
         atom1X, atom1Y, atom1Z = atomsXYZ[i]
+        for j in candIdxs[candPtrs[i]:candPtrs[i + 1]]:
+            diffX, diffY, diffZ = atom1X - atomsXYZ[j, 0], atom1Y - atomsXYZ[j, 1], atom1Z - atomsXYZ[j, 2]
+            if isPeriodic:
+                diffX, diffY, diffZ = minImage(diffX, diffY, diffZ, cellVecs, invCellVecs, pbc)
+            sumOfSquares = diffX*diffX + diffY*diffY + diffZ*diffZ
+            if sumOfSquares < ((atomsRad[i]+atomsRad[j])*radMult) ** 2:
+                neighIdxs[numNeighs] = j
+                numNeighs += 1
+                if calcBL:
+                    atomsAvgBondLen[i] += sqrt(sumOfSquares)
+        neighPtrs[i + 1] = numNeighs
+        if calcBL and neighPtrs[i + 1] > neighPtrs[i]:
+            atomsAvgBondLen[i] /= neighPtrs[i + 1] - neighPtrs[i]
+    return (neighPtrs, neighIdxs[:numNeighs].copy()), atomsAvgBondLen
 
-        x = min(numX - 1, floor((atom1X-minX) / stepSize))
-        y = min(numY - 1, floor((atom1Y-minY) / stepSize))
-        z = min(numZ - 1, floor((atom1Z-minZ) / stepSize))
-        for (dirX, dirY, dirZ) in allDirections:
-            if 0 <= x + dirX < numX and 0 <= y + dirY < numY and 0 <= z + dirZ < numZ:
-                for j in boxes[x + dirX][y + dirY][z + dirZ]:
-                    atom2X, atom2Y, atom2Z = atomsXYZ[j]
-                    atom2rad = atomsRad[j]
 
-                    diffX, diffY, diffZ = abs(atom1X - atom2X), abs(atom1Y - atom2Y), abs(atom1Z - atom2Z)
-                    sumOfSquares = diffX*diffX + diffY*diffY + diffZ*diffZ
-                    if sumOfSquares < ((atom1rad+atom2rad)*radMult) ** 2:
-                        atomsNeighIdxs[i].append(j)
-                        atomsNeighIdxs[j].append(i)
-                        if calcBL:
-                            atomsAvgBondLen[i] += sqrt(sumOfSquares)
-                            atomsAvgBondLen[j] += sqrt(sumOfSquares)
-        boxes[x][y][z].append(i)
-
-    # Turn list of lists into NumPy array padded with -1
-    maxNeighNum = max([len(atomNeighIdxs) for atomNeighIdxs in atomsNeighIdxs])
-    atomsNeighIdxsPadded = np.full((len(atomsNeighIdxs), maxNeighNum), -1)
-    for (i, atomNeighIdx) in enumerate(atomsNeighIdxs):
-        atomsNeighIdxsPadded[i][:len(atomNeighIdx)] = atomNeighIdx
+def findNNKDTree(atomsRad, atomsXYZ, maxAtomRad, radMult=1.2, calcBL=False):
+    """Compute the neighbour list and average bond length for each atom of a non-periodic system with a KD-tree."""
+    atomPairs = cKDTree(atomsXYZ).query_pairs(maxAtomRad * 2 * radMult, output_type='ndarray')
+    atomPairsDist = np.linalg.norm(atomsXYZ[atomPairs[:, 0]] - atomsXYZ[atomPairs[:, 1]], axis=1)
+    isNeigh = atomPairsDist < (atomsRad[atomPairs[:, 0]] + atomsRad[atomPairs[:, 1]]) * radMult
+    atomPairs, atomPairsDist = atomPairs[isNeigh], atomPairsDist[isNeigh]
+
+    # Arrange the neighbours with smaller indices of each atom in ascending order, as done by findHalfNeighs()
+    largerIdxs, smallerIdxs = atomPairs.max(axis=1), atomPairs.min(axis=1)
+    pairsOrder = np.lexsort((smallerIdxs, largerIdxs))
+    halfPtrs = np.concatenate(([0], np.cumsum(np.bincount(largerIdxs, minlength=len(atomsRad)))))
+    return mergeHalfNeighs(halfPtrs, smallerIdxs[pairsOrder].astype(np.int32), atomPairsDist[pairsOrder], calcBL)
+
+
+def getCellWidths(cellVecs):
+    """Return the distances between the opposite faces of a cell spanned by the given vectors (as rows)."""
+    faceAreas = np.linalg.norm(np.cross(cellVecs[[1, 2, 0]], cellVecs[[2, 0, 1]]), axis=1)
+    return abs(np.linalg.det(cellVecs)) / faceAreas
+
+
+def wrapXYZ(atomsXYZ, cellVecs, pbc=(True, True, True)):
+    """Return Cartesian coordinates wrapped into a cell (with its origin at zero) along its periodic axes."""
+    atomsFrac = atomsXYZ @ np.linalg.inv(cellVecs)
+    atomsFrac[:, np.asarray(pbc, dtype=np.bool_)] %= 1.0
+    return atomsFrac @ cellVecs
+
+
+def findPeriodicImages(atomsXYZ, cellVecs, pbc=(True, True, True), margin=5.0):
+    """
+    Find the periodic images of a set of atoms that lie within a margin outside the faces of a cell.
+
+    Parameters
+    ----------
+    atomsXYZ : 2D ndarray of floats
+        Cartesian coordinates of each atom, wrapped into the cell along its periodic axes (e.g. by wrapXYZ()).
+    cellVecs : 2D ndarray of floats
+        Vectors spanning the periodic simulation cell as rows.
+    pbc : tuple of bools, optional
+        Whether the system is periodic along each cell vector.
+    margin : float, optional
+        Distance from the faces of the cell within which images are kept.
+
+    Returns
+    -------
+    imgsIdxs : 1D ndarray of ints
+        Indices of the atoms that each image is a copy of.
+    imgsXYZ : 2D ndarray of floats
+        Cartesian coordinates of each image.
+    """
+    pbc = np.asarray(pbc, dtype=np.bool_)
+    atomsFrac = atomsXYZ @ np.linalg.inv(cellVecs)
+    fracMargins = margin / getCellWidths(cellVecs)
+    imgsIdxs, imgsXYZ = [np.zeros(0, dtype=np.int64)], [np.zeros((0, 3))]
+    for shift in product((-1, 0, 1), repeat=3):
+        shift = np.array(shift)
+        if not shift.any() or shift[~pbc].any():
+            continue
+        isImg = np.ones(len(atomsXYZ), dtype=np.bool_)
+        for axis in range(3):
+            if shift[axis] == 1:  # Images beyond the upper face are copies of atoms near the lower face
+                isImg &= atomsFrac[:, axis] < fracMargins[axis]
+            elif shift[axis] == -1:
+                isImg &= atomsFrac[:, axis] >= 1.0 - fracMargins[axis]
+        imgIdxs = np.nonzero(isImg)[0]
+        imgsIdxs.append(imgIdxs)
+        imgsXYZ.append(atomsXYZ[imgIdxs] + shift @ cellVecs)
+    return np.concatenate(imgsIdxs), np.concatenate(imgsXYZ)
 
-    if calcBL:
-        for atomID in range(len(atomsRad)):
-            atomsAvgBondLen[atomID] /= len(atomsNeighIdxs[atomID])
-    return atomsNeighIdxsPadded, atomsAvgBondLen
+
+def csrNeighs(atomsNeighIdxs):
+    """Return neighbour atoms indices in the compressed sparse row form of findNN(), converting -1-padded 2D arrays."""
+    if isinstance(atomsNeighIdxs, tuple):
+        return atomsNeighIdxs
+    atomsNeighIdxs = np.asarray(atomsNeighIdxs)
+    isNeigh = atomsNeighIdxs > -1
+    neighPtrs = np.zeros(len(atomsNeighIdxs) + 1, dtype=np.int32)
+    neighPtrs[1:] = np.cumsum(isNeigh.sum(axis=1))
+    return neighPtrs, atomsNeighIdxs[isNeigh].astype(np.int32)
 
 
 @njit(fastmath=True, cache=True)
-def findTetras(tetraVtxsIdxs, r, alpha):
-    """Return tetrahedrons with their circumsphere radii smaller than a specified alpha value."""
-    return tetraVtxsIdxs[r < alpha, :]
+def calcCircumRad(vtx0XYZ, vtx1XYZ, vtx2XYZ, vtx3XYZ):
+    """Return the circumsphere radius of a tetrahedron, infinite if it is flat."""
+    aX, aY, aZ = vtx1XYZ[0] - vtx0XYZ[0], vtx1XYZ[1] - vtx0XYZ[1], vtx1XYZ[2] - vtx0XYZ[2]
+    bX, bY, bZ = vtx2XYZ[0] - vtx0XYZ[0], vtx2XYZ[1] - vtx0XYZ[1], vtx2XYZ[2] - vtx0XYZ[2]
+    cX, cY, cZ = vtx3XYZ[0] - vtx0XYZ[0], vtx3XYZ[1] - vtx0XYZ[1], vtx3XYZ[2] - vtx0XYZ[2]
+    bcX, bcY, bcZ = bY*cZ - bZ*cY, bZ*cX - bX*cZ, bX*cY - bY*cX
+    caX, caY, caZ = cY*aZ - cZ*aY, cZ*aX - cX*aZ, cX*aY - cY*aX
+    abX, abY, abZ = aY*bZ - aZ*bY, aZ*bX - aX*bZ, aX*bY - aY*bX
+    a2, b2, c2 = aX*aX + aY*aY + aZ*aZ, bX*bX + bY*bY + bZ*bZ, cX*cX + cY*cY + cZ*cZ
+    det = 2 * (aX*bcX + aY*bcY + aZ*bcZ)
+    if det == 0:
+        return np.inf
+
+    # Circumcentre relative to the first vertex
+    centreX = (a2*bcX + b2*caX + c2*abX) / det
+    centreY = (a2*bcY + b2*caY + c2*abY) / det
+    centreZ = (a2*bcZ + b2*caZ + c2*abZ) / det
+    return sqrt(centreX*centreX + centreY*centreY + centreZ*centreZ)
+
+
+@njit(fastmath=True, cache=True)
+def calcCircumRads(tetraVtxsIdxs, atomsXYZ):
+    """Return the circumsphere radius of each tetrahedron."""
+    circumRads = np.empty(len(tetraVtxsIdxs), dtype=np.float64)
+    for (i, (vtx0Idx, vtx1Idx, vtx2Idx, vtx3Idx)) in enumerate(tetraVtxsIdxs):
+        circumRads[i] = calcCircumRad(atomsXYZ[vtx0Idx], atomsXYZ[vtx1Idx], atomsXYZ[vtx2Idx], atomsXYZ[vtx3Idx])
+    return circumRads
 
 
 @njit(fastmath=True, cache=True)
+def findTetras(tetraVtxsIdxs, atomsXYZ, alpha):
+    """Return tetrahedrons with their circumsphere radii smaller than a specified alpha value."""
+    isAlphaTetra = np.zeros(len(tetraVtxsIdxs), dtype=np.bool_)
+    for (i, (vtx0Idx, vtx1Idx, vtx2Idx, vtx3Idx)) in enumerate(tetraVtxsIdxs):
+        circumRad = calcCircumRad(atomsXYZ[vtx0Idx], atomsXYZ[vtx1Idx], atomsXYZ[vtx2Idx], atomsXYZ[vtx3Idx])
+        isAlphaTetra[i] = circumRad < alpha
+    return tetraVtxsIdxs[isAlphaTetra]
+
+
 def rmDupTris(tris):
-    """Remove triangles that occur twice (internal triangles)."""
-    unqTris = []
-    for tri in tris:
-        if tris.count(tri) == 1:
-            unqTris.append(tri)
-    return unqTris
+    """
+    Remove triangles that occur twice (internal triangles).
+
+    The vertex indices of each triangle are sorted and packed into a single integer key, so that the triangles occurring
+    once are found by counting the unique keys in O(n log n) time.
+    """
+    tris = np.sort(tris, axis=1).astype(np.int64)
+    numVtxs = int(tris.max()) + 1 if len(tris) > 0 else 1
+    if numVtxs ** 3 < 2 ** 63:
+        triKeys = (tris[:, 0]*numVtxs + tris[:, 1])*numVtxs + tris[:, 2]
+        _, unqIdxs, triCnts = np.unique(triKeys, return_index=True, return_counts=True)
+    else:  # Keys would overflow, compare the rows instead
+        _, unqIdxs, triCnts = np.unique(tris, axis=0, return_index=True, return_counts=True)
+    return tris[unqIdxs[triCnts == 1]]
 
 
 # @annotate('alphaShape', color='cyan')
@@ -162,29 +973,146 @@ def alphaShape(atomsXYZ, tetraVtxsIdxs, alpha):
 
     Algorithm modified from https://stackoverflow.com/questions/26303878/alpha-shapes-in-3d
     Radius of the sphere fitting inside the tetrahedral < alpha (http://mathworld.wolfram.com/Circumsphere.html)
+    The circumsphere radius of each tetrahedron is computed from the closed-form expansion of the determinants one at
+    a time, without allocating arrays over all tetrahedrons.
     """
-    # Find radius of the circumsphere
-    tetraVtxs = atomsXYZ[tetraVtxsIdxs]
-    norm2 = np.sum(tetraVtxs ** 2, axis=2)[:, :, np.newaxis]
-    ones = np.ones((tetraVtxs.shape[0], tetraVtxs.shape[1], 1))
-    a = np.linalg.det(np.concatenate((tetraVtxs, ones), axis=2))
-    Dx = np.linalg.det(np.concatenate((norm2, tetraVtxs[:, :, [1, 2]], ones), axis=2))
-    Dy = np.linalg.det(np.concatenate((norm2, tetraVtxs[:, :, [0, 2]], ones), axis=2))
-    Dz = np.linalg.det(np.concatenate((norm2, tetraVtxs[:, :, [0, 1]], ones), axis=2))
-    c = np.linalg.det(np.concatenate((norm2, tetraVtxs), axis=2))
-    with np.errstate(divide='ignore', invalid='ignore'):
-        r = np.sqrt(Dx**2 + Dy**2 + Dz**2 - 4*a*c) / (2*np.abs(a))
-
-    # Find tetrahedrons and triangles
-    tetras = findTetras(tetraVtxsIdxs, r, alpha)
+    # Find tetrahedrons whose circumspheres are smaller than alpha, then their triangles
+    tetras = findTetras(tetraVtxsIdxs, atomsXYZ, alpha)
     triComb = np.array([(0, 1, 2), (0, 1, 3), (0, 2, 3), (1, 2, 3)])
     tris = tetras[:, triComb].reshape(-1, 3)
-    tris = rmDupTris(List(tuple(i) for i in tris))
-    return np.unique(np.concatenate(tris))
+    return np.unique(rmDupTris(tris))
+
+
+def findShellSeeds(atomsNeighIdxs, bulkCN=12):
+    """Return a mask of the atoms that are under-coordinated or next to an under-coordinated atom."""
+    neighPtrs, neighIdxs = csrNeighs(atomsNeighIdxs)
+    numNeighs = np.diff(neighPtrs)
+    isUnderCoord = numNeighs < bulkCN
+    isSeed = isUnderCoord.copy()
+    isSeed[np.repeat(np.arange(len(numNeighs)), numNeighs)[isUnderCoord[neighIdxs]]] = True
+    return isSeed
+
+
+# @annotate('alphaShapeShell', color='cyan')
+def alphaShapeShell(atomsXYZ, isSeed, alpha, origIdxs=None):
+    """
+    Return points that form the surface using alpha shape algorithm, triangulating only a shell of the points.
+
+    The tetrahedrons with circumsphere radii smaller than alpha around a point only involve the points within 2*alpha of
+    it, so triangulating these points gives its boundary triangles exactly. The triangulation is done around the seed
+    points first, then repeated around the points newly found on boundary triangles until no more are found, hence the
+    buried points are never triangulated while every surface connected to a seed point is recovered.
+
+    Parameters
+    ----------
+    atomsXYZ : 2D ndarray of floats
+        Cartesian coordinates of each point, with the periodic images (if any) after the points they are copies of.
+    isSeed : 1D ndarray of bools
+        Whether each point (excluding images) is likely to be on the surface, e.g. from findShellSeeds().
+    alpha : Union[int, float]
+        'alpha' for the alpha shape algorithm.
+    origIdxs : 1D ndarray of ints, optional
+        Index of the point that each point is a copy of, defaults to the points themselves.
+
+    Returns
+    -------
+    isSurf : 1D ndarray of bools
+        Whether each point (excluding images) is on the surface.
+    """
+    numAtoms = len(isSeed)
+    if origIdxs is None:
+        origIdxs = np.arange(len(atomsXYZ))
+    triComb = np.array([(0, 1, 2), (0, 1, 3), (0, 2, 3), (1, 2, 3)])
+    tree = cKDTree(atomsXYZ)
+    isSurf, isDone = np.zeros(numAtoms, dtype=np.bool_), np.zeros(numAtoms, dtype=np.bool_)
+    isNew = isSeed.copy()
+    while isNew.any():
+        newIdxs = np.nonzero(isNew)[0]
+        isDone |= isNew
+        shellIdxs = np.unique(np.concatenate(tree.query_ball_point(atomsXYZ[newIdxs], 2.0 * alpha)))
+        try:
+            tetras = shellIdxs[findTetras(Delaunay(atomsXYZ[shellIdxs]).simplices, atomsXYZ[shellIdxs], alpha)]
+            tris = rmDupTris(tetras[:, triComb].reshape(-1, 3))
+            # Only the triangles on the new points are exact, their other vertices are on the surface as well
+            isExact = np.zeros(len(atomsXYZ), dtype=np.bool_)
+            isExact[newIdxs] = True
+            isSurf[origIdxs[tris[isExact[tris].any(axis=1)]]] = True
+        except QhullError:
+            isSurf[origIdxs[shellIdxs]] = True
+        isNew = isSurf & ~isDone
+    return isSurf
+
+
+@njit(fastmath=True, cache=True)
+def probeSphere(atomsRad, atomsXYZ, probeRad=1.4, gridSpacing=0.7):
+    """
+    Return whether each atom could be touched by a probe sphere rolling over the outside of a set of atoms.
+
+    The grid points that a probe sphere centre cannot occupy (within the sum of the probe and atomic radii from any
+    atom) are rasterised, the rest reachable from the corner of the padded grid are flood-filled as the exterior, and
+    atoms with exterior grid points within half a grid diagonal beyond the probe radius are labelled as surface atoms.
+    Both the rasterisation and the flood fill scale linearly with the number of atoms.
+    """
+    padDist = atomsRad.max() + probeRad + 2*gridSpacing
+    minX, minY, minZ = atomsXYZ[:, 0].min() - padDist, atomsXYZ[:, 1].min() - padDist, atomsXYZ[:, 2].min() - padDist
+    numX = int(ceil((atomsXYZ[:, 0].max() + padDist - minX) / gridSpacing)) + 1
+    numY = int(ceil((atomsXYZ[:, 1].max() + padDist - minY) / gridSpacing)) + 1
+    numZ = int(ceil((atomsXYZ[:, 2].max() + padDist - minZ) / gridSpacing)) + 1
+
+    # Rasterise the grid points excluded from the probe sphere centres
+    isExcluded = np.zeros((numX, numY, numZ), dtype=np.bool_)
+    for i in range(len(atomsRad)):
+        atomX, atomY, atomZ = atomsXYZ[i]
+        cutoff = atomsRad[i] + probeRad
+        for x in range(int((atomX - cutoff - minX) / gridSpacing), int((atomX + cutoff - minX) / gridSpacing) + 2):
+            diffX = minX + x*gridSpacing - atomX
+            for y in range(int((atomY - cutoff - minY) / gridSpacing), int((atomY + cutoff - minY) / gridSpacing) + 2):
+                diffY = minY + y*gridSpacing - atomY
+                for z in range(int((atomZ - cutoff - minZ) / gridSpacing), int((atomZ + cutoff - minZ) / gridSpacing) + 2):
+                    diffZ = minZ + z*gridSpacing - atomZ
+                    if diffX*diffX + diffY*diffY + diffZ*diffZ < cutoff*cutoff:
+                        isExcluded[x, y, z] = True
+
+    # Flood fill the exterior from a corner, which is always outside the padded atoms
+    isExterior = np.zeros((numX, numY, numZ), dtype=np.bool_)
+    isExterior[0, 0, 0] = True
+    toVisit = [(0, 0, 0)]
+    while len(toVisit) > 0:
+        x, y, z = toVisit.pop()
+        for (dx, dy, dz) in ((-1, 0, 0), (1, 0, 0), (0, -1, 0), (0, 1, 0), (0, 0, -1), (0, 0, 1)):
+            nx, ny, nz = x + dx, y + dy, z + dz
+            if 0 <= nx < numX and 0 <= ny < numY and 0 <= nz < numZ and not isExcluded[nx, ny, nz] \
+                    and not isExterior[nx, ny, nz]:
+                isExterior[nx, ny, nz] = True
+                toVisit.append((nx, ny, nz))
+
+    # Label the atoms in contact with the exterior
+    atomsIsSurf = np.zeros(len(atomsRad), dtype=np.bool_)
+    for i in range(len(atomsRad)):
+        atomX, atomY, atomZ = atomsXYZ[i]
+        cutoff = atomsRad[i] + probeRad + gridSpacing*sqrt(3)/2
+        for x in range(max(0, int((atomX - cutoff - minX) / gridSpacing)),
+                       min(numX, int((atomX + cutoff - minX) / gridSpacing) + 2)):
+            diffX = minX + x*gridSpacing - atomX
+            for y in range(max(0, int((atomY - cutoff - minY) / gridSpacing)),
+                           min(numY, int((atomY + cutoff - minY) / gridSpacing) + 2)):
+                diffY = minY + y*gridSpacing - atomY
+                for z in range(max(0, int((atomZ - cutoff - minZ) / gridSpacing)),
+                               min(numZ, int((atomZ + cutoff - minZ) / gridSpacing) + 2)):
+                    diffZ = minZ + z*gridSpacing - atomZ
+                    if isExterior[x, y, z] and diffX*diffX + diffY*diffY + diffZ*diffZ < cutoff*cutoff:
+                        atomsIsSurf[i] = True
+                        break
+                if atomsIsSurf[i]:
+                    break
+            if atomsIsSurf[i]:
+                break
+    return atomsIsSurf
 
 
 # @annotate('findSurf', color='yellow')
-def findSurf(atomsXYZ, atomsNeighIdxs, option='alphaShape', alpha=3.0, bulkCN=12):
+def findSurf(atomsXYZ, atomsNeighIdxs, option='alphaShape', alpha=3.0, bulkCN=12, cellVecs=None, pbc=(True, True, True),
+             atomsRad=None, probeRad=1.4, prefilterSurf=False):
     """
     Return the indices of surface atoms.
     
@@ -192,16 +1120,32 @@ def findSurf(atomsXYZ, atomsNeighIdxs, option='alphaShape', alpha=3.0, bulkCN=12
     ----------
     atomsXYZ : 2D ndarray of floats
         Cartesian coordinates of each atom.
-    atomsNeighIdxs : 2D ndarray of ints
-        Neighbour atoms indices of each atom.
-    option : {'alphaShape', 'convexHull', 'numNeigh'}, optional
+    atomsNeighIdxs : tuple of 1D ndarrays of ints
+        Neighbour atoms indices of each atom in compressed sparse row form, as returned by findNN().
+    option : {'alphaShape', 'convexHull', 'numNeigh', 'probeSphere'}, optional
         Algorithm to identify the spheres on the surface. 
         'convexHull' tends to identify less surface atoms; 'numNeigh' tends to identify more surface atoms.
-        'alphaShape' is a generalisation of 'convexHull'.
+        'alphaShape' is a generalisation of 'convexHull'. 'probeSphere' labels the atoms that a probe sphere rolling
+        outside could touch, on a grid rather than a Delaunay triangulation, hence scales linearly to millions of atoms.
     alpha : Union[int, float], optional
         'alpha' for the alpha shape algorithm, only used if 'option' is 'alphaShape'.
     bulkCN : int, optional
         Minimum number of neighbouring atoms for a non-surface atom.
+    cellVecs : 2D ndarray of floats, optional
+        Vectors spanning the periodic simulation cell as rows, the system is treated as non-periodic if None.
+        For 'alphaShape' and 'convexHull', the atoms are padded with their periodic images within 2*alpha of the cell,
+        and 'convexHull' then takes the atoms lying on the facets of the hull. For 'probeSphere', the padding is twice
+        the sum of the probe and largest atomic radii.
+    pbc : tuple of bools, optional
+        Whether the system is periodic along each cell vector, only used if 'cellVecs' is given.
+    atomsRad : 1D ndarray of floats, optional
+        Radius of each atom, required if 'option' is 'probeSphere'.
+    probeRad : Union[int, float], optional
+        Radius of the probe sphere (Angstrom), only used if 'option' is 'probeSphere'. The grid spacing is half of it.
+    prefilterSurf : bool, optional
+        Whether to triangulate only a shell of atoms grown from the atoms with less than 'bulkCN' neighbours and their
+        neighbours, instead of all atoms, only used if 'option' is 'alphaShape'. The results are identical as long as
+        every surface is connected to such an atom, and the buried atoms of compact objects are skipped.
     
     Returns
     -------
@@ -215,14 +1159,31 @@ def findSurf(atomsXYZ, atomsNeighIdxs, option='alphaShape', alpha=3.0, bulkCN=12
     - https://onlinelibrary.wiley.com/doi/pdf/10.1002/jcc.25384
     - https://www.jstage.jst.go.jp/article/tmrsj/45/4/45_115/_article
     """
+    numAtoms = len(atomsXYZ)
+    if option == 'probeSphere' and atomsRad is None:
+        raise ValueError("'atomsRad' is required to find the surface atoms with a probe sphere!")
+    if cellVecs is not None and option != 'numNeigh':
+        atomsXYZ = wrapXYZ(atomsXYZ, cellVecs, pbc)
+        margin = 2.0 * (np.max(atomsRad) + probeRad) if option == 'probeSphere' else 2.0 * alpha
+        imgsIdxs, imgsXYZ = findPeriodicImages(atomsXYZ, cellVecs, pbc, margin=margin)
+        atomsXYZ = np.concatenate((atomsXYZ, imgsXYZ))
+        origIdxs = np.concatenate((np.arange(numAtoms), imgsIdxs))
+        if atomsRad is not None:
+            atomsRad = np.concatenate((atomsRad, np.asarray(atomsRad)[imgsIdxs]))
     atomsSurfIdxs = np.zeros(len(atomsXYZ), dtype=np.bool_)
-    if option == 'convexHull':
+    if option == 'convexHull' and cellVecs is not None:
+        # The vertices of the padded hull are images, take the atoms lying on its facets instead
+        hullEqs = ConvexHull(atomsXYZ).equations
+        atomsSurfIdxs = np.any(np.abs(atomsXYZ @ hullEqs[:, :3].T + hullEqs[:, 3]) < 1e-6, axis=1)
+    elif option == 'convexHull':
         for atomIdx in np.array(ConvexHull(atomsXYZ).vertices):
             atomsSurfIdxs[atomIdx] = True
     elif option == 'numNeigh':
-        for (atomIdx, atomNeighIdxs) in enumerate(atomsNeighIdxs):
-            if len(atomNeighIdxs[atomNeighIdxs > -1]) < bulkCN:
-                atomsSurfIdxs[atomIdx] = True
+        neighPtrs, _ = csrNeighs(atomsNeighIdxs)
+        atomsSurfIdxs = np.diff(neighPtrs) < bulkCN
+    elif option == 'alphaShape' and prefilterSurf:
+        atomsSurfIdxs = alphaShapeShell(atomsXYZ, findShellSeeds(atomsNeighIdxs, bulkCN), alpha,
+                                        origIdxs if cellVecs is not None else None)
     elif option == 'alphaShape':
         try:
             tetraVtxsIdxs = Delaunay(atomsXYZ).simplices
@@ -230,20 +1191,58 @@ def findSurf(atomsXYZ, atomsNeighIdxs, option='alphaShape', alpha=3.0, bulkCN=12
                 atomsSurfIdxs[atomIdx] = True
         except QhullError:
             atomsSurfIdxs = np.full(len(atomsXYZ), True)
-    atomsSurfIdxs = np.where(atomsSurfIdxs)[0]
+    elif option == 'probeSphere':
+        atomsSurfIdxs = probeSphere(np.asarray(atomsRad, dtype=np.float64), atomsXYZ, probeRad, probeRad / 2)
+    atomsSurfIdxs = np.where(atomsSurfIdxs[:numAtoms])[0]  # Periodic images are only padding
     return atomsSurfIdxs
 
 
 @njit(fastmath=True, cache=True)
-def findAtomNeighs(neighIdxs, atomsSurfIdxs):
-    """Divide a list of atomic neighbours into two based on whether they lie on the surface."""
-    surfNeighIdxs, bulkNeighIdxs = [], []
-    for idx in neighIdxs:
-        if idx in atomsSurfIdxs:
-            surfNeighIdxs.append(idx)
-        else:
-            bulkNeighIdxs.append(idx)
-    return np.array(surfNeighIdxs, dtype=np.uint32), np.array(bulkNeighIdxs, dtype=np.uint32)
+def splitSurfNeighs(atomsNeighIdxs, atomsSurfIdxs):
+    """
+    Reorder the neighbours of each atom in compressed sparse row form so that those on the surface precede the rest.
+
+    Parameters
+    ----------
+    atomsNeighIdxs : tuple of 1D ndarrays of ints
+        Neighbour atoms indices of each atom in compressed sparse row form, as returned by findNN().
+    atomsSurfIdxs : 1D ndarray of ints
+        Indices of surface atoms.
+
+    Returns
+    -------
+    atomsNeighIdxs : tuple of 1D ndarrays of ints
+        Neighbour atoms indices of each atom in compressed sparse row form, with the same sets of neighbours.
+    surfNeighEnds : 1D ndarray of ints
+        End of the surface neighbours of each atom in the neighbour indices, see findAtomNeighs().
+    """
+    neighPtrs, neighIdxs = atomsNeighIdxs
+    isSurf = np.zeros(len(neighPtrs) - 1, dtype=np.bool_)
+    isSurf[atomsSurfIdxs] = True
+    splitNeighIdxs = np.empty_like(neighIdxs)
+    surfNeighEnds = np.empty(len(neighPtrs) - 1, dtype=neighPtrs.dtype)
+    for atomIdx in range(len(neighPtrs) - 1):
+        surfEnd = neighPtrs[atomIdx]
+        for neighIdx in neighIdxs[neighPtrs[atomIdx]:neighPtrs[atomIdx + 1]]:
+            surfEnd += isSurf[neighIdx]
+        surfNeighEnds[atomIdx] = surfEnd
+        surfPos, bulkPos = neighPtrs[atomIdx], surfEnd  # Both keep the original order of neighbours
+        for neighIdx in neighIdxs[neighPtrs[atomIdx]:neighPtrs[atomIdx + 1]]:
+            if isSurf[neighIdx]:
+                splitNeighIdxs[surfPos] = neighIdx
+                surfPos += 1
+            else:
+                splitNeighIdxs[bulkPos] = neighIdx
+                bulkPos += 1
+    return (neighPtrs, splitNeighIdxs), surfNeighEnds
+
+
+@njit(fastmath=True, cache=True)
+def findAtomNeighs(atomIdx, atomsNeighIdxs, surfNeighEnds):
+    """Divide the neighbours of an atom into two based on whether they lie on the surface, given splitSurfNeighs() outputs."""
+    neighPtrs, neighIdxs = atomsNeighIdxs
+    surfNeighEnd = surfNeighEnds[atomIdx]
+    return neighIdxs[neighPtrs[atomIdx]:surfNeighEnd], neighIdxs[surfNeighEnd:neighPtrs[atomIdx + 1]]
 
 
 @njit(fastmath=True, cache=True)  # parallel=True slows things down, incompatible with multiprocessing.Pool()
@@ -266,24 +1265,114 @@ def getOrdSurfNeighCombs(surfNeighDists, surfNeighIdxs):
 @njit(fastmath=True, cache=True)
 def closestSurfAtoms(pointXYZ, surfNeighIdxs, atomsXYZ, atomsNeighIdxs):
     """Return two closest surface atom pairs from a given point, that are neighbour of each other."""
+    noAtomXYZ = np.full(1, np.nan, dtype=atomsXYZ.dtype)
     if len(surfNeighIdxs) < 2: 
-        return np.array([np.nan]), np.array([np.nan])
+        return noAtomXYZ, noAtomXYZ
     surfNeighXYZs = atomsXYZ[surfNeighIdxs]
     surfNeighDists = np.array([calcDist(pointXYZ, surfNeighXYZ) for surfNeighXYZ in surfNeighXYZs])
+    neighPtrs, neighIdxs = atomsNeighIdxs
     for idxPair in getOrdSurfNeighCombs(surfNeighDists, surfNeighIdxs):
-        if idxPair[0] in atomsNeighIdxs[idxPair[1]]:
+        if idxPair[0] in neighIdxs[neighPtrs[idxPair[1]]:neighPtrs[idxPair[1] + 1]]:
             return atomsXYZ[idxPair[0]], atomsXYZ[idxPair[1]]
-    return np.array([np.nan]), np.array([np.nan])
+    return noAtomXYZ, noAtomXYZ
+
+
+@njit(fastmath=True, cache=True)
+def calcSurfFrames(atomsXYZ, atomsNeighIdxs, surfNeighEnds):
+    """
+    Precompute the local surface geometry of each atom that oppositeInnerAtoms() relies on.
+
+    Parameters
+    ----------
+    atomsXYZ : 2D ndarray of floats
+        Cartesian coordinates of each atom.
+    atomsNeighIdxs : tuple of 1D ndarrays of ints
+        Neighbour atoms indices of each atom in compressed sparse row form, as returned by splitSurfNeighs().
+    surfNeighEnds : 1D ndarray of ints
+        End of the surface neighbours of each atom in the neighbour indices, as returned by splitSurfNeighs().
+
+    Returns
+    -------
+    atomsSurfFrames : tuple of ndarrays
+        Pointers to the pairs of surface neighbours of each atom that neighbour each other in compressed sparse row
+        form, positions of the two atoms of each pair among the surface neighbours, normal of the plane through each
+        pair and the atom, dot product of each normal with the direction towards the average coordinates of the inner
+        neighbours, and these average coordinates for each atom.
+    """
+    neighPtrs, neighIdxs = atomsNeighIdxs
+    numAtoms = len(neighPtrs) - 1
+    pairPtrs = np.zeros(numAtoms + 1, dtype=np.int64)
+    for atomIdx in range(numAtoms):
+        surfNeighIdxs = neighIdxs[neighPtrs[atomIdx]:surfNeighEnds[atomIdx]]
+        numPairs = 0
+        for i in range(len(surfNeighIdxs)):
+            for j in range(i + 1, len(surfNeighIdxs)):
+                numPairs += surfNeighIdxs[i] in neighIdxs[neighPtrs[surfNeighIdxs[j]]:neighPtrs[surfNeighIdxs[j] + 1]]
+        pairPtrs[atomIdx + 1] = pairPtrs[atomIdx] + numPairs
+
+    pairLocIdxs = np.empty((pairPtrs[-1], 2), dtype=np.int64)
+    pairNormals = np.empty((pairPtrs[-1], 3), dtype=atomsXYZ.dtype)
+    pairInnerDots = np.empty(pairPtrs[-1], dtype=atomsXYZ.dtype)
+    avgInnerXYZs = np.full((numAtoms, 3), np.nan, dtype=atomsXYZ.dtype)
+    for atomIdx in range(numAtoms):
+        atomXYZ = atomsXYZ[atomIdx]
+        surfNeighIdxs = neighIdxs[neighPtrs[atomIdx]:surfNeighEnds[atomIdx]]
+        innerNeighIdxs = neighIdxs[surfNeighEnds[atomIdx]:neighPtrs[atomIdx + 1]]
+        if len(innerNeighIdxs) == 0:
+            innerNeighIdxs = surfNeighIdxs
+        if len(innerNeighIdxs) > 0:
+            innerNeighXYZs = atomsXYZ[innerNeighIdxs]
+            for k in range(3):
+                avgInnerXYZs[atomIdx, k] = innerNeighXYZs[:, k].mean()
+        innerVec = avgInnerXYZs[atomIdx] - atomXYZ
+        pairIdx = pairPtrs[atomIdx]
+        for i in range(len(surfNeighIdxs)):
+            for j in range(i + 1, len(surfNeighIdxs)):
+                if surfNeighIdxs[i] in neighIdxs[neighPtrs[surfNeighIdxs[j]]:neighPtrs[surfNeighIdxs[j] + 1]]:
+                    normal = np.cross(atomsXYZ[surfNeighIdxs[i]] - atomXYZ, atomsXYZ[surfNeighIdxs[j]] - atomXYZ)
+                    pairLocIdxs[pairIdx] = (i, j)
+                    pairNormals[pairIdx] = normal
+                    pairInnerDots[pairIdx] = np.dot(normal, innerVec)
+                    pairIdx += 1
+    return pairPtrs, pairLocIdxs, pairNormals, pairInnerDots, avgInnerXYZs
+
+
+@njit(fastmath=True, cache=True)
+def getSurfFrame(atomIdx, atomsSurfFrames):
+    """Return the local surface geometry of an atom from the outputs of calcSurfFrames()."""
+    pairPtrs, pairLocIdxs, pairNormals, pairInnerDots, avgInnerXYZs = atomsSurfFrames
+    pairStart, pairEnd = pairPtrs[atomIdx], pairPtrs[atomIdx + 1]
+    return pairLocIdxs[pairStart:pairEnd], pairNormals[pairStart:pairEnd], pairInnerDots[pairStart:pairEnd], \
+        avgInnerXYZs[atomIdx]
 
 
 @njit(fastmath=True, cache=True)
-def oppositeInnerAtoms(pointXYZ, atom1XYZ, atomNeighIdxs, 
-                       atomsSurfIdxs, atomsXYZ, atomsNeighIdxs):
-    """Return whether a point lies opposite of the average coordinates of neighbouring inner atoms of a given atom."""
-    surfNeighIdxs, bulkNeighIdxs = findAtomNeighs(atomNeighIdxs, atomsSurfIdxs)
-    atom2XYZ, atom3XYZ = closestSurfAtoms(pointXYZ, surfNeighIdxs, atomsXYZ, atomsNeighIdxs)
-    innerNeighXYZs = atomsXYZ[bulkNeighIdxs] if len(bulkNeighIdxs) > 0 else atomsXYZ[surfNeighIdxs]
-    avgInnerAtomXYZ = np.array([innerNeighXYZs[:, i].mean() for i in range(3)])
-    normal = avgInnerAtomXYZ - atom1XYZ if len(atom3XYZ) == 1 else np.cross(atom2XYZ - atom1XYZ, atom3XYZ - atom1XYZ)
+def oppositeInnerAtoms(pointXYZ, atom1XYZ, surfNeighIdxs, atomSurfFrame, atomsXYZ):
+    """
+    Return whether a point lies opposite of the average coordinates of neighbouring inner atoms of a given atom.
+
+    The surface plane is spanned by the atom and the pair of its surface neighbours, that neighbour each other, closest
+    to the point (as in closestSurfAtoms()), or is normal to the direction towards the inner atoms if there is no such
+    pair. Only the distances to the surface neighbours depend on the point, the rest is precomputed in 'atomSurfFrame'
+    (from getSurfFrame()).
+    """
+    pairLocIdxs, pairNormals, pairInnerDots, avgInnerXYZ = atomSurfFrame
+    # The pairs are ordered by the distance of their closer atom, then by the distance of their further atom, which
+    # orders them as the ranks of their atoms by distance would without sorting
+    closestPairIdx, closestNearDistSq, closestFarDistSq = -1, np.inf, np.inf
+    for pairIdx in range(len(pairLocIdxs)):
+        distSq1, distSq2 = 0.0, 0.0
+        for i in range(3):
+            distSq1 += (pointXYZ[i] - atomsXYZ[surfNeighIdxs[pairLocIdxs[pairIdx, 0]], i]) ** 2
+            distSq2 += (pointXYZ[i] - atomsXYZ[surfNeighIdxs[pairLocIdxs[pairIdx, 1]], i]) ** 2
+        nearDistSq, farDistSq = min(distSq1, distSq2), max(distSq1, distSq2)
+        if nearDistSq < closestNearDistSq or (nearDistSq == closestNearDistSq and farDistSq < closestFarDistSq):
+            closestPairIdx, closestNearDistSq, closestFarDistSq = pairIdx, nearDistSq, farDistSq
+    if closestPairIdx == -1:
+        normal, innerDot = avgInnerXYZ - atom1XYZ, np.dot(avgInnerXYZ - atom1XYZ, avgInnerXYZ - atom1XYZ)
+    else:
+        normal, innerDot = pairNormals[closestPairIdx], pairInnerDots[closestPairIdx]
+    pointDot = normal[0]*(pointXYZ[0] - atom1XYZ[0]) + normal[1]*(pointXYZ[1] - atom1XYZ[1]) + \
+        normal[2]*(pointXYZ[2] - atom1XYZ[2])
     # If the given point is on the opposite side of the surface plane, the sign of products of the dot products will be negative
-    return np.dot(normal, avgInnerAtomXYZ - atom1XYZ) * np.dot(normal, pointXYZ - atom1XYZ) < 0
+    return innerDot * pointDot < 0
@@ -1,6 +1,8 @@
 import numpy as np
 from pytest import fixture
 
+from sphractal.utils import csrNeighs
+
 
 @fixture
 def egAtomsXYZ():
@@ -678,7 +680,7 @@ def egAtomsXYZ():
 
 @fixture
 def egAtomsNeighIdxs():
-    return np.array([[1, 2, 3, 4, -1, -1, -1, -1, -1, -1, -1, -1],
+    return csrNeighs(np.array([[1, 2, 3, 4, -1, -1, -1, -1, -1, -1, -1, -1],
                      [0, 2, 4, 9, 12, 13, 22, -1, -1, -1, -1, -1],
                      [0, 1, 3, 5, 12, 13, 16, -1, -1, -1, -1, -1],
                      [0, 2, 4, 13, 16, 17, 26, -1, -1, -1, -1, -1],
@@ -1347,7 +1349,7 @@ def egAtomsNeighIdxs():
                      [645, 646, 665, 649, 654, 667, 668, -1, -1, -1, -1, -1],
                      [659, 660, 664, 665, 666, 668, 669, -1, -1, -1, -1, -1],
                      [659, 635, 663, 664, 646, 666, 667, 649, 650, -1, -1, -1],
-                     [660, 661, 664, 667, -1, -1, -1, -1, -1, -1, -1, -1]])
+                     [660, 661, 664, 667, -1, -1, -1, -1, -1, -1, -1, -1]]))
 
 
 @fixture
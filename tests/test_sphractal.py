@@ -1,23 +1,31 @@
-from math import dist
+import bz2
+import gzip
+import lzma
+from math import dist, log10
 # from os import environ
 from os.path import exists, isdir, isfile
 from shutil import rmtree
 
-from pytest import approx, mark
+from pytest import approx, mark, raises
 
 from fixtures import fixture, np, egAtomsXYZ, egAtomsNeighIdxs, egAtomsSurfIdxs, egAtomsWithSurfNeighIdxs
+from sphractal.cache import getCacheKey, loadCache, saveCache
 from sphractal.datasets import getExampleDataPath, getStrongScalingDataPath, getWeakScalingDataPaths, \
     getValidationDataPath, getCaseStudyDataPaths, getMiscellaneousDataPaths
-from sphractal.utils import estDuration, getMinMaxXYZ, readInp, findNN, findSurf, calcDist, closestSurfAtoms, \
-    oppositeInnerAtoms
-from sphractal.surfVoxel import fibonacciSphere, pointsOnAtom, pointsToVoxels, voxelBoxCnts
+from sphractal.utils import estDuration, getMinMaxXYZ, readInp, readFrames, readLmp, encodeEles, decodeEles, findNN, csrNeighs, findSurf, rmDupTris, calcCircumRad, calcDist, closestSurfAtoms, \
+    oppositeInnerAtoms, splitSurfNeighs, findAtomNeighs, calcSurfFrames, getSurfFrame, shareArrays, attachArrays
+from sphractal.structure import AlphaComplex, Structure, VerletList
+from sphractal.surfVoxel import fibonacciSphere, encodeMorton, decodeMorton, pointsOnAtoms, pointsToVoxels, voxelsBoxCnts, \
+    voxelBoxCnts, voxelFrame, genSurfShells
 from sphractal.surfExact import getNearFarCoord, scanBox, writeBoxCoords, findAtomsWithSurfNeighs, exactBoxCnts
-from sphractal.boxCnt import voxelBoxCnts, exactBoxCnts, findSlope, runBoxCnt
+from sphractal.boxCnt import voxelBoxCnts, exactBoxCnts, findSlope, runBoxCnt, runBoxCntTraj
 
 
 EG_XYZ_ATOM_NUM = 670
 ATOM_RAD = 1.69
 MAX_RANGE = 36.58499999999998
+SLAB_LAT_CONST = 3.89
+SLAB_CELL_VECS = np.array([[4 * SLAB_LAT_CONST, 0.0, 0.0], [0.0, 4 * SLAB_LAT_CONST, 0.0], [0.0, 0.0, 30.0]])
 
 
 @fixture
@@ -27,7 +35,7 @@ def egMinMaxXYZ():
 
 @fixture
 def egAtomsEle():
-    return np.array(['Pd']*EG_XYZ_ATOM_NUM, dtype='U2')
+    return np.array([46]*EG_XYZ_ATOM_NUM, dtype=np.uint8)
 
 
 @fixture
@@ -35,6 +43,29 @@ def egAtomsRad():
     return np.array([ATOM_RAD]*EG_XYZ_ATOM_NUM)
 
 
+@fixture
+def egSlabXYZ():
+    """Pd(001) slab of 4 x 4 x 4 face-centred cubic unit cells, periodic along x and y in a cell of SLAB_CELL_VECS."""
+    unitCell = np.array([[0.0, 0.0, 0.0], [0.5, 0.5, 0.0], [0.5, 0.0, 0.5], [0.0, 0.5, 0.5]])
+    return np.array([(atom + (i, j, k)) * SLAB_LAT_CONST for i in range(4) for j in range(4) for k in range(4)
+                     for atom in unitCell])
+
+
+@fixture
+def egTrajPath(tmp_path):
+    """Two-frame trajectory made of the example object translated by 0 and 1 Angstrom along x."""
+    with open(getExampleDataPath(), 'r') as f:
+        lines = f.readlines()
+    trajPath = f"{tmp_path}/exampleTraj.xyz"
+    with open(trajPath, 'w') as f:
+        for shift in range(2):
+            f.write(f"{lines[0].strip()}\nFrame {shift}\n")
+            for line in lines[2:]:
+                ele, x, y, z = line.split()
+                f.write(f"{ele} {float(x) + shift} {y} {z}\n")
+    return trajPath
+
+
 @fixture
 def egVoxelBoxCnts():
     return ([-2.70926996, -2.40823997, -2.10720997, -1.80617997, -1.50514998, -1.20411998, -0.90308999, -0.60205999, -0.30103],
@@ -127,7 +158,7 @@ def test_readInp(radType, atomRad, egAtomsEle, egAtomsXYZ):
     assert isinstance(atomsRadAct, np.ndarray), 'atomsRad not ndarray'
     assert isinstance(atomsXYZAct, np.ndarray), 'atomsXYZ not ndarray'
 
-    assert atomsEleAct.dtype == '<U2', 'Incorrect atomsEle data type'
+    assert atomsEleAct.dtype == np.uint8, 'Incorrect atomsEle data type'
 
     assert np.all(atomsEleAct == egAtomsEle), 'Incorrect atomsEle values'
     assert atomsRadAct == approx([atomRad]*EG_XYZ_ATOM_NUM), 'Incorrect atomsRad values'
@@ -138,8 +169,121 @@ def test_readInp(radType, atomRad, egAtomsEle, egAtomsXYZ):
     assert maxXYZAct == approx([440.65, 440.65, 440.65]), 'Incorrect maxXYZ values'
 
 
-@mark.parametrize('maxAtomRad, radMult, totNeighNumExp, avgAvgBL', [(ATOM_RAD, 1.2, 6840, 2.87438906), (1.37, 1.5, 9774, 3.21771150)])
-def test_findNN(maxAtomRad, radMult, totNeighNumExp, avgAvgBL, egMinMaxXYZ, egAtomsXYZ, egAtomsNeighIdxs):
+@mark.parametrize('numCPUs, chunkSize', [(1, 4096), (4, 2**26)])
+def test_readInpChunks(numCPUs, chunkSize):
+    """Unit test of readInp() outputs consistency when parsing in chunks over multiple processes."""
+    inpFilePath = getStrongScalingDataPath()
+    readInpExp = readInp(inpFilePath)
+    readInpAct = readInp(inpFilePath, numCPUs=numCPUs, chunkSize=chunkSize)
+    for (arrAct, arrExp) in zip(readInpAct, readInpExp):
+        assert np.array_equal(arrAct, arrExp), 'Inconsistent outputs from chunked parsing'
+
+
+def test_readInpRagged(tmp_path):
+    """Unit test of readInp() on lines with differing numbers of columns, even when they add up to a constant number of columns."""
+    inpFilePath = f"{tmp_path}/ragged.xyz"
+    with open(inpFilePath, 'w') as f:
+        f.write('3\n\n1 Pd 0.0 0.0 0.0\n2 3 Pd 2.7 0.0 0.0\nPd 0.0 2.7 0.0\n')
+    atomsEle, _, atomsXYZ, maxRange, _, _ = readInp(inpFilePath)
+    assert decodeEles(atomsEle).tolist() == ['Pd'] * 3, 'Incorrect elements'
+    assert atomsXYZ == approx(np.array([[0.0, 0.0, 0.0], [2.7, 0.0, 0.0], [0.0, 2.7, 0.0]])), 'Incorrect coordinates'
+    assert maxRange == approx(2.7), 'Incorrect maxRange value'
+
+
+@mark.parametrize('opener, ext', [(gzip.open, 'gz'), (bz2.open, 'bz2'), (lzma.open, 'xz')])
+@mark.parametrize('numCPUs', [1, 2])
+def test_readInpCompressed(opener, ext, numCPUs, tmp_path):
+    """Unit test of readInp() outputs consistency for compressed input files."""
+    inpFilePath, compFilePath = getExampleDataPath(), f"{tmp_path}/exampleOT.xyz.{ext}"
+    with open(inpFilePath, 'rb') as fIn, opener(compFilePath, 'wb') as fOut:
+        fOut.write(fIn.read())
+    readInpExp = readInp(inpFilePath)
+    readInpAct = readInp(compFilePath, numCPUs=numCPUs, chunkSize=4096)
+    for (arrAct, arrExp) in zip(readInpAct, readInpExp):
+        assert np.array_equal(arrAct, arrExp), 'Inconsistent outputs from compressed input'
+
+
+def test_readFrames(egTrajPath, egAtomsXYZ):
+    """Unit test of readFrames()."""
+    numFrames = 0
+    for (frameIdx, (atomsEleAct, atomsRadAct, atomsXYZAct, maxRangeAct, minXYZAct, maxXYZAct)) in enumerate(readFrames(egTrajPath)):
+        assert len(atomsEleAct) == EG_XYZ_ATOM_NUM, 'Incorrect number of atoms'
+        assert atomsRadAct == approx([ATOM_RAD]*EG_XYZ_ATOM_NUM), 'Incorrect atomsRad values'
+        assert atomsXYZAct == approx(egAtomsXYZ + (frameIdx, 0, 0)), 'Incorrect atomsXYZ values'
+        assert maxRangeAct == approx(MAX_RANGE), 'Incorrect maxRange value'
+        numFrames += 1
+    assert numFrames == 2, 'Incorrect number of frames'
+
+
+def writeLmpDump(filePath, atomsXYZ, colNames, numFrames=1):
+    """Write the coordinates of a set of Pd atoms in a cubic box of 50 Angstroms as a LAMMPS dump file."""
+    boxLo, boxLen = 400.0, 50.0
+    with open(filePath, 'w') as f:
+        for frameIdx in range(numFrames):
+            f.write(f"ITEM: TIMESTEP\n{frameIdx}\nITEM: NUMBER OF ATOMS\n{len(atomsXYZ)}\n")
+            f.write(f"ITEM: BOX BOUNDS pp pp pp\n" + f"{boxLo} {boxLo + boxLen}\n" * 3)
+            f.write(f"ITEM: ATOMS {' '.join(colNames)}\n")
+            for (i, (x, y, z)) in enumerate(atomsXYZ):
+                cols = {'id': i + 1, 'type': 1, 'element': 'Pd', 'q': 0.0, 'x': x, 'y': y, 'z': z,
+                        'xs': (x-boxLo) / boxLen, 'ys': (y-boxLo) / boxLen, 'zs': (z-boxLo) / boxLen}
+                f.write(' '.join(str(cols[colName]) for colName in colNames) + '\n')
+
+
+@mark.parametrize('colNames, typeEles', [(('element', 'x', 'y', 'z'), None),
+                                         (('id', 'type', 'x', 'y', 'z', 'q'), {1: 'Pd'}),
+                                         (('id', 'type', 'xs', 'ys', 'zs'), ['Pd'])])
+def test_readLmpDump(colNames, typeEles, egAtomsEle, egAtomsXYZ, tmp_path):
+    """Unit test of readLmp() for LAMMPS dump files with different columns."""
+    lmpFilePath = f"{tmp_path}/example.lmp"
+    writeLmpDump(lmpFilePath, egAtomsXYZ, colNames)
+    atomsEleAct, atomsRadAct, atomsXYZAct, maxRangeAct, _, _ = readInp(lmpFilePath, typeEles=typeEles)
+    assert np.all(atomsEleAct == egAtomsEle), 'Incorrect atomsEle values'
+    assert atomsRadAct == approx([ATOM_RAD]*EG_XYZ_ATOM_NUM), 'Incorrect atomsRad values'
+    assert atomsXYZAct == approx(egAtomsXYZ), 'Incorrect atomsXYZ values'
+    assert maxRangeAct == approx(MAX_RANGE), 'Incorrect maxRange value'
+
+
+def test_readLmpData(egAtomsEle, egAtomsXYZ, tmp_path):
+    """Unit test of readLmp() for LAMMPS data files, with elements taken from the comments in the Masses section."""
+    lmpFilePath = f"{tmp_path}/example.lmp"
+    with open(lmpFilePath, 'w') as f:
+        f.write(f"LAMMPS data file\n\n{EG_XYZ_ATOM_NUM} atoms\n1 atom types\n\n")
+        f.write('400.0 450.0 xlo xhi\n400.0 450.0 ylo yhi\n400.0 450.0 zlo zhi\n\nMasses\n\n1 106.42  # Pd\n\n')
+        f.write('Atoms  # full\n\n')
+        for (i, (x, y, z)) in enumerate(egAtomsXYZ):
+            f.write(f"{i + 1} 1 1 0.0 {x} {y} {z} 0 0 0\n")
+        f.write('\nVelocities\n\n')
+    atomsEleAct, atomsRadAct, atomsXYZAct, _, _, _ = readLmp(lmpFilePath)
+    assert np.all(atomsEleAct == egAtomsEle), 'Incorrect atomsEle values'
+    assert atomsXYZAct == approx(egAtomsXYZ), 'Incorrect atomsXYZ values'
+    with raises(ValueError):
+        readLmp(lmpFilePath, typeEles={2: 'Pt'})
+
+
+def test_readFramesLmp(egAtomsXYZ, tmp_path):
+    """Unit test of readFrames() for multi-frame LAMMPS dump files."""
+    lmpFilePath = f"{tmp_path}/exampleTraj.lmp"
+    writeLmpDump(lmpFilePath, egAtomsXYZ, ('id', 'type', 'xs', 'ys', 'zs'), numFrames=3)
+    frameInps = list(readFrames(lmpFilePath, typeEles=['Pd']))
+    assert len(frameInps) == 3, 'Incorrect number of frames'
+    for frameInp in frameInps:
+        assert frameInp[2] == approx(egAtomsXYZ), 'Incorrect atomsXYZ values'
+
+
+def test_encodeDecodeEles():
+    """Unit test of encodeEles() and decodeEles()."""
+    atomsEle = np.array(['H', 'C', 'Pd', 'Og', 'Pd'], dtype='U2')
+    atomsEleCodes = encodeEles(atomsEle)
+    assert atomsEleCodes.dtype == np.uint8, 'Incorrect element codes data type'
+    assert np.all(atomsEleCodes == [1, 6, 46, 118, 46]), 'Incorrect element codes'
+    assert encodeEles(atomsEleCodes) is atomsEleCodes, 'Element codes not returned unchanged'
+    assert np.all(decodeEles(atomsEleCodes) == atomsEle), 'Incorrect decoded element symbols'
+    with raises(ValueError, match='Zz, pd'):
+        encodeEles(['Pd', 'pd', 'Zz'])
+
+
+@mark.parametrize('maxAtomRad, radMult, totNeighNumExp, avgAvgBL, numCPUs', [(ATOM_RAD, 1.2, 6840, 2.87438906, 1), (1.37, 1.5, 9774, 3.21771150, None)])
+def test_findNN(maxAtomRad, radMult, totNeighNumExp, avgAvgBL, numCPUs, egMinMaxXYZ, egAtomsXYZ, egAtomsNeighIdxs):
     """
     Unit test of findNN(). 
     calcBL=False was not tested as there's no extra code for this conditional branch. 
@@ -148,24 +292,150 @@ def test_findNN(maxAtomRad, radMult, totNeighNumExp, avgAvgBL, egMinMaxXYZ, egAt
     """
     egMinXYZ, egMaxXYZ = egMinMaxXYZ
     atomsRad = np.array([maxAtomRad] * EG_XYZ_ATOM_NUM)
-    atomsNeighIdxsAct, atomsAvgBondLensAct = findNN(atomsRad, egAtomsXYZ, egMinXYZ, egMaxXYZ, maxAtomRad, radMult, True)
-    totNeighNumAct = sum([len(atomNeighIdxs[atomNeighIdxs > -1]) for atomNeighIdxs in atomsNeighIdxsAct])
+    (neighPtrsAct, neighIdxsAct), atomsAvgBondLensAct = findNN(atomsRad, egAtomsXYZ, egMinXYZ, egMaxXYZ, maxAtomRad, radMult, True, numCPUs)
 
-    assert isinstance(atomsNeighIdxsAct, np.ndarray), 'atomsNeighIdxs not ndarray'
+    assert neighPtrsAct.dtype == np.int32 and neighIdxsAct.dtype == np.int32, 'atomsNeighIdxs not int32 ndarrays'
     assert isinstance(atomsAvgBondLensAct, np.ndarray), 'atomsAvgBondLens not ndarray'
 
-    assert totNeighNumAct == totNeighNumExp, 'Incorrect atomsNeighIdxs values'
+    assert len(neighPtrsAct) == EG_XYZ_ATOM_NUM + 1, 'Incorrect atomsNeighIdxs pointers'
+    assert len(neighIdxsAct) == neighPtrsAct[-1] == totNeighNumExp, 'Incorrect atomsNeighIdxs values'
+    for atomIdx in range(EG_XYZ_ATOM_NUM):
+        atomNeighIdxs = neighIdxsAct[neighPtrsAct[atomIdx]:neighPtrsAct[atomIdx + 1]]
+        assert np.all(np.diff(atomNeighIdxs) > 0), 'Neighbours not in ascending order'
+        for neighIdx in atomNeighIdxs:
+            assert atomIdx in neighIdxsAct[neighPtrsAct[neighIdx]:neighPtrsAct[neighIdx + 1]], 'Asymmetric neighbours'
+    if radMult == 1.2:
+        egNeighPtrs, egNeighIdxs = egAtomsNeighIdxs
+        assert np.all(neighPtrsAct == egNeighPtrs), 'Incorrect number of neighbours'
+        for atomIdx in range(EG_XYZ_ATOM_NUM):
+            assert np.all(neighIdxsAct[neighPtrsAct[atomIdx]:neighPtrsAct[atomIdx + 1]] ==
+                          np.sort(egNeighIdxs[egNeighPtrs[atomIdx]:egNeighPtrs[atomIdx + 1]])), 'Incorrect neighbours'
     assert atomsAvgBondLensAct.mean() == approx(avgAvgBL), 'Incorrect atomsAvgBondLens values'
 
 
-@mark.parametrize('findSurfAlg, numSurfAtomsExp', [('alphaShape', 326), ('convexHull', 6), ('numNeigh', 326)])
+@mark.parametrize('radMult', [1.2, 1.5])
+def test_findNNBackends(radMult, egAtomsXYZ):
+    """Unit test of findNN(), the KD-tree and cells backends should find identical neighbours."""
+    atomsRad = np.linspace(1.2, ATOM_RAD, EG_XYZ_ATOM_NUM)
+    minXYZ, maxXYZ = egAtomsXYZ.min(axis=0), egAtomsXYZ.max(axis=0)
+    (neighPtrsKD, neighIdxsKD), atomsAvgBondLenKD = findNN(atomsRad, egAtomsXYZ, minXYZ, maxXYZ, ATOM_RAD, radMult,
+                                                           True, 1, backend='kdTree')
+    (neighPtrs, neighIdxs), atomsAvgBondLen = findNN(atomsRad, egAtomsXYZ, minXYZ, maxXYZ, ATOM_RAD, radMult, True, 1,
+                                                     backend='cells')
+    assert neighPtrsKD.dtype == np.int32 and neighIdxsKD.dtype == np.int32, 'Incorrect data types'
+    assert np.all(neighPtrsKD == neighPtrs) and np.all(neighIdxsKD == neighIdxs), 'Incorrect neighbours'
+    assert atomsAvgBondLenKD == approx(atomsAvgBondLen), 'Incorrect average bond lengths'
+    with raises(ValueError):
+        findNN(atomsRad, egAtomsXYZ, minXYZ, maxXYZ, ATOM_RAD, radMult, cellVecs=np.eye(3) * 44.0, backend='kdTree')
+
+
+@mark.parametrize('pbc, numNeighsExp', [(None, {3: 8, 4: 24, 5: 24, 6: 8}), ((True, True, False), {5: 32, 6: 32}), ((True, True, True), {6: 64})])
+def test_findNNPeriodic(pbc, numNeighsExp):
+    """Unit test of findNN() with periodic boundaries, on a simple cubic lattice of 4 x 4 x 4 atoms."""
+    atomsXYZ = np.array([(i, j, k) for i in range(4) for j in range(4) for k in range(4)], dtype=float) * 2.75
+    atomsXYZ[:, 0] += 5 * 11.0  # Unwrapped coordinates
+    atomsRad = np.array([1.2] * len(atomsXYZ))
+    cellVecs = None if pbc is None else np.eye(3) * 11.0
+    (neighPtrs, _), atomsAvgBondLens = findNN(atomsRad, atomsXYZ, atomsXYZ.min(axis=0), atomsXYZ.max(axis=0), 1.2, 1.2,
+                                              True, 1, cellVecs, pbc)
+    numNeighs, numAtoms = np.unique(np.diff(neighPtrs), return_counts=True)
+    assert dict(zip(numNeighs.tolist(), numAtoms.tolist())) == numNeighsExp, 'Incorrect number of neighbours'
+    assert atomsAvgBondLens == approx(2.75), 'Incorrect minimum image bond lengths'
+    with raises(ValueError):
+        findNN(atomsRad, atomsXYZ, atomsXYZ.min(axis=0), atomsXYZ.max(axis=0), 1.2, 1.2, cellVecs=np.eye(3) * 5.5)
+
+
+@mark.parametrize('cellVecs, pbc', [(None, None), (np.eye(3) * 44.0, (True, False, True))])
+def test_verletList(cellVecs, pbc, egAtomsXYZ):
+    """Unit test of VerletList, whose neighbour lists of jittered frames should match those from findNN()."""
+    rng = np.random.default_rng(0)
+    atomsRad = np.array([ATOM_RAD] * EG_XYZ_ATOM_NUM)
+    verletList = VerletList(radMult=1.2, skin=1.0, calcBL=True, numCPUs=1)
+    for (frameIdx, maxDisp) in enumerate((0.0, 0.2, 0.2, 0.6)):  # The last frame moves beyond half of the skin
+        atomsXYZ = egAtomsXYZ + rng.uniform(-maxDisp, maxDisp, egAtomsXYZ.shape) / np.sqrt(3)
+        if cellVecs is not None:
+            atomsXYZ[frameIdx::4, 0] += 44.0  # Periodic images should not trigger searches
+        neighsExp = findNN(atomsRad, atomsXYZ, atomsXYZ.min(axis=0), atomsXYZ.max(axis=0), ATOM_RAD, 1.2, True, 1,
+                           cellVecs, pbc)
+        (neighPtrs, neighIdxs), atomsAvgBondLen = verletList.update(atomsRad, atomsXYZ, cellVecs, pbc)
+        assert np.all(neighPtrs == neighsExp[0][0]) and np.all(neighIdxs == neighsExp[0][1]), 'Incorrect neighbours'
+        assert atomsAvgBondLen == approx(neighsExp[1]), 'Incorrect average bond lengths'
+    assert verletList.numBuilds == 2, 'Incorrect number of neighbour searches'
+
+
+@mark.parametrize('findSurfAlg', ['alphaShape', 'convexHull', 'numNeigh', 'probeSphere'])
+def test_findSurfPeriodic(findSurfAlg, egSlabXYZ):
+    """Unit test of findSurf() on a periodic slab, whose surface atoms are the top and bottom layers only."""
+    atomsRad = np.array([1.37] * len(egSlabXYZ))
+    atomsNeighIdxs, _ = findNN(atomsRad, egSlabXYZ, egSlabXYZ.min(axis=0), egSlabXYZ.max(axis=0), 1.37, 1.2,
+                               cellVecs=SLAB_CELL_VECS, pbc=(True, True, False))
+    atomsSurfIdxs = findSurf(egSlabXYZ, atomsNeighIdxs, findSurfAlg, 2.0 * 1.37, cellVecs=SLAB_CELL_VECS,
+                             pbc=(True, True, False), atomsRad=atomsRad)
+    assert len(atomsSurfIdxs) == 64, 'Incorrect number of surface atoms'
+    assert set(egSlabXYZ[atomsSurfIdxs, 2]) == {0.0, 3.5 * SLAB_LAT_CONST}, 'Surface atoms not in the outer layers'
+
+
+def test_findSurfPrefilter(egSlabXYZ):
+    """Unit test of findSurf() with a shell prefilter, whose surface atoms should match those from all atoms."""
+    for xyzFilePath in getCaseStudyDataPaths():
+        _, atomsRad, atomsXYZ, _, minXYZ, maxXYZ = readInp(xyzFilePath)
+        atomsNeighIdxs, _ = findNN(atomsRad, atomsXYZ, minXYZ, maxXYZ, atomsRad.max(), 1.2, numCPUs=1)
+        atomsSurfIdxsExp = findSurf(atomsXYZ, atomsNeighIdxs, 'alphaShape', 2.0 * atomsRad.min())
+        atomsSurfIdxsAct = findSurf(atomsXYZ, atomsNeighIdxs, 'alphaShape', 2.0 * atomsRad.min(), prefilterSurf=True)
+        assert np.all(atomsSurfIdxsAct == atomsSurfIdxsExp), f"Incorrect surface atoms for {xyzFilePath}"
+    atomsRad = np.array([1.37] * len(egSlabXYZ))
+    atomsNeighIdxs, _ = findNN(atomsRad, egSlabXYZ, egSlabXYZ.min(axis=0), egSlabXYZ.max(axis=0), 1.37, 1.2,
+                               cellVecs=SLAB_CELL_VECS, pbc=(True, True, False))
+    atomsSurfIdxs = findSurf(egSlabXYZ, atomsNeighIdxs, 'alphaShape', 2.0 * 1.37, cellVecs=SLAB_CELL_VECS,
+                             pbc=(True, True, False), prefilterSurf=True)
+    assert len(atomsSurfIdxs) == 64, 'Incorrect number of periodic surface atoms'
+
+
+def test_alphaComplex(egAtomsXYZ, egAtomsNeighIdxs, egSlabXYZ):
+    """Unit test of AlphaComplex, whose surface atoms should match those from findSurf() for every alpha value."""
+    alphas = np.array([1.0, 1.5, 2.0, 3.0]) * ATOM_RAD
+    for (alpha, atomsSurfIdxs) in zip(alphas, AlphaComplex(egAtomsXYZ).surfAtomsSpectrum(alphas)):
+        assert np.all(atomsSurfIdxs == findSurf(egAtomsXYZ, egAtomsNeighIdxs, 'alphaShape', alpha)), 'Incorrect surface atoms'
+    alphaComplex = AlphaComplex(egSlabXYZ, SLAB_CELL_VECS, (True, True, False), maxAlpha=2.0 * 1.37)
+    assert len(alphaComplex.surfAtoms(2.0 * 1.37)) == 64, 'Incorrect number of periodic surface atoms'
+    with raises(ValueError):
+        alphaComplex.surfAtoms(3.0 * 1.37)
+    with raises(ValueError):
+        AlphaComplex(egSlabXYZ, SLAB_CELL_VECS)
+
+
+def test_csrNeighs():
+    """Unit test of csrNeighs() converting -1-padded neighbour lists."""
+    neighPtrs, neighIdxs = csrNeighs(np.array([[1, 2, -1], [0, -1, -1], [0, -1, -1], [-1, -1, -1]]))
+    assert neighPtrs.dtype == np.int32 and neighIdxs.dtype == np.int32, 'Incorrect data types'
+    assert np.all(neighPtrs == [0, 2, 3, 4, 4]), 'Incorrect pointers'
+    assert np.all(neighIdxs == [1, 2, 0, 0]), 'Incorrect neighbour indices'
+    assert csrNeighs((neighPtrs, neighIdxs))[1] is neighIdxs, 'Compressed neighbour list not returned unchanged'
+
+
+def test_calcCircumRad():
+    """Unit test of calcCircumRad() on a regular and a flat tetrahedron."""
+    vtxsXYZ = np.array([(1.0, 1.0, 1.0), (1.0, -1.0, -1.0), (-1.0, 1.0, -1.0), (-1.0, -1.0, 1.0)]) + 10.0
+    assert calcCircumRad(*vtxsXYZ) == approx(np.sqrt(3)), 'Incorrect circumsphere radius'
+    assert calcCircumRad(*vtxsXYZ[[0, 1, 2]], vtxsXYZ[0] + vtxsXYZ[1] - vtxsXYZ[2]) == np.inf, 'Flat tetrahedron with finite circumsphere'
+
+
+def test_rmDupTris():
+    """Unit test of rmDupTris(), the face shared by two tetrahedra is internal regardless of its vertices order."""
+    tris = np.array([(0, 1, 2), (0, 1, 3), (0, 2, 3), (1, 2, 3), (3, 2, 1), (1, 2, 4), (1, 3, 4), (2, 3, 4)])
+    assert rmDupTris(tris).tolist() == [[0, 1, 2], [0, 1, 3], [0, 2, 3], [1, 2, 4], [1, 3, 4], [2, 3, 4]], 'Incorrect boundary triangles'
+    assert len(rmDupTris(np.empty((0, 3), dtype=np.int32))) == 0, 'Triangles found from none'
+
+
+@mark.parametrize('findSurfAlg, numSurfAtomsExp', [('alphaShape', 326), ('convexHull', 6), ('numNeigh', 326), ('probeSphere', 326)])
 def test_findSurfAlgs(findSurfAlg, numSurfAtomsExp, egAtomsXYZ, egAtomsNeighIdxs):
     """
     Unit test of findSurf() outputs for different 'findSurfAlg' options.
 
     TODO: Test with extreme alpha.
     """
-    atomsSurfIdxsAct = findSurf(egAtomsXYZ, egAtomsNeighIdxs, findSurfAlg, alpha=2.0 * ATOM_RAD)
+    atomsSurfIdxsAct = findSurf(egAtomsXYZ, egAtomsNeighIdxs, findSurfAlg, alpha=2.0 * ATOM_RAD,
+                                atomsRad=np.array([ATOM_RAD] * EG_XYZ_ATOM_NUM))
     assert isinstance(atomsSurfIdxsAct, np.ndarray), 'atomsSurfIdxs not ndarray'
     assert len(atomsSurfIdxsAct) == numSurfAtomsExp, 'Incorrect number of surface atoms'
 
@@ -176,6 +446,44 @@ def test_findSurfAcc(egAtomsXYZ, egAtomsNeighIdxs, egAtomsSurfIdxs):
     assert np.all(atomsSurfIdxsAct == egAtomsSurfIdxs), 'Incorrect surface atom indices'
 
 
+def test_structure(egAtomsXYZ, egAtomsNeighIdxs, egAtomsSurfIdxs, egMinMaxXYZ):
+    """Unit test of Structure, whose neighbour list, surface atoms and bounding box are computed lazily once."""
+    struct = Structure(['Pd']*EG_XYZ_ATOM_NUM, egAtomsXYZ)
+    assert len(struct) == EG_XYZ_ATOM_NUM, 'Incorrect number of atoms'
+    assert struct.atomsEle.dtype == np.uint8 and np.all(struct.atomsRad == ATOM_RAD), 'Incorrect elements or radii'
+    assert struct._neighs is None and struct._atomsSurfIdxs is None, 'Neighbours or surface atoms computed eagerly'
+    assert struct.maxRange == approx(MAX_RANGE), 'Incorrect maximum range'
+    assert struct.minXYZ == approx(egMinMaxXYZ[0]), 'Incorrect minimum coordinates'
+    assert np.all(struct.atomsSurfIdxs == egAtomsSurfIdxs), 'Incorrect surface atom indices'
+    assert np.all(struct.atomsNeighIdxs[0] == egAtomsNeighIdxs[0]), 'Incorrect neighbour indices'
+    assert struct.atomsSurfIdxs is struct.atomsSurfIdxs, 'Surface atoms not memoised'
+    assert struct.neighs is struct.neighs, 'Neighbour list not memoised'
+    with raises(AttributeError):
+        struct.someAttr = None
+
+
+def test_saveLoadCache(tmp_path, egAtomsXYZ):
+    """Unit test of saveCache() and loadCache(), including the eviction of least recently used entries."""
+    cacheDir = f"{tmp_path}/cache"
+    keys = [getCacheKey(getExampleDataPath(), radMult=radMult) for radMult in (1.0, 1.2, 1.5)]
+    assert len(set(keys)) == 3, 'Cache keys do not depend on the parameters'
+    assert loadCache(cacheDir, keys[0]) is None, 'Entry found in empty cache'
+    for key in keys:
+        saveCache(cacheDir, key, egAtomsXYZ.nbytes * 2.5, atomsXYZ=egAtomsXYZ)
+    assert loadCache(cacheDir, keys[0]) is None, 'Least recently used entry not evicted'
+    cachedArrs = loadCache(cacheDir, keys[-1])
+    assert np.array_equal(cachedArrs['atomsXYZ'], egAtomsXYZ), 'Incorrect cached values'
+
+
+def test_runBoxCntCache(tmp_path):
+    """Unit test of runBoxCnt() outputs consistency between cold and warm cache runs."""
+    runBoxCntKwargs = {'voxelSurf': False, 'vis': False, 'writeBox': False, 'numCPUs': 1, 'cacheDir': f"{tmp_path}/cache"}
+    boxCntDimsCold = runBoxCnt(getValidationDataPath(), **runBoxCntKwargs)
+    boxCntDimsWarm = runBoxCnt(getValidationDataPath(), **runBoxCntKwargs)
+    assert boxCntDimsWarm[-4:-2] == approx(boxCntDimsCold[-4:-2]), 'Inconsistent R2 and D_Box from cached inputs'
+    assert boxCntDimsWarm[-2] == approx(boxCntDimsCold[-2]), 'Inconsistent confidence interval from cached inputs'
+
+
 def test_calcDist(egAtomsXYZ):
     """Unit test of calcDist()."""
     numTests = 100
@@ -198,12 +506,17 @@ def test_calcDist(egAtomsXYZ):
 #    assert idxPairAct == idxPairExp, 'Incorrect atom indices pairs'
 
 
-#@mark.parametrize('pointXYZ, atom1XYZ, atomNeighIdxs, isOppExp', [(), (), ()])
-#def test_oppositeInnerAtoms(pointXYZ, atom1XYZ, atomNeighIdxs, isOppExp, egAtomsSurfIdxs, egAtomsXYZ, egAtomsNeighIdxs):
-#    """Unit test of oppositeInnerAtoms(). (To be implemented)"""
-#    isOppAct = oppositeInnerAtoms(pointXYZ, atom1XYZ, atomNeighIdxs, 
-#                                  egAtomsSurfIdxs, egAtomsXYZ, egAtomsNeighIdxs)
-#    assert isOppAct == isOppExp, 'Incorrect results'
+@mark.parametrize('atomIdx, pointDir, isOppExp', [(0, 1.0, True), (0, -1.0, False), (1, 1.0, True), (1, -1.0, False), (300, 1.0, True), (300, -1.0, False)])
+def test_oppositeInnerAtoms(atomIdx, pointDir, isOppExp, egAtomsXYZ, egAtomsNeighIdxs, egAtomsSurfIdxs):
+    """Unit test of oppositeInnerAtoms(), points away from the centre of the nanoparticle should be opposite of the inner atoms."""
+    atomsNeighIdxs, surfNeighEnds = splitSurfNeighs(egAtomsNeighIdxs, egAtomsSurfIdxs)
+    atomsSurfFrames = calcSurfFrames(egAtomsXYZ, atomsNeighIdxs, surfNeighEnds)
+    atom1XYZ = egAtomsXYZ[atomIdx]
+    outwardDir = atom1XYZ - egAtomsXYZ.mean(axis=0)
+    pointXYZ = atom1XYZ + pointDir * ATOM_RAD * outwardDir / np.linalg.norm(outwardDir)
+    surfNeighIdxs, _ = findAtomNeighs(atomIdx, atomsNeighIdxs, surfNeighEnds)
+    isOppAct = oppositeInnerAtoms(pointXYZ, atom1XYZ, surfNeighIdxs, getSurfFrame(atomIdx, atomsSurfFrames), egAtomsXYZ)
+    assert isOppAct == isOppExp, 'Incorrect results'
 
 
 @mark.parametrize('numPoints, sphereRad, xyzsExp',
@@ -217,12 +530,15 @@ def test_fibonacciSphere(numPoints, sphereRad, xyzsExp):
     assert xyzsAct == approx(xyzsExp), 'Incorrect surface point coordinates'
 
 
-#@mark.parametrize('atomIdx, numOuterPointsExp, numInnerPointsExp, rmInSurf', [(), (), ()])
-#def test_pointsOnAtom(atomIdx, numOuterPointsExp, numInnerPointsExp, rmInSurf, egAtomsSurfIdxs, egAtomsRad, egAtomsXYZ, egAtomsNeighIdxs):
-#    """Unit test of pointsOnAtom(). (To be implemented)"""
-#    outerSurfsAct, innerSurfsAct = pointsOnAtom(atomIdx, 300, egAtomsSurfIdxs, egAtomsRad, egAtomsXYZ, egAtomsNeighIdxs, None, rmInSurf)
-#    assert len(outerSurfsAct) == numOuterPointsExp, 'Incorrect number of outer surface points'
-#    assert len(innerSurfsAct) == numInnerPointsExp, 'Incorrect number of inner surface points'
+@mark.parametrize('atomIdx, rmInSurf, numOuterPointsExp, numInnerPointsExp',
+    [(0, True, 207, 6), (0, False, 213, 0), (1, True, 134, 13), (1, False, 147, 0), (100, True, 1, 42), (100, False, 43, 0)])
+def test_pointsOnAtoms(atomIdx, rmInSurf, numOuterPointsExp, numInnerPointsExp, egAtomsSurfIdxs, egAtomsRad, egAtomsXYZ, egAtomsNeighIdxs):
+    """Unit test of pointsOnAtoms()."""
+    atomsNeighIdxs, surfNeighEnds = splitSurfNeighs(egAtomsNeighIdxs, egAtomsSurfIdxs)
+    atomsSurfFrames = calcSurfFrames(egAtomsXYZ, atomsNeighIdxs, surfNeighEnds)
+    outerSurfsAct, innerSurfsAct = pointsOnAtoms((np.array([atomIdx]), np.zeros(1, dtype=np.int64), fibonacciSphere(300, ATOM_RAD)[None], egAtomsRad, egAtomsXYZ, atomsNeighIdxs, surfNeighEnds, atomsSurfFrames, rmInSurf))
+    assert len(outerSurfsAct) == numOuterPointsExp, 'Incorrect number of outer surface points'
+    assert len(innerSurfsAct) == numInnerPointsExp, 'Incorrect number of inner surface points'
 
 
 #@mark.parametrize('gridSize, numVoxelsExp', [(1024, 33204), (512, 33168), (256, 32888), (128, 29901), (64, 11329), (32, 3104)])
@@ -247,6 +563,50 @@ def test_fibonacciSphere(numPoints, sphereRad, xyzsExp):
 #                 rmInSurf=True)
 
 
+def test_shareArrays(egAtomsNeighIdxs):
+    """Unit test of shareArrays() and attachArrays(), which should round-trip the arrays through shared memory and detach them on exit."""
+    arrs = (*egAtomsNeighIdxs, np.random.default_rng(0).random((5, 3)).astype(np.float32), np.empty(0, dtype=np.int64))
+    with shareArrays(arrs) as arrsSpecs:
+        with attachArrays(arrsSpecs) as sharedArrs:
+            for (arr, sharedArr) in zip(arrs, sharedArrs):
+                assert sharedArr.dtype == arr.dtype and sharedArr.shape == arr.shape, 'Incorrect array specification'
+                assert np.array_equal(sharedArr, arr), 'Incorrect array values'
+            with open('/proc/self/maps') as f:
+                numMapsAttached = sum(blockName in line for line in f for (blockName, _, _) in arrsSpecs)
+        with open('/proc/self/maps') as f:
+            numMapsDetached = sum(blockName in line for line in f for (blockName, _, _) in arrsSpecs)
+        assert numMapsAttached - numMapsDetached == len(arrs), 'Shared memory kept attached'
+
+
+def test_splitSurfNeighs(egAtomsNeighIdxs, egAtomsSurfIdxs):
+    """Unit test of splitSurfNeighs() and findAtomNeighs(), which should partition the neighbours of each atom."""
+    (neighPtrs, neighIdxs), surfNeighEnds = splitSurfNeighs(egAtomsNeighIdxs, egAtomsSurfIdxs)
+    assert np.all(neighPtrs == egAtomsNeighIdxs[0]), 'Incorrect pointers'
+    for atomIdx in range(len(neighPtrs) - 1):
+        atomNeighIdxs = egAtomsNeighIdxs[1][neighPtrs[atomIdx]:neighPtrs[atomIdx + 1]]
+        surfNeighIdxs, bulkNeighIdxs = findAtomNeighs(atomIdx, (neighPtrs, neighIdxs), surfNeighEnds)
+        isSurf = np.isin(atomNeighIdxs, egAtomsSurfIdxs)
+        assert np.all(surfNeighIdxs == atomNeighIdxs[isSurf]), 'Incorrect surface neighbours'
+        assert np.all(bulkNeighIdxs == atomNeighIdxs[~isSurf]), 'Incorrect bulk neighbours'
+
+
+def test_oppositeInnerAtomsFrames(egAtomsXYZ, egAtomsNeighIdxs, egAtomsSurfIdxs):
+    """Unit test of oppositeInnerAtoms() with calcSurfFrames(), which should match the closest surface atoms pair."""
+    atomsNeighIdxs, surfNeighEnds = splitSurfNeighs(egAtomsNeighIdxs, egAtomsSurfIdxs)
+    atomsSurfFrames = calcSurfFrames(egAtomsXYZ, atomsNeighIdxs, surfNeighEnds)
+    for atomIdx in egAtomsSurfIdxs[::10]:
+        atomXYZ = egAtomsXYZ[atomIdx]
+        surfNeighIdxs, bulkNeighIdxs = findAtomNeighs(atomIdx, atomsNeighIdxs, surfNeighEnds)
+        avgInnerXYZ = egAtomsXYZ[bulkNeighIdxs if len(bulkNeighIdxs) > 0 else surfNeighIdxs].mean(axis=0)
+        for pointXYZ in fibonacciSphere(50, 2.0 * ATOM_RAD) + atomXYZ:
+            atom2XYZ, atom3XYZ = closestSurfAtoms(pointXYZ, surfNeighIdxs, egAtomsXYZ, atomsNeighIdxs)
+            normal = avgInnerXYZ - atomXYZ if len(atom3XYZ) == 1 else np.cross(atom2XYZ - atomXYZ, atom3XYZ - atomXYZ)
+            isOppExp = np.dot(normal, avgInnerXYZ - atomXYZ) * np.dot(normal, pointXYZ - atomXYZ) < 0
+            isOppAct = oppositeInnerAtoms(pointXYZ, atomXYZ, surfNeighIdxs, getSurfFrame(atomIdx, atomsSurfFrames),
+                                          egAtomsXYZ)
+            assert isOppAct == isOppExp, 'Incorrect side of the surface plane'
+
+
 def test_findAtomsWithSurfNeighs(egAtomsNeighIdxs, egAtomsSurfIdxs, egAtomsWithSurfNeighIdxs):
     """Unit test of findAtomsWithSurfNeighs()."""
     atomsWithSurfNeighIdxsAct = findAtomsWithSurfNeighs(egAtomsNeighIdxs, egAtomsSurfIdxs)
@@ -284,32 +644,43 @@ def test_findSlopeAcc(scales, counts, boxCntDimsExp):
     assert boxCntDimsAct[:2] == approx(boxCntDimsExp[:2]), 'Incorrect estimation of box-counting dimensions by findSlope()'
 
 
-#def test_getVoxelBoxCntVis(egAtomsEle, egAtomsRad, egAtomsSurfIdxs, egAtomsXYZ, egAtomsNeighIdxs):
-#    """Unit test of voxelBoxCnts() functionalities to generate output files for visualisation (To be uncommented when compiled C++ code could be shipped together)."""
-#    assert isfile(os.environ['FASTBC_EXE']), 'Executable not found at FASTBC_EXE'
-#    voxelScalesAct, voxelCountsAct = voxelBoxCnts(egAtomsEle, egAtomsRad, egAtomsSurfIdxs, egAtomsXYZ, egAtomsNeighIdxs,
-#                                                     'example', 'tests/outputs', verbose=True, genPCD=True)
-#    assert exists('./tests/outputs/surfVoxelIdxs.txt'), 'surfVoxelBoxIdxs.txt is not found'
-#    assert isfile('./tests/outputs/surfVoxelIdxs.txt'), 'surfVoxelBoxIdxs.txt is a file'
-#    assert exists('./tests/outputs/surfVoxelBoxCnts.txt'), 'surfVoxelBoxCnts is not found'
-#    assert isfile('./tests/outputs/surfVoxelBoxCnts.txt'), 'surfVoxelBoxCnts is not a file'
-#    assert exists('./tests/outputs/surfPoints/example_surfPoints.xyz'), 'example_surfPoints.xyz is not found'
-#    assert isfile('./tests/outputs/surfPoints/example_surfPoints.xyz'), 'example_surfPoints.xyz is not a file'
-#    assert exists('./tests/outputs/surfPoints/example_surfPoints.pcd'), 'example_surfPoints.pcd is not found'
-#    assert isfile('./tests/outputs/surfPoints/example_surfPoints.pcd'), 'example_surfPoints.pcd is not a file'
-#    assert exists('./tests/outputs/surfVoxels/example_surfVoxels.xyz'), 'example_surfVoxels.xyz is not found'
-#    assert isfile('./tests/outputs/surfVoxels/example_surfVoxels.xyz'), 'example_surfVoxels.xyz is not a file'
-#    if isdir('./tests/outputs'):
-#        rmtree('./tests/outputs')
-
-
-#@mark.parametrize('rmInSurf, voxelScalesExp, voxelCountsExp', [(True, [-2.70926996, -2.40823997, -2.10720997, -1.80617997, -1.50514998, -1.20411998, -0.90308999, -0.60205999, -0.30103], [0.90308999, 1.50514998, 2.30963017, 2.91855453, 3.49192171, 4.05419158, 4.47568571, 4.51703746, 4.52071928]), (False, [-2.70926996, -2.40823997, -2.10720997, -1.80617997, -1.50514998, -1.20411998, -0.90308999, -0.60205999, -0.30103], [0.90308999, 1.50514998, 2.35024802, 3.02530587, 3.62479758, 4.14640714, 4.54740546, 4.5884958, 4.59508819])])
-#def test_getVoxelBoxCntAcc(rmInSurf, voxelScalesExp, voxelCountsExp, egAtomsEle, egAtomsRad, egAtomsSurfIdxs, egAtomsXYZ, egAtomsNeighIdxs):
-#    """Unit test of voxelBoxCnts() outputs accuracy (To be uncommented when compiled C++ code could be shipped together)."""
-#    voxelScalesAct, voxelCountsAct = voxelBoxCnts(egAtomsEle, egAtomsRad, egAtomsSurfIdxs, egAtomsXYZ, egAtomsNeighIdxs,
-#                                                     'example', 'tests/outputs', rmInSurf=rmInSurf, vis=False)
-#    assert voxelScalesAct == approx(voxelScalesExp), 'Incorrect scales'
-#    assert voxelCountsAct == approx(voxelCountsExp), 'Incorrect box counts'
+def test_getVoxelBoxCntVis(egAtomsEle, egAtomsRad, egAtomsSurfIdxs, egAtomsXYZ, egAtomsNeighIdxs):
+    """Unit test of voxelBoxCnts() functionalities to generate output files for visualisation."""
+    voxelScalesAct, voxelCountsAct = voxelBoxCnts(egAtomsEle, egAtomsRad, egAtomsSurfIdxs, egAtomsXYZ, egAtomsNeighIdxs,
+                                                  'example', 'tests/outputs', verbose=True, genPCD=True)
+    assert exists('./tests/outputs/surfPoints/example_surfPoints.xyz'), 'example_surfPoints.xyz is not found'
+    assert isfile('./tests/outputs/surfPoints/example_surfPoints.xyz'), 'example_surfPoints.xyz is not a file'
+    assert exists('./tests/outputs/surfPoints/example_surfPoints.pcd'), 'example_surfPoints.pcd is not found'
+    assert isfile('./tests/outputs/surfPoints/example_surfPoints.pcd'), 'example_surfPoints.pcd is not a file'
+    assert exists('./tests/outputs/surfVoxels/example_surfVoxels.xyz'), 'example_surfVoxels.xyz is not found'
+    assert isfile('./tests/outputs/surfVoxels/example_surfVoxels.xyz'), 'example_surfVoxels.xyz is not a file'
+    if isdir('./tests/outputs'):
+        rmtree('./tests/outputs')
+
+
+@mark.parametrize('rmInSurf, numVoxelsExp, voxelCountsExp', [(True, 824, [8, 32, 200]), (False, 1112, [8, 32, 224])])
+def test_getVoxelBoxCntShell(rmInSurf, numVoxelsExp, voxelCountsExp, egAtomsEle, egAtomsRad, egAtomsSurfIdxs, egAtomsXYZ, egAtomsNeighIdxs):
+    """Regression test of voxelBoxCnts() rasterising the sphere shells on a coarse grid."""
+    surfVoxelCodes = genSurfShells(egAtomsEle, egAtomsRad, egAtomsSurfIdxs, egAtomsXYZ, egAtomsNeighIdxs, 'example',
+                                   numCPUs=1, gridNum=16, rmInSurf=rmInSurf)
+    assert len(surfVoxelCodes) == numVoxelsExp, 'Incorrect number of voxels'
+    voxelScalesAct, voxelCountsAct = voxelBoxCnts(egAtomsEle, egAtomsRad, egAtomsSurfIdxs, egAtomsXYZ, egAtomsNeighIdxs,
+                                                  'example', 'tests/outputs', numCPUs=2, gridNum=16, rmInSurf=rmInSurf,
+                                                  voxelAlg='sphereShell')
+    assert voxelScalesAct == approx([log10(1 / 2**i) for i in range(3, 0, -1)]), 'Incorrect scales'
+    assert voxelCountsAct == approx([log10(count) for count in voxelCountsExp]), 'Incorrect box counts'
+    assert exists('./tests/outputs/surfVoxels/example_surfVoxels.xyz'), 'example_surfVoxels.xyz is not found'
+    if isdir('./tests/outputs'):
+        rmtree('./tests/outputs')
+
+
+@mark.parametrize('rmInSurf, voxelScalesExp, voxelCountsExp', [(True, [-2.70926996, -2.40823997, -2.10720997, -1.80617997, -1.50514998, -1.20411998, -0.90308999, -0.60205999, -0.30103], [0.90308999, 1.50514998, 2.30963017, 2.91855453, 3.49192171, 4.05419158, 4.47568571, 4.51703746, 4.52071928]), (False, [-2.70926996, -2.40823997, -2.10720997, -1.80617997, -1.50514998, -1.20411998, -0.90308999, -0.60205999, -0.30103], [0.90308999, 1.50514998, 2.35024802, 3.02530587, 3.62479758, 4.14640714, 4.54740546, 4.5884958, 4.59508819])])
+def test_getVoxelBoxCntAcc(rmInSurf, voxelScalesExp, voxelCountsExp, egAtomsEle, egAtomsRad, egAtomsSurfIdxs, egAtomsXYZ, egAtomsNeighIdxs):
+    """Unit test of voxelBoxCnts() outputs accuracy."""
+    voxelScalesAct, voxelCountsAct = voxelBoxCnts(egAtomsEle, egAtomsRad, egAtomsSurfIdxs, egAtomsXYZ, egAtomsNeighIdxs,
+                                                  'example', 'tests/outputs', rmInSurf=rmInSurf, vis=False)
+    assert voxelScalesAct == approx(voxelScalesExp), 'Incorrect scales'
+    assert voxelCountsAct == approx(voxelCountsExp), 'Incorrect box counts'
 
 
 @mark.parametrize('rmInSurf, exactScalesExp, exactCountsExp', [(True, [-0.23688234, -0.16309612, -0.10004438, -0.03477764, 0.03932408, 0.10260591, 0.17060299, 0.24023892, 0.30488175, 0.37314659], [3.20194306, 3.32139128, 3.5171959, 3.68142216, 3.80522891, 3.9531796, 4.09272064, 4.27207379, 4.38937875, 4.52953301]), (False, [-0.23688234, -0.16309612, -0.10004438, -0.03477764, 0.03932408, 0.10260591, 0.17060299, 0.24023892, 0.30488175, 0.37314659], [3.49789674, 3.69055046, 3.84997191, 4.00056421, 4.18301346, 4.32281862, 4.47290265, 4.61702132, 4.74061529, 4.86194043])])
@@ -326,14 +697,147 @@ def test_getExactBoxCnt(rmInSurf, exactScalesExp, exactCountsExp, egAtomsEle, eg
         rmtree('./tests/outputs')
 
 
-#def test_runBoxCnt(egVoxelBoxCntDims, egExactBoxCntDims):
-#    """Unit and regression test of runBoxCnt() (To be uncommented when compiled C++ code could be shipped together)."""
-#    assert isfile(environ['FASTBC_EXE']), 'Executable not found at FASTBC_EXE'
-#    boxCntDimsAct = runBoxCnt(getExampleDataPath(), writeFileDir='tests/outputs')
-#    assert boxCntDimsAct[:2] == approx(egVoxelBoxCntDims[:2]), 'Incorrect R2 and D_Box for point clouds representation'
-#    assert boxCntDimsAct[2] == approx(egVoxelBoxCntDims[2]), 'Incorrect confidence interval for point clouds representation'
-#    assert boxCntDimsAct[-3:-1] == approx(egExactBoxCntDims[:2]), 'Incorrect R2 and D_Box for exact surface representation'
-#    assert boxCntDimsAct[-1] == approx(egExactBoxCntDims[2]), 'Incorrect confidence interval for exact surface representation'
-#    if isdir('./tests/outputs'):
-#        rmtree('./tests/outputs')
+def test_exactBoxCntsStructure(egAtomsXYZ):
+    """Unit test of exactBoxCnts() taking a Structure in place of the per-atom arrays."""
+    struct = Structure(['Pd']*EG_XYZ_ATOM_NUM, egAtomsXYZ)
+    exactScalesAct, exactCountsAct = exactBoxCnts(struct, npName='example', outDir='tests/outputs', writeBox=False)
+    assert exactScalesAct == approx([-0.23688234, -0.16309612, -0.10004438, -0.03477764, 0.03932408, 0.10260591, 0.17060299, 0.24023892, 0.30488175, 0.37314659]), 'Incorrect scales'
+    assert exactCountsAct == approx([3.20194306, 3.32139128, 3.5171959, 3.68142216, 3.80522891, 3.9531796, 4.09272064, 4.27207379, 4.38937875, 4.52953301]), 'Incorrect box counts'
+    if isdir('./tests/outputs'):
+        rmtree('./tests/outputs')
+
+
+def test_exactBoxCntsDefaults(egAtomsEle, egAtomsRad, egAtomsSurfIdxs, egAtomsXYZ, egAtomsNeighIdxs):
+    """Unit test of exactBoxCnts() taking the per-atom arrays alone, which should default to their bounding box."""
+    exactScalesAct, exactCountsAct = exactBoxCnts(egAtomsEle, egAtomsRad, egAtomsSurfIdxs, egAtomsXYZ, egAtomsNeighIdxs,
+                                                  npName='example', outDir='tests/outputs', writeBox=False)
+    assert exactScalesAct == approx([-0.23688234, -0.16309612, -0.10004438, -0.03477764, 0.03932408, 0.10260591, 0.17060299, 0.24023892, 0.30488175, 0.37314659]), 'Incorrect scales'
+    assert exactCountsAct == approx([3.20194306, 3.32139128, 3.5171959, 3.68142216, 3.80522891, 3.9531796, 4.09272064, 4.27207379, 4.38937875, 4.52953301]), 'Incorrect box counts'
+
+
+def test_exactBoxCntsFloat32(egAtomsXYZ, egExactBoxCntDims):
+    """Validation test of exactBoxCnts() in single precision, whose box-counting dimension should match the double precision one."""
+    struct = Structure(['Pd']*EG_XYZ_ATOM_NUM, egAtomsXYZ)
+    exactScalesAct, exactCountsAct = exactBoxCnts(struct, numCPUs=1, writeBox=False, dtype=np.float32)
+    r2Act, boxCntDimAct, _, _ = findSlope(exactScalesAct, exactCountsAct, visReg=False)
+    assert r2Act == approx(egExactBoxCntDims[0], abs=1e-3), 'Incorrect R2 in single precision'
+    assert boxCntDimAct == approx(egExactBoxCntDims[1], abs=1e-2), 'Incorrect D_Box in single precision'
+
+
+def test_pointsOnAtomsFloat32(egAtomsXYZ, egAtomsNeighIdxs, egAtomsSurfIdxs):
+    """Validation test of pointsOnAtoms() in single precision, which should classify nearly the same surface points."""
+    atomsRad = np.array([ATOM_RAD] * EG_XYZ_ATOM_NUM)
+    atomsNeighIdxs, surfNeighEnds = splitSurfNeighs(egAtomsNeighIdxs, egAtomsSurfIdxs)
+    atomsSurfFrames = calcSurfFrames(egAtomsXYZ, atomsNeighIdxs, surfNeighEnds)
+    atomsSurfFrames32 = calcSurfFrames(egAtomsXYZ.astype(np.float32), atomsNeighIdxs, surfNeighEnds)
+    atomSphereIdxs = np.zeros(1, dtype=np.int64)
+    for atomIdx in egAtomsSurfIdxs[:10]:
+        numPointsExp = [len(points) for points in pointsOnAtoms((np.array([atomIdx]), atomSphereIdxs,
+                                                                 fibonacciSphere(300, ATOM_RAD)[None], atomsRad,
+                                                                 egAtomsXYZ, atomsNeighIdxs, surfNeighEnds,
+                                                                 atomsSurfFrames, True))]
+        outerPointXYZs, innerPointXYZs = pointsOnAtoms((np.array([atomIdx]), atomSphereIdxs,
+                                                        fibonacciSphere(300, ATOM_RAD, np.float32)[None],
+                                                        atomsRad.astype(np.float32), egAtomsXYZ.astype(np.float32),
+                                                        atomsNeighIdxs, surfNeighEnds, atomsSurfFrames32, True))
+        assert outerPointXYZs.dtype == innerPointXYZs.dtype == np.float32, 'Points not in single precision'
+        assert [len(outerPointXYZs), len(innerPointXYZs)] == approx(numPointsExp, abs=3), 'Incorrect number of points'
+
+
+@mark.parametrize('voxelAlg', ['pointCloud', 'sphereShell'])
+def test_voxelBoxCntsFloat32(voxelAlg, egAtomsEle, egAtomsRad, egAtomsSurfIdxs, egAtomsXYZ, egAtomsNeighIdxs):
+    """Validation test of voxelBoxCnts() in single precision, whose box-counting dimension should match the double precision one."""
+    boxCntDims = []
+    for dtype in (np.float64, np.float32):
+        voxelScalesAct, voxelCountsAct = voxelBoxCnts(egAtomsEle, egAtomsRad, egAtomsSurfIdxs, egAtomsXYZ, egAtomsNeighIdxs,
+                                                      'example', 'tests/outputs', numCPUs=1, gridNum=256, vis=False,
+                                                      dtype=dtype, voxelAlg=voxelAlg)
+        boxCntDims.append(findSlope(voxelScalesAct, voxelCountsAct, visReg=False)[:2])
+    (r2Exp, boxCntDimExp), (r2Act, boxCntDimAct) = boxCntDims
+    assert r2Act == approx(r2Exp, abs=1e-3), 'Incorrect R2 in single precision'
+    assert boxCntDimAct == approx(boxCntDimExp, abs=1e-2), 'Incorrect D_Box in single precision'
+    if isdir('./tests/outputs'):
+        rmtree('./tests/outputs')
+
+
+def test_encodeMorton():
+    """Unit test of encodeMorton() and decodeMorton(), which should round-trip voxel indices up to 2^21 and keep their
+    octree order."""
+    voxelXYZs = np.random.default_rng(0).integers(0, 2**21, (1000, 3))
+    assert np.array_equal(decodeMorton(encodeMorton(voxelXYZs)), voxelXYZs), 'Incorrect round trip'
+    assert encodeMorton(np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1]])).tolist() == [4, 2, 1], 'Incorrect bit order'
+
+
+def test_pointsToVoxelsFineGrid():
+    """Unit test of pointsToVoxels() on a grid too fine for a dense 3D binary image."""
+    pointXYZs = fibonacciSphere(2000, 10.0)
+    voxelCodes = pointsToVoxels(pointXYZs, 2**16)
+    assert np.all(voxelCodes[1:] > voxelCodes[:-1]), 'Voxel codes not sorted and unique'
+    assert len(voxelCodes) == len(np.unique(pointXYZs, axis=0)), 'Distinct points merged into the same voxel'
+    assert decodeMorton(voxelCodes).max() == 2**16 - 1, 'Points not spanning the grid'
+
+
+@mark.parametrize('rmInSurf', [True, False])
+def test_genSurfShells(rmInSurf, egAtomsEle, egAtomsXYZ, egAtomsNeighIdxs, egAtomsSurfIdxs):
+    """Validation test of genSurfShells(), which should occupy the voxels of a dense point cloud and few others."""
+    atomsRad = np.array([ATOM_RAD] * EG_XYZ_ATOM_NUM)
+    surfVoxelCodes = genSurfShells(egAtomsEle, atomsRad, egAtomsSurfIdxs, egAtomsXYZ, egAtomsNeighIdxs, 'example',
+                                   numCPUs=1, gridNum=64, rmInSurf=rmInSurf)
+    atomsNeighIdxs, surfNeighEnds = splitSurfNeighs(egAtomsNeighIdxs, egAtomsSurfIdxs)
+    atomsSurfFrames = calcSurfFrames(egAtomsXYZ, atomsNeighIdxs, surfNeighEnds)
+    surfXYZs = egAtomsXYZ[egAtomsSurfIdxs]
+    cornerXYZ, voxelsPerLen = voxelFrame(surfXYZs.min(axis=0) - ATOM_RAD, surfXYZs.max(axis=0) + ATOM_RAD, 64)
+    # The points are voxelised on the grid of the shells, in batches of atoms to bound the memory used
+    spherePoints, pointVoxelCodes = fibonacciSphere(100000, ATOM_RAD)[None], []
+    for atomsIdxs in np.array_split(egAtomsSurfIdxs, 16):
+        surfPointXYZs, _ = pointsOnAtoms((atomsIdxs, np.zeros(len(atomsIdxs), dtype=np.int64), spherePoints, atomsRad,
+                                          egAtomsXYZ, atomsNeighIdxs, surfNeighEnds, atomsSurfFrames, rmInSurf))
+        pointVoxelCodes.append(encodeMorton(np.clip(np.floor((surfPointXYZs - cornerXYZ) * voxelsPerLen), 0, 63)))
+    pointVoxelCodes = np.unique(np.concatenate(pointVoxelCodes))
+    assert np.isin(pointVoxelCodes, surfVoxelCodes).all(), 'Voxels of the point cloud missed'
+    assert len(surfVoxelCodes) - len(pointVoxelCodes) < 0.025 * len(surfVoxelCodes), 'Voxels missed by the point cloud found'
+
+
+@mark.parametrize('gridSize', [16, 64])
+def test_voxelsBoxCnts(gridSize):
+    """Unit test of voxelsBoxCnts(), which should count the same boxes as coarsening the voxels directly."""
+    voxelXYZs = np.random.default_rng(0).integers(0, gridSize, (500, 3))
+    boxLensAct, countsAct = voxelsBoxCnts(np.unique(encodeMorton(voxelXYZs)), gridSize)
+    assert boxLensAct.tolist() == [2**i for i in range(1, int(np.log2(gridSize)))], 'Incorrect box lengths'
+    for (boxLen, count) in zip(boxLensAct, countsAct):
+        assert count == len(np.unique(voxelXYZs // boxLen, axis=0)), 'Incorrect box counts'
+
+
+def test_exactBoxCntsPeriodic(egSlabXYZ):
+    """Unit test of exactBoxCnts() on a periodic slab, which lacks the side surfaces of its non-periodic counterpart."""
+    periodicStruct = Structure(['Pd']*len(egSlabXYZ), egSlabXYZ, cellVecs=SLAB_CELL_VECS, pbc=(True, True, False))
+    atomsEle, _, atomsSurfIdxs, atomsXYZ, _ = periodicStruct.engineInps()
+    assert len(atomsEle) > len(periodicStruct) and len(atomsSurfIdxs) > 64, 'Periodic images not included'
+    assert periodicStruct.engineInps()[3] is atomsXYZ, 'Periodic images not memoised'
+    _, countsPeriodic = exactBoxCnts(periodicStruct, outDir='tests/outputs', numCPUs=1, numBoxLen=3, writeBox=False)
+    _, countsNonPeriodic = exactBoxCnts(Structure(['Pd']*len(egSlabXYZ), egSlabXYZ), outDir='tests/outputs', numCPUs=1,
+                                        numBoxLen=3, writeBox=False)
+    assert all(countPeriodic < countNonPeriodic for (countPeriodic, countNonPeriodic) in zip(countsPeriodic, countsNonPeriodic)), 'Side surfaces counted'
+    if isdir('./tests/outputs'):
+        rmtree('./tests/outputs')
+
+
+def test_runBoxCnt(egVoxelBoxCntDims, egExactBoxCntDims):
+    """Unit and regression test of runBoxCnt()."""
+    boxCntDimsAct = runBoxCnt(getExampleDataPath(), outDir='tests/outputs', numPoints=300, vis=False, writeBox=False)
+    assert boxCntDimsAct[:2] == approx(egVoxelBoxCntDims[:2]), 'Incorrect R2 and D_Box for point clouds representation'
+    assert boxCntDimsAct[2] == approx(egVoxelBoxCntDims[2]), 'Incorrect confidence interval for point clouds representation'
+    assert boxCntDimsAct[-4:-2] == approx(egExactBoxCntDims[:2]), 'Incorrect R2 and D_Box for exact surface representation'
+    assert boxCntDimsAct[-2] == approx(egExactBoxCntDims[2]), 'Incorrect confidence interval for exact surface representation'
+    if isdir('./tests/outputs'):
+        rmtree('./tests/outputs')
+
 
+def test_runBoxCntTraj(egTrajPath, egExactBoxCntDims):
+    """Unit test of runBoxCntTraj(), translated frames should have identical box-counting dimensions."""
+    numFrames = 0
+    for (frameIdx, boxCntDimsAct) in runBoxCntTraj(egTrajPath, voxelSurf=False, vis=False, writeBox=False, numCPUs=1):
+        assert boxCntDimsAct[-4:-2] == approx(egExactBoxCntDims[:2]), 'Incorrect R2 and D_Box for exact surface representation'
+        assert boxCntDimsAct[-2] == approx(egExactBoxCntDims[2]), 'Incorrect confidence interval for exact surface representation'
+        numFrames += 1
+    assert numFrames == 2, 'Incorrect number of frames'